@@ -1,13 +1,10 @@
 from __future__ import annotations
 import asyncio
 import logging
-from psycopg2 import sql
-import psycopg2
 from dotenv import load_dotenv
 import json
 import os
-from time import perf_counter
-from typing import Annotated
+from typing import Annotated, Optional
 from livekit import rtc, api
 from livekit.agents import (
     AutoSubscribe,
@@ -18,76 +15,18 @@ from livekit.agents import (
     llm,
 )
 from datetime import datetime
-from call_agent import resolve_db
+from call_agent import retrieve_db, format_passages, load_knowledge_base, warm_up_embeddings
+from agent_db import AgentDatabase, CALL_OUTCOME_CHANNEL
+from transcript_capture import TranscriptRecorder
+from call_metrics import CallMetricsRecorder
+from call_monitor import CallMonitor, ANSWERED, NO_ANSWER
+from tts_cache import CachedTTS, PhraseAudioCache, FIXED_PHRASES, HOLD_PHRASE, CLOSING_PHRASE, GREETING_PREFIX, greeting
 from livekit.agents.multimodal import MultimodalAgent
-from livekit.agents.pipeline import VoicePipelineAgent
+from livekit.agents.pipeline import AgentCallContext, VoicePipelineAgent
 from livekit.plugins import deepgram, openai, silero
 from livekit.plugins.openai import stt
 from livekit.plugins.deepgram import tts
-from whatsapp import send_whatsapp
 # from livekit.plugins.elevenlabs import tts
-class DatabaseManager:
-    def __init__(self):
-        load_dotenv(".env.local")
-        
-        # Retrieve database connection parameters from environment
-        self.connection_params = {
-            "dbname": os.getenv("DB_NAME"),
-            "user": os.getenv("DB_USER"),
-            "password": os.getenv("DB_PASSWORD"),
-            "host": os.getenv("DB_HOST"),
-            "port": os.getenv("DB_PORT"),
-        }
-        self.connection = None
-
-    def connect(self):
-        """Establish a connection to the database."""
-        if self.connection is None:
-            self.connection = psycopg2.connect(**self.connection_params)
-        return self.connection.cursor()
-
-    def get_complaint_details(self, phone_number: str) -> dict:
-        """Fetch the complaint details from the database using the phone number."""
-        cursor = self.connect()
-        query = sql.SQL("SELECT customer_name, complaint_description ,knowledge_base_solution, created_at FROM complaints WHERE customer_phone_number = %s")
-        cursor.execute(query, (phone_number,))
-        result = cursor.fetchone()
-
-        if result:
-            name, complaint,solution, complaint_time = result
-            return {"name": name, "complaint": complaint, "solution":solution,"time": complaint_time}
-        else:
-            return {"name": "Unknown", "complaint": "No complaint found", "time": "Unknown"}
-    def update_complaint_status(self, phone_number: str, status: str,complaint_description:str):
-        """Update the complaint status from 'pending' to 'resolved'."""
-        cursor = self.connect()
-        query = sql.SQL("UPDATE complaints SET status = %s WHERE customer_phone_number = %s and complaint_description = %s")
-        cursor.execute(query, (status, phone_number,complaint_description))
-        self.connection.commit()
-        logger.info(f"Complaint status for {phone_number} updated to {status}")
-
-    def close(self):
-        """Close the database connection."""
-        if self.connection:
-            self.connection.close()
-    def get_solution(self,phone_number):
-        try:
-            cursor=self.connect()
-            sql_command = "SELECT knowledge_base_solution FROM your_table_name WHERE customer_phone_number = %s"
-
-        # Execute the SQL command with the phone number as a parameter
-            cursor.execute(sql_command, (phone_number,))
-
-            # Fetch the result (assuming there's only one result)
-            solution = cursor.fetchone()
-            return solution
-        except Exception as e:
-            print("Error fetching solution for phone number {}: {}".format(phone_number, e))
-        
-
-
-# Initialize DatabaseManager
-db_manager = DatabaseManager()
 
 
 # load environment variables, this is optional, only used for local development
@@ -110,17 +49,28 @@ async def entrypoint(ctx: JobContext):
     # the phone number to dial is provided in the job metadata
     phone_number = ctx.job.metadata
     logger.info(f"dialing {phone_number} to room {ctx.room.name}")
-    complaint_details = db_manager.get_complaint_details(phone_number)
+
+    # the transcript is captured from speech events, not dictated by the LLM
+    recorder = TranscriptRecorder(ctx.proc.userdata["db"], phone_number)
+    ctx.add_shutdown_callback(recorder.close)
+
+    # per-turn STT/LLM/TTS/tool latency, aggregated into call_metrics at the end of the call
+    call_metrics = CallMetricsRecorder(ctx.proc.userdata["db"], ctx.room.name, phone_number)
+    ctx.add_shutdown_callback(call_metrics.close)
+
+    complaint_details = await ctx.proc.userdata["db"].get_complaint_details(phone_number)
     print(f"the name  of the user is {complaint_details['name']}")
     instructions = (
         f"You are a BPO client complaint resolver agent for a broadband company called Bharat Telecom. Your interface with the user will be voice. "
         f"You have to talk in fluent English"
         f"The customer's name is {complaint_details['name']}. the complaint is {complaint_details['complaint']}. the time of the complaint is {complaint_details['time']}.Resolve their complaint and provide assistance as needed."
         f"the Initial Solution provided by the database is {complaint_details['solution']}."
-        f"if user asks for questions whose answer is not mentioned in the initial solution use read knowledge base function tool  to get entire knowledge base and before searching tell him to please wait "
+        "The call opens with a greeting that has already introduced you and the complaint, so after the user replies tell them the solution "
+        f"if user asks for questions whose answer is not mentioned in the initial solution use read knowledge base function tool  to get entire knowledge base "
         "provide this solution and listen to their queries"
         f"use function calling to get solution during conversation realtime from the knowledge base"
         f"U should only end the call if the user tells u to or u feel that the conversation has ended"
+        f"Before ending the call say exactly: '{CLOSING_PHRASE}' "
       
     
         f"Dont speak the things about the function calling and the output ur getting from it "     
@@ -130,44 +80,60 @@ async def entrypoint(ctx: JobContext):
         instructions
     )
 
+    monitor: Optional[CallMonitor] = None
+
+    async def publish_call_outcome():
+        # lets callback_dispatcher release the call slot and record the outcome;
+        # registered before dialing so a failed dial is reported too
+        await ctx.proc.userdata["db"].notify(CALL_OUTCOME_CHANNEL, json.dumps({
+            "room": ctx.room.name,
+            "phone_number": phone_number,
+            "outcome": (monitor.outcome if monitor is not None else None) or NO_ANSWER,
+        }))
+
+    ctx.add_shutdown_callback(publish_call_outcome)
+
     # `create_sip_participant` starts dialing the user
-    await ctx.api.sip.create_sip_participant(
-        api.CreateSIPParticipantRequest(
-            room_name=ctx.room.name,
-            sip_trunk_id=outbound_trunk_id,
-            sip_call_to=phone_number,
-            participant_identity=user_identity,
+    try:
+        await ctx.api.sip.create_sip_participant(
+            api.CreateSIPParticipantRequest(
+                room_name=ctx.room.name,
+                sip_trunk_id=outbound_trunk_id,
+                sip_call_to=phone_number,
+                participant_identity=user_identity,
+            )
         )
-    )
+        # a participant is created as soon as we start dialing
+        participant = await ctx.wait_for_participant(identity=user_identity)
+    except Exception as e:
+        logger.error(f"could not dial {phone_number}: {e}")
+        ctx.shutdown(reason="dial failed")
+        return
+    monitor = CallMonitor(ctx.room, participant)
 
-    # a participant is created as soon as we start dialing
-    participant = await ctx.wait_for_participant(identity=user_identity)
+    async def log_call_summary():
+        logger.info(f"call summary for {phone_number}: {monitor.summary()} "
+                    f"tts cache: {ctx.proc.userdata['tts_cache'].stats()}")
+
+    ctx.add_shutdown_callback(log_call_summary)
 
     # start the agent, either a VoicePipelineAgent or MultimodalAgent
     # this can be started before the user picks up. The agent will only start
     # speaking once the user answers the call.
     # run_voice_pipeline_agent(ctx, participant, instructions)
-    run_voice_pipeline_agent(ctx, participant, instructions)
-
-    # in addition, you can monitor the call status separately
-    start_time = perf_counter()
-    while perf_counter() - start_time < 30:
-        call_status = participant.attributes.get("sip.callStatus")
-        if call_status == "active":
-            logger.info("user has picked up")
-            return
-        elif call_status == "automation":
-            # if DTMF is used in the `sip_call_to` number, typically used to dial
-            # an extension or enter a PIN.
-            # during DTMF dialing, the participant will be in the "automation" state
-            pass
-        elif call_status == "hangup":
-            # user hung up, we'll exit the job
-            logger.info("user hung up, exiting job")
-            break
-        await asyncio.sleep(0.1)
-
-    logger.info("session timed out, exiting job")
+    agent = run_voice_pipeline_agent(ctx, participant, instructions, recorder, monitor, call_metrics)
+
+    # in addition, monitor the call status through participant events;
+    # DTMF dialing ("automation") simply keeps waiting
+    outcome = await monitor.wait_for_outcome()
+    if outcome == ANSWERED:
+        logger.info("user has picked up")
+        # the opening sentence plays from the cache while the personalised part is synthesized
+        await agent.say(GREETING_PREFIX, allow_interruptions=True)
+        await agent.say(greeting(complaint_details['name'], complaint_details['complaint']), allow_interruptions=True)
+        return
+
+    logger.info(f"call not answered ({outcome}), exiting job")
     ctx.shutdown()
 
 
@@ -177,13 +143,16 @@ class CallActions(llm.FunctionContext):
     """
 
     def __init__(
-        self, *, api: api.LiveKitAPI, participant: rtc.RemoteParticipant, room: rtc.Room
+        self, *, api: api.LiveKitAPI, participant: rtc.RemoteParticipant, room: rtc.Room,
+        db: AgentDatabase, knowledge_base=None
     ):
         super().__init__()
 
         self.api = api
         self.participant = participant
         self.room = room
+        self.db = db
+        self.knowledge_base = knowledge_base
 
     async def hangup(self):
         try:
@@ -207,13 +176,13 @@ class CallActions(llm.FunctionContext):
     async def resolve_complaint(self, complaint: Annotated[str, "Call this function to update the status of the complaint of the user "]):
         """Called to resolve a user's complaint by providing relevant information."""
         phone_number = self.participant.identity 
-        complaint_details=db_manager.get_complaint_details(phone_number)
+        complaint_details = await self.db.get_complaint_details(phone_number)
         complaint_description=complaint_details['complaint']
         logger.info(f"Resolving complaint for {self.participant.identity}: {complaint}")
         
         # Update the complaint status in the database to "resolved"
          # Assuming the participant identity is the phone number
-        db_manager.update_complaint_status(phone_number, "resolved",complaint_description)
+        await self.db.update_complaint_status(phone_number, "resolved", complaint_description=complaint_description)
         
         return "Your complaint has been noted. We will resolve it promptly."
     # @llm.ai_callable()
@@ -235,11 +204,13 @@ class CallActions(llm.FunctionContext):
     async def search_knowledge_base(self, query: Annotated[str, "Query to search in the knowledge base the question user is asking on the call you want to check"]):
         """Called to search the knowledge base for user queries."""
         logger.info(f"Searching knowledge base for query: {query}")
-        
-        # Read the knowledge base from the file
-        solution = resolve_db(query)
-        # Simulate a search by checking if any knowledge base entry matches the complain
-        return str(solution)
+        # cached hold phrase covers the lookup
+        await AgentCallContext.get_current().agent.say(HOLD_PHRASE, add_to_chat_ctx=False)
+
+        # Retrieval only: the pipeline's LLM phrases the answer from the passages,
+        # so the caller waits on one generation instead of two
+        passages = await asyncio.to_thread(retrieve_db, query, knowledge_base=self.knowledge_base)
+        return format_passages(passages)
 
     @llm.ai_callable()
     async def confirm_resolution(self):
@@ -255,47 +226,27 @@ class CallActions(llm.FunctionContext):
         
         
     @llm.ai_callable()
-    async def log_conversation(
-        self, 
-        conversation_transcription: Annotated[
-            str, 
-            "Complete transcript of the conversation in chronological order. Format: 'Agent: ... | User: ...'"
-        ]
-    ):
-        """Called to permanently save the full conversation transcript before ending the call."""
-        try:
-            # Process transcript in chunks to avoid blocking
-            transcript_chunks = [
-                conversation_transcription[i:i+1000] 
-                for i in range(0, len(conversation_transcription), 1000)
-            ]
-            
-            for chunk in transcript_chunks:
-                await self._log_conversation(chunk)
-                
-            return "Conversation transcript has been securely archived."
-            
-        except Exception as e:
-            logger.error(f"Conversation logging failed: {e}")
-            return "Failed to save conversation transcript."
-          
-    @llm.ai_callable()
-    async def send_whatsapp(self):
+    async def send_whatsapp(self,confirmation_message:Annotated[str,"Confirmation message that has to be sent to the user regarding the registeration of the complaint"]):
         """Send confirmation message to the user"""
-        logger.info(f"Sending sale details to {self.participant.identity}")
-        print(self.participant.identity)
-        result=send_whatsapp(self.participant.identity)
-        if result=="success":
-            logging.info(f"the details have been sent to {self.participant.identity}")
-            return "The details have been sent to {self.participant.identity"
-        else:
-            return "could not send the details to {self.participant.identity}"
+        logger.info(f"Queueing WhatsApp details for {self.participant.identity}")
+        # queued for whatsapp_outbox.py to deliver; Twilio is never called on the audio loop
+        if await self.db.enqueue_whatsapp(self.participant.identity, confirmation_message):
+            return f"The details will be sent to {self.participant.identity} on WhatsApp shortly"
+        return f"could not send the details to {self.participant.identity}"
          
 
 def run_voice_pipeline_agent(
-    ctx: JobContext, participant: rtc.RemoteParticipant, instructions: str):
+    ctx: JobContext, participant: rtc.RemoteParticipant, instructions: str,
+    recorder: TranscriptRecorder = None, monitor: CallMonitor = None,
+    call_metrics: CallMetricsRecorder = None):
     logger.info("starting voice pipeline agent")
 
+    cached_tts = CachedTTS(tts.TTS(model="aura-asteria-en"), ctx.proc.userdata["tts_cache"])
+    # only the first job of the process gets the phrases still to render
+    missing_phrases = ctx.proc.userdata["tts_cache"].take_unrendered()
+    if missing_phrases:
+        asyncio.create_task(cached_tts.render_fixed_phrases(missing_phrases))
+
     initial_ctx = llm.ChatContext().append(
         role="system",
         text=instructions,
@@ -305,16 +256,20 @@ def run_voice_pipeline_agent(
     vad=ctx.proc.userdata["vad"],
     stt=stt.STT.with_groq(model="whisper-large-v3", language="en"),
     llm=openai.LLM.with_groq(model="llama-3.3-70b-versatile", temperature=0.8),
-    tts= tts.TTS(
-    model="aura-asteria-en",
-    
-    ),
+    tts=cached_tts,
     chat_ctx=initial_ctx,
-    
-    
+    fnc_ctx=CallActions(api=ctx.api, participant=participant, room=ctx.room,
+                        db=ctx.proc.userdata["db"], knowledge_base=ctx.proc.userdata["kb"]),
 
     )  # Closing parenthesis for VoicePipelineAgent
     agent.start(ctx.room, participant)
+    if recorder is not None:
+        recorder.attach(agent)
+    if monitor is not None:
+        monitor.track_agent(agent)
+    if call_metrics is not None:
+        call_metrics.attach(agent)
+    return agent
     
 
     # 
@@ -338,6 +293,15 @@ def run_voice_pipeline_agent(
 
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
+    # knowledge base index and chunks are loaded once per worker
+    # process so the first in-call lookup costs the same as later ones
+    proc.userdata["kb"] = load_knowledge_base()
+    warm_up_embeddings()
+    # one pool per worker process; connections open on the first job's event loop
+    proc.userdata["db"] = AgentDatabase()
+    # fixed call phrases rendered by earlier jobs load from disk; the first job renders the rest
+    proc.userdata["tts_cache"] = PhraseAudioCache(voice_id="deepgram-aura-asteria-en")
+    proc.userdata["tts_cache"].load_pinned(FIXED_PHRASES)
 
 
 if __name__ == "__main__":
@@ -3,7 +3,6 @@ import os
 import asyncio
 import logging
 import subprocess
-from datetime import datetime
 from time import perf_counter
 from dotenv import load_dotenv
 from livekit import rtc, api
@@ -17,7 +16,8 @@ from livekit.agents import (
     cli,
     llm,
 )
-from call_agent import resolve_db
+from call_agent import retrieve_db, format_passages
+from recordings import download_recording, transcode_in_background
 from typing import Annotated
 
 import subprocess
@@ -108,24 +108,18 @@ async def start_recording(room: rtc.Room):
     return recording.url
 
 async def stop_recording(room: rtc.Room, recording_url: str):
-    """Stop the recording and download the file."""
+    """Stop the recording and stream the file to disk."""
     await room.recording.stop()
-    
-    # Download the MP4 file
-    response = await api.download_file(recording_url)
-    
-    # Create recordings directory
-    os.makedirs("recordings", exist_ok=True)
-    
-    # Generate timestamped filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_path = f"recordings/call_recording_{timestamp}.mp4"
-    
-    # Save the file locally
-    with open(file_path, "wb") as f:
-        f.write(response)
-    
-    logger.info(f"Recording saved as {file_path}")
+
+    # streamed in chunks to a temp file, fsynced and renamed; never held in memory
+    recording = await download_recording(recording_url)
+
+    # optional audio-only copy, produced by a separate process
+    transcode_format = os.getenv("RECORDING_TRANSCODE_FORMAT")
+    if transcode_format:
+        transcode_in_background(recording.path, transcode_format,
+                                keep_source=os.getenv("RECORDING_KEEP_MP4", "1") == "1")
+    return recording
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
 
@@ -135,7 +129,7 @@ async def entrypoint(ctx: JobContext):
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
 
     # Start system audio recording
-    recording_info = await start_recording()
+    recording_info = await start_recording(ctx.room)
 
     user_identity = "phone_user"
     phone_number = ctx.job.metadata
@@ -178,7 +172,7 @@ async def entrypoint(ctx: JobContext):
     logger.info("Session timed out, exiting job")
     
     # Stop system audio recording
-    stop_recording(recording_info)
+    await stop_recording(ctx.room, recording_info)
     ctx.shutdown()
 class CallActions(llm.FunctionContext):
     """
@@ -231,13 +225,8 @@ class CallActions(llm.FunctionContext):
         """Called to search the knowledge base for user queries."""
         logger.info(f"Searching knowledge base for query: {query}")
         
-        # Read the knowledge base from the file
-        solution = resolve_db(query)
-        
-        # Simulate a search by checking if any knowledge base entry matches the complaint
-        
-        
-        return str(solution)
+        passages = await asyncio.to_thread(retrieve_db, query)
+        return format_passages(passages)
     
     @llm.ai_callable()
     async def confirm_resolution(self):
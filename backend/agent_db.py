@@ -0,0 +1,290 @@
+# agent_db.py
+"""
+Async database access for the LiveKit voice agents.
+
+Tool calls run on the agent's audio event loop, so they must never block on
+synchronous psycopg2 I/O. AgentDatabase wraps one asyncpg pool per worker
+process; it is created in prewarm and opens its connections lazily on the
+job's event loop, after which every tool call borrows a warm connection.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+import asyncpg
+from dotenv import load_dotenv
+
+from events import EVENT_CHANNEL, build_event_payload
+
+load_dotenv(".env.local")
+
+logger = logging.getLogger("outbound-caller")
+
+# wakes whatsapp_outbox.WhatsAppSender when a message is queued
+OUTBOX_CHANNEL = "whatsapp_outbox"
+# every outbound call's outcome, keyed by room; read by callback_dispatcher
+CALL_OUTCOME_CHANNEL = "call_outcomes"
+
+
+def connection_params_from_env() -> Dict:
+    """Same DB_* variables as DatabaseManager, in asyncpg's naming."""
+    return {
+        "database": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": int(os.getenv("DB_PORT") or 5432),
+    }
+
+
+class DBLatencyStats:
+    """Per-call record of how long each database operation took."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, operation: str, seconds: float) -> None:
+        self.samples[operation].append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            operation: {
+                "count": len(values),
+                "avg_ms": round(1000 * sum(values) / len(values), 2),
+                "max_ms": round(1000 * max(values), 2),
+            }
+            for operation, values in self.samples.items()
+        }
+
+
+class AgentDatabase:
+    def __init__(self, connection_params: Optional[Dict] = None, min_size: int = 1, max_size: int = 5):
+        self.connection_params = connection_params or connection_params_from_env()
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool: Optional[asyncpg.Pool] = None
+        self._pool_lock = asyncio.Lock()
+
+    async def pool(self) -> asyncpg.Pool:
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        **self.connection_params,
+                    )
+        return self._pool
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    @asynccontextmanager
+    async def _timed(self, operation: str, stats: Optional[DBLatencyStats]):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if stats is not None:
+                stats.record(operation, elapsed)
+            logger.debug(f"db {operation} took {elapsed * 1000:.1f} ms")
+
+    async def get_complaint_details(self, phone_number: str, stats: Optional[DBLatencyStats] = None) -> dict:
+        """Fetch the complaint details from the database using the phone number."""
+        try:
+            async with self._timed("get_complaint_details", stats):
+                pool = await self.pool()
+                row = await pool.fetchrow(
+                    """SELECT customer_name, complaint_description,
+                              knowledge_base_solution, complaint_category, created_at
+                       FROM complaints
+                       WHERE customer_phone_number = $1""",
+                    phone_number,
+                )
+        except Exception as e:
+            logger.error(f"Error fetching complaint details for {phone_number}: {e}")
+            return {"name": "Unknown", "complaint": "Connection failed", "time": "Unknown"}
+
+        if row:
+            return {"name": row["customer_name"], "complaint": row["complaint_description"],
+                    "solution": row["knowledge_base_solution"], "category": row["complaint_category"],
+                    "time": row["created_at"]}
+        return {"name": "Unknown", "complaint": "No complaint found", "time": "Unknown"}
+
+    async def update_complaint_status(self, phone_number: str, status: str,
+                                      stats: Optional[DBLatencyStats] = None,
+                                      complaint_description: Optional[str] = None) -> bool:
+        """
+        Update the status of the caller's complaints and publish the change.
+        Pass complaint_description to only update that complaint.
+        """
+        try:
+            async with self._timed("update_complaint_status", stats):
+                pool = await self.pool()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        rows = await conn.fetch(
+                            """UPDATE complaints SET status = $1
+                               WHERE customer_phone_number = $2
+                               AND ($3::text IS NULL OR complaint_description = $3)
+                               RETURNING complaint_id""",
+                            status, phone_number, complaint_description,
+                        )
+                        for row in rows:
+                            await conn.execute(
+                                "SELECT pg_notify($1, $2)", EVENT_CHANNEL,
+                                build_event_payload("complaint.status_changed",
+                                                    {"complaint_id": row["complaint_id"], "status": status}),
+                            )
+        except Exception as e:
+            logger.error(f"Error updating complaint status for {phone_number}: {e}")
+            return False
+        logger.info(f"Complaint status for {phone_number} updated to {status}")
+        return True
+
+    async def save_transcript(self, phone_number: str, transcript: str,
+                              stats: Optional[DBLatencyStats] = None) -> bool:
+        """Store a call transcript in the transcripts table."""
+        try:
+            async with self._timed("save_transcript", stats):
+                pool = await self.pool()
+                await pool.execute(
+                    "INSERT INTO transcripts (phone_number, call_transcript, called_at) VALUES ($1, $2, NOW())",
+                    phone_number, transcript,
+                )
+        except Exception as e:
+            logger.error(f"Error saving transcript for {phone_number}: {e}")
+            return False
+        return True
+
+    async def start_call(self, caller: str, receiver: str,
+                         stats: Optional[DBLatencyStats] = None) -> Optional[str]:
+        """Create a calls row for a live call and return its id."""
+        try:
+            async with self._timed("start_call", stats):
+                pool = await self.pool()
+                call_id = await pool.fetchval(
+                    "INSERT INTO calls (caller, receiver) VALUES ($1, $2) RETURNING id::text",
+                    caller, receiver,
+                )
+        except Exception as e:
+            logger.error(f"Error creating call row for {receiver}: {e}")
+            return None
+        return call_id
+
+    async def end_call(self, call_id: str, stats: Optional[DBLatencyStats] = None) -> bool:
+        try:
+            async with self._timed("end_call", stats):
+                pool = await self.pool()
+                await pool.execute("UPDATE calls SET end_time = NOW() WHERE id = $1::uuid", call_id)
+        except Exception as e:
+            logger.error(f"Error closing call {call_id}: {e}")
+            return False
+        return True
+
+    async def add_messages(self, call_id: str, messages: List[Dict],
+                           stats: Optional[DBLatencyStats] = None) -> bool:
+        """
+        Append messages to a call in one transaction, in list order.
+        Same contract as DatabaseManager.add_messages_batch: each message has
+        'sender', 'message', 'timestamp' and a 'client_message_id' that makes a
+        retried flush a no-op for rows already stored.
+        """
+        try:
+            async with self._timed("add_messages", stats):
+                pool = await self.pool()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        for m in messages:
+                            row = await conn.fetchrow(
+                                """INSERT INTO messages (call_id, sender, message, client_message_id, timestamp)
+                                   VALUES ($1::uuid, $2, $3, $4, $5)
+                                   ON CONFLICT (call_id, client_message_id) DO NOTHING
+                                   RETURNING id::text, timestamp""",
+                                call_id, m["sender"], m["message"], m["client_message_id"], m["timestamp"],
+                            )
+                            if row is None:
+                                continue
+                            await conn.execute(
+                                "SELECT pg_notify($1, $2)", EVENT_CHANNEL,
+                                build_event_payload("message.created", {
+                                    "call_id": call_id,
+                                    "message_id": row["id"],
+                                    "sender": m["sender"],
+                                    "message": m["message"],
+                                    "timestamp": row["timestamp"],
+                                }),
+                            )
+        except Exception as e:
+            logger.error(f"Error saving {len(messages)} messages for call {call_id}: {e}")
+            return False
+        return True
+
+    async def enqueue_whatsapp(self, to_number: str, body: str,
+                               stats: Optional[DBLatencyStats] = None) -> Optional[int]:
+        """
+        Queue a WhatsApp message for the outbox sender and return its id.
+        The NOTIFY wakes the sender as soon as the row is committed.
+        """
+        try:
+            async with self._timed("enqueue_whatsapp", stats):
+                pool = await self.pool()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        outbox_id = await conn.fetchval(
+                            "INSERT INTO whatsapp_outbox (to_number, body) VALUES ($1, $2) RETURNING id",
+                            to_number, body,
+                        )
+                        await conn.execute("SELECT pg_notify($1, $2)", OUTBOX_CHANNEL, str(outbox_id))
+        except Exception as e:
+            logger.error(f"Error queueing WhatsApp message for {to_number}: {e}")
+            return None
+        return outbox_id
+
+    async def add_call_metrics(self, room_name: str, phone_number: str, agent_name: str, rows: List[Dict],
+                               samples: List[Tuple[str, str, float]],
+                               stats: Optional[DBLatencyStats] = None) -> bool:
+        """
+        Store a call's per-metric latency aggregates (see call_metrics.CallMetricsRecorder.summary)
+        and its individual (metric, label, value_ms) samples, in one transaction.
+        """
+        try:
+            async with self._timed("add_call_metrics", stats):
+                pool = await self.pool()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        await conn.executemany(
+                            """INSERT INTO call_metrics
+                                   (room_name, phone_number, agent_name, metric, label,
+                                    samples, avg_ms, p50_ms, p95_ms, max_ms)
+                               VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)""",
+                            [(room_name, phone_number, agent_name, r["metric"], r["label"], r["samples"],
+                              r["avg_ms"], r["p50_ms"], r["p95_ms"], r["max_ms"]) for r in rows],
+                        )
+                        await conn.executemany(
+                            """INSERT INTO call_metric_samples (room_name, agent_name, metric, label, value_ms)
+                               VALUES ($1, $2, $3, $4, $5)""",
+                            [(room_name, agent_name, metric, label, value_ms)
+                             for metric, label, value_ms in samples],
+                        )
+        except Exception as e:
+            logger.error(f"Error saving latency metrics for {phone_number}: {e}")
+            return False
+        return True
+
+    async def notify(self, channel: str, payload: str) -> bool:
+        """Publish a NOTIFY outside any data change, e.g. a call outcome for the campaign dialer."""
+        try:
+            pool = await self.pool()
+            await pool.execute("SELECT pg_notify($1, $2)", channel, payload)
+        except Exception as e:
+            logger.error(f"Error notifying {channel}: {e}")
+            return False
+        return True
@@ -2,11 +2,15 @@
 from openai import OpenAI
 import os
 from dotenv import load_dotenv
-from typing import Tuple
-import groq
+from typing import Optional, Tuple
 import random
+import re
 import string
 
+from category_classifier import CATEGORIES, SOURCE_DEFAULT, SOURCE_LLM, SOURCE_LOCAL, load_classifier
+from llm_gateway import get_gateway
+from singleflight import SingleFlight, normalized_key
+
 load_dotenv(dotenv_path=".env.local")
 os.environ['OPENAI_API_KEY'] = os.getenv('OPENAI_API_KEY')
 os.environ['GROQ_API_KEY'] = os.getenv('GROQ_API_KEY')
@@ -14,8 +18,13 @@ os.environ['GROQ_API_KEY'] = os.getenv('GROQ_API_KEY')
 
 class ComplaintAnalyzer:
     def __init__(self):
-        self.client = groq.Groq()
+        # shared, rate-limited client with retries and provider fallback
+        self.llm = get_gateway()
         self.model = "gemma2-9b-it"
+        # local model trained by `python category_classifier.py train`; None until then
+        self.category_classifier = load_classifier()
+        # identical complaints arriving together share one LLM call per task
+        self.llm_calls = SingleFlight()
 
     def analyze_complaint(self, complaint_text: str, past_complaints: int) -> Tuple[float, float, float, float]:
         sentiment = self._analyze_sentiment(complaint_text)
@@ -24,9 +33,13 @@ class ComplaintAnalyzer:
         priority = self._calculate_priority(sentiment, urgency, politeness, past_complaints)
         return sentiment, urgency, politeness, priority
 
+    def _chat_once(self, task: str, text: str, **request) -> str:
+        """self.llm.chat, coalesced with concurrent and recent requests for the same task and text."""
+        return self.llm_calls.do((task, normalized_key(text)), self.llm.chat, **request)
+
     def _analyze_sentiment(self, text: str) -> float:
         try:
-            completion = self.client.chat.completions.create(
+            completion = self._chat_once("sentiment", text,
                 model=self.model,
                 messages=[
                     {
@@ -49,15 +62,17 @@ class ComplaintAnalyzer:
                         "role": "user",
                         "content": f"Evaluate the sentiment of this complaint:\n\n{text}"
                     }
-                ]
+                ],
+                max_tokens=8  # a single score
             )
-            return float(completion.choices[0].message.content.strip())
-        except:
+            return float(completion.strip())
+        except Exception as e:
+            print(f"Error scoring complaint, using 0.5: {e}")
             return 0.5
 
     def _evaluate_urgency(self, text: str) -> float:
         try:
-            completion = self.client.chat.completions.create(
+            completion = self._chat_once("urgency", text,
                 model=self.model,
                 messages=[
                     {
@@ -80,15 +95,17 @@ class ComplaintAnalyzer:
                         "role": "user",
                         "content": f"Evaluate the urgency of this complaint:\n\n{text}"
                     }
-                ]
+                ],
+                max_tokens=8  # a single score
             )
-            return float(completion.choices[0].message.content.strip())
-        except:
+            return float(completion.strip())
+        except Exception as e:
+            print(f"Error scoring complaint, using 0.5: {e}")
             return 0.5
 
     def _assess_politeness(self, text: str) -> float:
         try:
-            completion = self.client.chat.completions.create(
+            completion = self._chat_once("politeness", text,
                 model=self.model,
                 messages=[
                     {
@@ -110,47 +127,67 @@ class ComplaintAnalyzer:
                         "role": "user",
                         "content": f"Evaluate the politeness of this complaint:\n\n{text}"
                     }
-                ]
+                ],
+                max_tokens=8  # a single score
             )
-            return float(completion.choices[0].message.content.strip())
-        except:
+            return float(completion.strip())
+        except Exception as e:
+            print(f"Error scoring complaint, using 0.5: {e}")
             return 0.5
 
-    def get_complaint_category(self, complaint: str):
-        response = self.client.chat.completions.create(
-            model=self.model,  # Ensure the model name is correct
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are given a task to categorize the complaints of a Broadband company Customer Care into: \n"
-                        "1. Technical Support: return 0\n"
-                        "2. Billing: return 1\n"
-                        "3. New Connection: return 2\n"
-                        "4. Added Service and Bundle offers: return 3\n"
-                        "Return only the number corresponding to the category. "
-                        "If I get anything else, I will terminate you."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": complaint  # Use complaint as a string, not inside {}
-                }
-            ],
-            temperature=0.7,
-            max_tokens=5  # Limit response length as we need only a number
-        )
+    def get_complaint_category(self, complaint: str) -> str:
+        return self.classify_complaint(complaint)[0]
+
+    def classify_complaint(self, complaint: str) -> Tuple[str, str]:
+        """
+        (category, source). Answers from the local classifier when it is
+        confident and asks the LLM only otherwise. Always returns one of
+        CATEGORIES: an unusable LLM reply falls back to the local guess, then
+        to Technical Support. The source is stored with the complaint so the
+        classifier is only retrained on LLM and human labels.
+        """
+        prediction = self.category_classifier.predict(complaint) if self.category_classifier else None
+        if self.category_classifier and self.category_classifier.is_confident(prediction):
+            return prediction.label, SOURCE_LOCAL
+        category = self._llm_category(complaint)
+        if category is not None:
+            return category, SOURCE_LLM
+        if prediction:
+            return prediction.label, SOURCE_LOCAL
+        return CATEGORIES[0], SOURCE_DEFAULT
+
+    def _llm_category(self, complaint: str) -> Optional[str]:
+        try:
+            response = self._chat_once("category", complaint,
+                model=self.model,  # Ensure the model name is correct
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "You are given a task to categorize the complaints of a Broadband company Customer Care into: \n"
+                            "1. Technical Support: return 0\n"
+                            "2. Billing: return 1\n"
+                            "3. New Connection: return 2\n"
+                            "4. Added Service and Bundle offers: return 3\n"
+                            "Return only the number corresponding to the category. "
+                            "If I get anything else, I will terminate you."
+                        )
+                    },
+                    {
+                        "role": "user",
+                        "content": complaint  # Use complaint as a string, not inside {}
+                    }
+                ],
+                temperature=0,
+                max_tokens=5  # Limit response length as we need only a number
+            )
+            result = response.strip()
+        except Exception as e:
+            print(f"Error categorizing complaint: {e}")
+            return None
 
-        result = response.choices[0].message.content.strip()
-        if result == "0":
-            result = "Technical Support"
-        elif result == "1":
-            result = "Billing"
-        elif result == "2":
-            result = "New Connection"
-        elif result == "3":
-            result = "Added Service and Bundle offers"
-        return result
+        match = re.search(r"[0-3]", result)
+        return CATEGORIES[int(match.group())] if match else None
 
     def _calculate_priority(self, sentiment: float, urgency: float, politeness: float, past_complaints: int) -> float:
         # Adjust weights for better differentiation
@@ -199,7 +236,7 @@ Output format:
 (e.g., "3,TICKET1234" or "0,LASTTICKET1234")
 """
             # Call the LLM with the generated prompt
-            completion = self.client.chat.completions.create(
+            completion = self.llm.chat(
                 model=self.model,
                 messages=[
                     {
@@ -210,11 +247,12 @@ Output format:
                         "role": "user", 
                         "content": f"Count how many complaints are similar to the reference complaint. Complaint Descriptions: \n\n{descriptions}\n\nTicket IDs: {past_ticket_ids}"
                     }
-                ]
+                ],
+                max_tokens=64  # a count and one ticket id
             )
 
             # Extract and parse the LLM response
-            response = completion.choices[0].message.content.strip()
+            response = completion.strip()
             count, first_ticket_id = response.split(',')
 
             # Return the count and first ticket ID as a list
@@ -7,6 +7,7 @@ import pandas as pd
 import time
 from styles import load_css
 from call_agent import resolve
+from dispatcher import DispatchError
 from datetime import datetime, timedelta
 import calendar
 
@@ -181,26 +182,26 @@ def admin_interface():
         with col3:
             search = st.text_input("Search", placeholder="Search by name or description...")
 
-        # Get complaints from database
-        df = db.get_complaints()
+        if search:
+            # Ranked full-text search with the filters applied in SQL
+            df, total = db.search_complaints(search, status_filter, priority_filter)
+            if total > len(df):
+                st.caption(f"Showing the {len(df)} best of {total} matches; refine the search to narrow them down.")
+        else:
+            # Get complaints from database
+            df = db.get_complaints()
 
-        # Apply filters
-        if status_filter != "All":
-            df = df[df['status'].str.lower() == status_filter.lower()]
+            # Apply filters
+            if status_filter != "All":
+                df = df[df['status'].str.lower() == status_filter.lower()]
 
-        if priority_filter != "All":
-            if priority_filter == "High":
-                df = df[df['priority_score'] >= 0.7]
-            elif priority_filter == "Medium":
-                df = df[(df['priority_score'] >= 0.4) & (df['priority_score'] < 0.7)]
-            else:
-                df = df[df['priority_score'] < 0.4]
-
-        if search:
-            df = df[
-                df['customer_name'].str.contains(search, case=False) |
-                df['complaint_description'].str.contains(search, case=False)
-            ]
+            if priority_filter != "All":
+                if priority_filter == "High":
+                    df = df[df['priority_score'] >= 0.7]
+                elif priority_filter == "Medium":
+                    df = df[(df['priority_score'] >= 0.4) & (df['priority_score'] < 0.7)]
+                else:
+                    df = df[df['priority_score'] < 0.4]
 
         # Display complaints
         for _, row in df.iterrows():
@@ -220,11 +221,15 @@ def admin_interface():
                 with col1:
                     if row['status'] != 'resolved':
                         if st.button("Resolve", key=f"resolve_{row['complaint_id']}"):
-                            resolve(row['customer_phone_number'],row['complaint_description'])
-                            if db.resolve_complaint(row['complaint_id']):
-                                st.success("Complaint resolved successfully!")
-                                time.sleep(1)
-                                st.experimental_rerun()
+                            try:
+                                resolve(row['customer_phone_number'],row['complaint_description'])
+                            except DispatchError as e:
+                                st.error(f"Could not start the call: {e}")
+                            else:
+                                if db.resolve_complaint(row['complaint_id']):
+                                    st.success("Complaint resolved successfully!")
+                                    time.sleep(1)
+                                    st.experimental_rerun()
                 
                 with col2:
                     if row['status'] != 'resolved':
@@ -0,0 +1,217 @@
+# bm25.py
+"""
+Local BM25 keyword index over the knowledge base chunks.
+
+Built from the same chunks as the FAISS index and saved next to it, so a
+keyword-style question ("router reset", "bill dispute") can be answered
+without the remote embedding call. call_agent fuses its ranking with the
+vector ranking (reciprocal rank fusion) and skips the embedding entirely when
+the lexical match is unambiguous.
+
+The index is stored as flat numpy arrays (sorted terms, per-term posting
+offsets, posting doc ids and term frequencies, document lengths) and loaded
+memory-mapped like the chunk store, so workers share it through the page
+cache instead of each unpickling the postings into Python objects.
+"""
+import json
+import math
+import os
+import re
+import shutil
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its me my
+no not of on or our so than that the their then there these this to was we what when
+where which who why will with you your
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# bumped whenever tokenize() changes, so indexes and models built with the old tokens are rebuilt
+TOKENIZER_VERSION = 2
+
+
+def _stem(token: str) -> str:
+    # light suffix stripping so "resetting"/"reset", "routers"/"router" and
+    # "disputes"/"disputed"/"dispute" meet
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 6 and token.endswith("ing"):
+        token = token[:-3]
+    elif len(token) > 5 and token.endswith("ed"):
+        token = token[:-2]
+    elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        token = token[:-1]
+    # a silent final e, so the -e form meets the stem left by -ed/-ing
+    if len(token) > 3 and token.endswith("e"):
+        token = token[:-1]
+    if len(token) > 4 and token[-1] == token[-2]:
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(t) for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+
+# terms are stored as fixed-width bytes; the tokenizer only emits ASCII
+MAX_TERM_BYTES = 32
+_ARRAYS = ("terms", "idf", "offsets", "doc_ids", "term_freqs", "doc_lengths")
+_META_FILE = "meta.json"
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # sorted terms; the postings of term i are [offsets[i], offsets[i + 1]) in doc_ids/term_freqs
+        self.terms = np.zeros(0, dtype=f"S{MAX_TERM_BYTES}")
+        self.idf = np.zeros(0, dtype=np.float64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.term_freqs = np.zeros(0, dtype=np.int32)
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+        self.avg_length = 0.0
+        # kb_index.chunk_store_hash of the chunks the index was built from
+        self.source_hash: Optional[str] = None
+        self.tokenizer_version = TOKENIZER_VERSION
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        index = cls(k1, b)
+        postings = defaultdict(list)
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            terms = tokenize(text)
+            doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings[_term_key(term)].append((doc_id, tf))
+        # truncated terms can collide; merge their postings per document
+        terms = sorted(postings)
+        n = len(doc_lengths)
+        offsets, doc_ids, term_freqs, idf = [0], [], [], []
+        for term in terms:
+            merged = Counter()
+            for doc_id, tf in postings[term]:
+                merged[doc_id] += tf
+            for doc_id in sorted(merged):
+                doc_ids.append(doc_id)
+                term_freqs.append(merged[doc_id])
+            offsets.append(len(doc_ids))
+            idf.append(math.log(1 + (n - len(merged) + 0.5) / (len(merged) + 0.5)))
+        index.terms = np.asarray(terms, dtype=f"S{MAX_TERM_BYTES}")
+        index.idf = np.asarray(idf, dtype=np.float64)
+        index.offsets = np.asarray(offsets, dtype=np.int64)
+        index.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        index.term_freqs = np.asarray(term_freqs, dtype=np.int32)
+        index.doc_lengths = np.asarray(doc_lengths, dtype=np.int32)
+        index.avg_length = sum(doc_lengths) / n if n else 0.0
+        return index
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def _term_id(self, term: str) -> Optional[int]:
+        key = _term_key(term)
+        i = int(np.searchsorted(self.terms, key))
+        if i < len(self.terms) and self.terms[i] == key:
+            return i
+        return None
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_ids[start:end], self.term_freqs[start:end]
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """Returns (doc_id, score) pairs, best first; documents sharing no term are left out."""
+        docs, scores = [], []
+        for term in set(tokenize(query)):
+            term_id = self._term_id(term)
+            if term_id is None:
+                continue
+            doc_ids, tfs = self._postings(term_id)
+            tfs = tfs.astype(np.float64)
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_ids] / self.avg_length)
+            docs.append(doc_ids)
+            scores.append(self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + norm))
+        if not docs:
+            return []
+        unique, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        best = np.argsort(-totals, kind="stable")[:top_k]
+        return [(int(unique[i]), float(totals[i])) for i in best]
+
+    def coverage(self, query: str, doc_id: int) -> float:
+        """Share of the query's idf weight that appears in the document (1.0 = every known term)."""
+        term_ids = {t for t in map(self._term_id, tokenize(query)) if t is not None}
+        total = sum(float(self.idf[t]) for t in term_ids)
+        if not total:
+            return 0.0
+        matched = 0.0
+        for t in term_ids:
+            doc_ids, _ = self._postings(t)
+            i = int(np.searchsorted(doc_ids, doc_id))
+            if i < len(doc_ids) and doc_ids[i] == doc_id:
+                matched += float(self.idf[t])
+        return matched / total
+
+    def is_confident(self, query: str, results: List[Tuple[int, float]],
+                     max_terms: int = 4, min_margin: float = 1.25) -> bool:
+        """
+        True for short keyword queries whose terms are all known, all found in
+        the top document, and whose top score clearly beats the runner-up.
+        """
+        terms = set(tokenize(query))
+        if not results or not terms or len(terms) > max_terms:
+            return False
+        if any(self._term_id(t) is None for t in terms) or self.coverage(query, results[0][0]) < 1.0:
+            return False
+        return len(results) == 1 or results[0][1] >= min_margin * results[1][1]
+
+    def save(self, path: str) -> None:
+        """Writes the arrays and metadata into the directory `path`, replacing it whole."""
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_path, _META_FILE), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "avg_length": self.avg_length,
+                       "source_hash": self.source_hash, "tokenizer_version": self.tokenizer_version}, f)
+        # a directory cannot be replaced in one rename; move the old one aside first.
+        # Workers that have it mapped keep reading the unlinked files.
+        old_path = f"{path}.old-{os.getpid()}"
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Opens an index written by save, with its arrays memory-mapped."""
+        index = cls()
+        with open(os.path.join(path, _META_FILE)) as f:
+            meta = json.load(f)
+        index.k1, index.b, index.avg_length = meta["k1"], meta["b"], meta["avg_length"]
+        index.source_hash = meta.get("source_hash")
+        index.tokenizer_version = meta.get("tokenizer_version", 1)
+        for name in _ARRAYS:
+            setattr(index, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        return index
+
+
+def _term_key(term: str) -> bytes:
+    return term.encode("utf-8")[:MAX_TERM_BYTES]
+
+
+def reciprocal_rank_fusion(*rankings: List[int], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuses ranked id lists; ids ranked high in several lists come first."""
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
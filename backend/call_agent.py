@@ -1,18 +1,62 @@
 import os
-import faiss
+import threading
+from collections import OrderedDict
 import numpy as np
 import pickle
+from collections import namedtuple
 import google.generativeai as genai
-from groq import Groq
 from dotenv import load_dotenv
 from database import DatabaseManager
+from dispatcher import dispatch_call
+from bm25 import TOKENIZER_VERSION, BM25Index, reciprocal_rank_fusion
+from llm_gateway import get_gateway
+from singleflight import SingleFlight, normalized_key
+from token_count import count_tokens, truncate_tokens
+from kb_index import INDEX_FACTORY, INDEX_FILE, CHUNKS_FILE, ChunkStore, chunk_store_hash, build_index, read_index, write_chunk_store, write_index
 
 # Load environment variables
 load_dotenv()
 genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
 database = DatabaseManager()
 
-def create_and_persist_index(data_path, persist_dir):
+PERSIST_DIR = './STORAGE'
+DATA_PATH = './data/knowledge_base.txt'
+# Per-domain knowledge bases: ./data/knowledge_bases/<domain>.txt, indexed under
+# ./STORAGE/kb/<domain>. Domains without a file fall back to the shared KB above.
+DOMAIN_DATA_DIR = './data/knowledge_bases'
+DOMAIN_PERSIST_DIR = './STORAGE/kb'
+# ComplaintAnalyzer.get_complaint_category labels -> domain
+CATEGORY_DOMAINS = {
+    "Technical Support": "technical_support",
+    "Billing": "billing",
+    "New Connection": "new_connection",
+    "Added Service and Bundle offers": "added_services",
+}
+MAX_OPEN_KNOWLEDGE_BASES = int(os.getenv("KB_MAX_OPEN", "4"))
+EMBEDDING_MODEL = "models/embedding-001"
+# Retrieval-only lookups hand passages straight to the caller's LLM; keep them
+# short enough that they do not noticeably slow its next turn
+RETRIEVAL_TOP_K = 3
+RETRIEVAL_TOKEN_BUDGET = 400
+# "hybrid" fuses BM25 and vector rankings, "lexical" never calls the embedding API,
+# "vector" is embedding search alone
+RETRIEVAL_MODE = os.getenv("KB_RETRIEVAL_MODE", "hybrid")
+# hybrid lookups fall back to the BM25 ranking if the embedding API is slower than this
+EMBEDDING_TIMEOUT = float(os.getenv("KB_EMBEDDING_TIMEOUT_SECONDS", "2"))
+# each ranking contributes this many candidates to the fusion
+FUSION_CANDIDATES = 10
+# directory of memory-mapped BM25 arrays (see bm25.BM25Index.save)
+BM25_DIR = 'bm25'
+EMBEDDING_BATCH_SIZE = 100
+
+KnowledgeBase = namedtuple("KnowledgeBase", ["index", "chunks", "lexical"])
+
+# Process-wide knowledge base, loaded once and shared by every query
+_knowledge_base = None
+_resolve_calls = SingleFlight()
+_init_lock = threading.Lock()
+
+def create_and_persist_index(data_path, persist_dir, index_spec=INDEX_FACTORY):
     # Load and process documents
     with open(data_path, 'r') as f:
         text = f.read()
@@ -20,83 +64,278 @@ def create_and_persist_index(data_path, persist_dir):
     # Simple text splitting (modify as needed)
     chunks = [chunk for chunk in text.split('\n\n') if chunk.strip()]
     
-    # Generate embeddings
+    # Generate embeddings, EMBEDDING_BATCH_SIZE chunks per request
     embeddings = []
-    for chunk in chunks:
+    for start in range(0, len(chunks), EMBEDDING_BATCH_SIZE):
         response = genai.embed_content(
-            model="models/embedding-001",
-            content=chunk
+            model=EMBEDDING_MODEL,
+            content=chunks[start:start + EMBEDDING_BATCH_SIZE]
         )
-        embeddings.append(response['embedding'])
+        embeddings.extend(response['embedding'])
     
     # Convert to numpy array
     embeddings_np = np.array(embeddings).astype('float32')
     
-    # Create FAISS index
-    dimension = embeddings_np.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings_np)
+    # Create FAISS index (type from KB_INDEX_FACTORY, trained if needed)
+    index = build_index(embeddings_np, index_spec)
     
     # Create storage directory if not exists
     os.makedirs(persist_dir, exist_ok=True)
     
-    # Save index and metadata
-    faiss.write_index(index, os.path.join(persist_dir, 'faiss.index'))
-    with open(os.path.join(persist_dir, 'chunks.pkl'), 'wb') as f:
-        pickle.dump(chunks, f)
-    
-    return index, chunks
+    # Save index and chunks, then reopen them memory-mapped
+    write_index(index, persist_dir)
+    write_chunk_store(chunks, persist_dir)
+    del index, embeddings_np
+    return load_existing_index(persist_dir, rebuild_lexical=True)
+
+def load_existing_index(persist_dir, rebuild_lexical=False):
+    index = read_index(persist_dir)
+    if not os.path.exists(os.path.join(persist_dir, CHUNKS_FILE)):
+        # one-time migration of an index built before chunks.bin existed
+        with open(os.path.join(persist_dir, 'chunks.pkl'), 'rb') as f:
+            write_chunk_store(pickle.load(f), persist_dir)
+    chunks = ChunkStore(persist_dir)
+    return KnowledgeBase(index, chunks, load_lexical_index(persist_dir, chunks, rebuild=rebuild_lexical))
+
+def load_lexical_index(persist_dir, chunks, rebuild=False):
+    """
+    Loads the saved BM25 index, rebuilding it if it is missing, was built
+    from different chunks (its recorded chunk store hash does not match) or
+    with an older tokenizer.
+    """
+    path = os.path.join(persist_dir, BM25_DIR)
+    source_hash = chunk_store_hash(persist_dir)
+    if not rebuild:
+        try:
+            lexical = BM25Index.load(path)
+            if lexical.source_hash == source_hash and lexical.tokenizer_version == TOKENIZER_VERSION:
+                return lexical
+        except (OSError, ValueError, KeyError):
+            pass
+    lexical = BM25Index.build(chunks)
+    lexical.source_hash = source_hash
+    lexical.save(path)
+    # pickled index from before the array layout
+    legacy_path = os.path.join(persist_dir, 'bm25.pkl')
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+    return BM25Index.load(path)
+
+def load_knowledge_base(persist_dir=PERSIST_DIR, data_path=DATA_PATH):
+    """Returns the KnowledgeBase (index, chunks, lexical), reading it from disk only on the first call."""
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _init_lock:
+            if _knowledge_base is None:
+                try:
+                    _knowledge_base = load_existing_index(persist_dir)
+                    print("Loaded existing index.")
+                except Exception as e:
+                    print(f"Index load failed: {e}. Creating new index.")
+                    _knowledge_base = create_and_persist_index(data_path, persist_dir)
+    return _knowledge_base
+
+class KnowledgeBaseRegistry:
+    """
+    Per-domain knowledge bases, opened on first use and kept in an LRU of at
+    most `max_open`. An evicted KB is only dropped from the registry; a query
+    still holding it finishes normally and the memory maps close once it is
+    garbage collected.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_KNOWLEDGE_BASES, data_dir=DOMAIN_DATA_DIR, persist_dir=DOMAIN_PERSIST_DIR):
+        self.max_open = max_open
+        self.data_dir = data_dir
+        self.persist_dir = persist_dir
+        self._open = OrderedDict()
+        # guards the LRU only; loads run outside it
+        self._lock = threading.Lock()
+        # one load per domain at a time, so two queries never build the same
+        # index while lookups in other domains carry on
+        self._loads = SingleFlight(ttl=0)
 
-def load_existing_index(persist_dir):
-    index = faiss.read_index(os.path.join(persist_dir, 'faiss.index'))
-    with open(os.path.join(persist_dir, 'chunks.pkl'), 'rb') as f:
-        chunks = pickle.load(f)
-    return index, chunks
+    def has_domain(self, domain):
+        return bool(domain) and (
+            os.path.exists(os.path.join(self.data_dir, f"{domain}.txt"))
+            or os.path.exists(os.path.join(self.persist_dir, domain, INDEX_FILE))
+        )
+
+    def _cached(self, domain):
+        with self._lock:
+            knowledge_base = self._open.get(domain)
+            if knowledge_base is not None:
+                self._open.move_to_end(domain)
+            return knowledge_base
+
+    def get(self, domain):
+        return self._cached(domain) or self._loads.do(domain, self._load, domain)
+
+    def _load(self, domain):
+        # another caller may have finished loading it since our cache check
+        knowledge_base = self._cached(domain)
+        if knowledge_base is not None:
+            return knowledge_base
+        persist_dir = os.path.join(self.persist_dir, domain)
+        try:
+            knowledge_base = load_existing_index(persist_dir)
+        except Exception as e:
+            print(f"Index load for {domain} failed: {e}. Creating new index.")
+            knowledge_base = create_and_persist_index(os.path.join(self.data_dir, f"{domain}.txt"), persist_dir)
+        with self._lock:
+            self._open[domain] = knowledge_base
+            self._open.move_to_end(domain)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return knowledge_base
+
+knowledge_bases = KnowledgeBaseRegistry()
+
+def knowledge_base_for(category=None, default=None):
+    """
+    The KB for a complaint category (or domain name) when one exists,
+    otherwise `default` or the shared KB.
+    """
+    domain = CATEGORY_DOMAINS.get(category, category)
+    if knowledge_bases.has_domain(domain):
+        return knowledge_bases.get(domain)
+    return default or load_knowledge_base()
+
+def warm_up_embeddings():
+    """Opens the embedding API channel ahead of the first real query."""
+    try:
+        genai.embed_content(model=EMBEDDING_MODEL, content="warm up")
+    except Exception as e:
+        print(f"Embedding warm-up failed: {e}")
 
-def query_index(query, index, chunks, top_k=3):
+def vector_search(query, index, top_k=3, timeout=None):
+    """Returns (chunk_id, distance) pairs for the query, nearest first."""
     # Generate query embedding
     query_embedding = genai.embed_content(
-        model="models/embedding-001",
-        content=query
+        model=EMBEDDING_MODEL,
+        content=query,
+        request_options={"timeout": timeout} if timeout else None,
     )['embedding']
     
     # Convert to numpy array
     query_np = np.array([query_embedding]).astype('float32')
     
     # Search FAISS index
-    distances, indices = index.search(query_np, top_k)
-    
+    distances, indices = index.search(query_np, min(top_k, index.ntotal))
+    return [(int(i), float(d)) for i, d in zip(indices[0], distances[0]) if i != -1]
+
+def search_index(query, index, chunks, top_k=3):
+    """Returns (chunk, distance) pairs for the query, nearest first."""
+    return [(chunks[i], d) for i, d in vector_search(query, index, top_k)]
+
+def hybrid_search(query, knowledge_base, top_k=3, mode=None, embedding_timeout=None):
+    """
+    Returns (chunk, distance, bm25_score) triples, best first; either score is
+    None when the chunk was not ranked by that retriever. A short keyword
+    query with an unambiguous BM25 match is answered from the local index
+    alone, as is any query when the embedding call fails or times out.
+    """
+    index, chunks, lexical = knowledge_base
+    mode = mode or RETRIEVAL_MODE
+    lexical_hits = lexical.search(query, max(top_k, FUSION_CANDIDATES))
+    bm25_scores = dict(lexical_hits)
+    distances = {}
+
+    if mode == "lexical" or (mode == "hybrid" and lexical.is_confident(query, lexical_hits)):
+        ranked = [doc_id for doc_id, _ in lexical_hits]
+    else:
+        try:
+            vector_hits = vector_search(query, index, max(top_k, FUSION_CANDIDATES), embedding_timeout)
+        except Exception as e:
+            if mode == "vector":
+                raise
+            print(f"Embedding search failed, using keyword results only: {e}")
+            vector_hits = []
+        distances = dict(vector_hits)
+        vector_ranking = [doc_id for doc_id, _ in vector_hits]
+        if mode == "vector":
+            ranked = vector_ranking
+        else:
+            lexical_ranking = [doc_id for doc_id, _ in lexical_hits]
+            ranked = [doc_id for doc_id, _ in reciprocal_rank_fusion(vector_ranking, lexical_ranking)]
+
+    return [(chunks[i], distances.get(i), bm25_scores.get(i)) for i in ranked[:top_k]]
+
+def query_index(query, knowledge_base, top_k=3, client=None):
     # Get relevant context
-    context = "\n".join([chunks[i] for i in indices[0]])
+    context = "\n".join(chunk for chunk, _, _ in hybrid_search(query, knowledge_base, top_k))
     
-    # Query Groq LLM
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    response = client.chat.completions.create(
+    # Query the LLM through the shared gateway (rate limits, retries, fallback)
+    client = client or get_gateway()
+    return client.chat(
         messages=[{
             "role": "user",
             "content": f"Context:\n{context}\n\nQuestion: {query}\nAnswer:"
         }],
         model="llama3-70b-8192",
     )
-    return response.choices[0].message.content
 
-def resolve_db(query):
-    persist_dir = './STORAGE'
-    data_path = './data/knowledge_base.txt'
-    
-    try:
-        index, chunks = load_existing_index(persist_dir)
-        print("Loaded existing index.")
-    except Exception as e:
-        print(f"Index load failed: {e}. Creating new index.")
-        index, chunks = create_and_persist_index(data_path, persist_dir)
-    
-    response = query_index(query, index, chunks)
+def resolve_db(query, knowledge_base=None, client=None, category=None):
+    """
+    Answers from the category's KB when there is one (see knowledge_base_for).
+    Identical questions in the same category, asked together or within the
+    cache TTL, share one generation; passing `knowledge_base` or `client`
+    bypasses that.
+    """
+    if knowledge_base is None and client is None:
+        return _resolve_calls.do((category, normalized_key(query)), resolve_db, query, knowledge_base_for(category),
+                                 category=category)
+    knowledge_base = knowledge_base_for(category, knowledge_base)
+
+    response = query_index(query, knowledge_base, client=client)
     print("Query Response:", response)
     return response
 
+def retrieve_db(query, knowledge_base=None, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET,
+                category=None):
+    """
+    Retrieval-only lookup: returns the best matching passages with their
+    vector distance (lower is closer) and BM25 score, and no LLM generation,
+    for callers that already have an LLM to phrase the answer. Passages are
+    added best first until the token budget is spent; the first one is always
+    kept, truncated if it alone is over budget. With a `category` that has
+    its own KB, that KB is searched instead of `knowledge_base`.
+    """
+    knowledge_base = knowledge_base_for(category, knowledge_base)
+
+    results = []
+    used = 0
+    for chunk, distance, bm25_score in hybrid_search(query, knowledge_base, top_k,
+                                                     embedding_timeout=EMBEDDING_TIMEOUT):
+        tokens = count_tokens(chunk)
+        if used + tokens > token_budget:
+            if results:
+                break
+            chunk = truncate_tokens(chunk, token_budget)
+            tokens = token_budget
+        results.append({
+            "text": chunk,
+            "distance": round(distance, 4) if distance is not None else None,
+            "bm25": round(bm25_score, 3) if bm25_score is not None else None,
+            "tokens": tokens,
+        })
+        used += tokens
+    return results
+
+def format_passages(passages):
+    """Renders retrieve_db results as a tool-call result for the agent's LLM."""
+    if not passages:
+        return "No relevant information was found in the knowledge base."
+    return "\n\n".join(
+        f"[{i}] ({_match_label(p)}) {p['text']}" for i, p in enumerate(passages, 1)
+    )
+
+def _match_label(passage):
+    if passage["distance"] is not None:
+        return f"distance {passage['distance']}"
+    return "keyword match"
+
 def resolve(num, prblm_description):
-    
-    os.system(f'lk dispatch create --new-room --agent-name outbound-caller --metadata "{num}"')
+    """Dispatches the outbound agent to call `num`. Raises DispatchError if LiveKit rejects it."""
+    return dispatch_call(num)
 
 # Example usage
\ No newline at end of file
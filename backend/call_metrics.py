@@ -0,0 +1,119 @@
+# call_metrics.py
+"""
+Per-call conversational latency for the voice agents.
+
+CallMetricsRecorder listens to the agent's metrics_collected events and keeps
+each turn's STT delay, LLM time-to-first-token, TTS time-to-first-byte and
+end-of-utterance delay in memory, together with how long each batch of tool
+calls took. The handlers only append to lists; when the call ends the samples
+are aggregated per metric (count, avg, p50, p95, max) and written to
+`call_metrics`, with the samples themselves going to `call_metric_samples`
+in the same transaction. GET /metrics/latency reports p50/p95 over the
+samples of recent calls.
+"""
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from livekit.agents import llm, metrics
+
+from agent_db import AgentDatabase, DBLatencyStats
+
+logger = logging.getLogger("outbound-caller")
+
+STT_DELAY = "stt"
+LLM_TTFT = "llm_ttft"
+TTS_TTFB = "tts_ttfb"
+EOU_DELAY = "eou_delay"
+TOOL_CALL = "tool_call"
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Linear interpolation between closest ranks, like Postgres percentile_cont."""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class CallMetricsRecorder:
+    def __init__(self, db: AgentDatabase, room_name: str, phone_number: str,
+                 agent_name: str = "outbound-caller", stats: Optional[DBLatencyStats] = None):
+        self.db = db
+        self.room_name = room_name
+        self.phone_number = phone_number
+        self.agent_name = agent_name
+        self.stats = stats
+
+        # (metric, label) -> samples in seconds; label names the tools for TOOL_CALL
+        self.samples: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+        self._tools_started_at: Optional[float] = None
+        self._closed = False
+
+    def attach(self, agent) -> None:
+        """Subscribes to a VoicePipelineAgent's or MultimodalAgent's metrics and tool events."""
+        agent.on("metrics_collected", self._on_metrics)
+        agent.on("function_calls_collected", self._on_function_calls_collected)
+        agent.on("function_calls_finished", self._on_function_calls_finished)
+
+    def record(self, metric: str, seconds: float, label: str = "") -> None:
+        # the plugins report -1 for a stage that never produced output (e.g. a cancelled reply)
+        if self._closed or seconds is None or seconds < 0:
+            return
+        self.samples[(metric, label)].append(seconds)
+
+    def _on_metrics(self, agent_metrics: metrics.AgentMetrics) -> None:
+        if isinstance(agent_metrics, metrics.PipelineEOUMetrics):
+            # with a streaming STT, the wait for the final transcript is STT's share of the turn
+            self.record(STT_DELAY, agent_metrics.transcription_delay)
+            self.record(EOU_DELAY, agent_metrics.end_of_utterance_delay)
+        elif isinstance(agent_metrics, (metrics.PipelineLLMMetrics, metrics.MultimodalLLMMetrics)):
+            self.record(LLM_TTFT, agent_metrics.ttft)
+        elif isinstance(agent_metrics, metrics.PipelineTTSMetrics):
+            self.record(TTS_TTFB, agent_metrics.ttfb)
+
+    def _on_function_calls_collected(self, function_calls: List[llm.FunctionCallInfo]) -> None:
+        self._tools_started_at = time.perf_counter()
+
+    def _on_function_calls_finished(self, called_functions: List[llm.CalledFunction]) -> None:
+        if self._tools_started_at is None or not called_functions:
+            return
+        # the functions of one batch run back to back, so the batch is timed as a whole
+        label = ",".join(sorted({f.call_info.function_info.name for f in called_functions}))
+        self.record(TOOL_CALL, time.perf_counter() - self._tools_started_at, label)
+        self._tools_started_at = None
+
+    def summary(self) -> List[Dict]:
+        rows = []
+        for (metric, label), values in sorted(self.samples.items()):
+            values = sorted(values)
+            rows.append({
+                "metric": metric,
+                "label": label,
+                "samples": len(values),
+                "avg_ms": round(1000 * sum(values) / len(values), 2),
+                "p50_ms": round(1000 * percentile(values, 0.5), 2),
+                "p95_ms": round(1000 * percentile(values, 0.95), 2),
+                "max_ms": round(1000 * values[-1], 2),
+            })
+        return rows
+
+    def sample_rows(self) -> List[Tuple[str, str, float]]:
+        """Every sample as (metric, label, value_ms)."""
+        return [(metric, label, round(1000 * value, 2))
+                for (metric, label), values in sorted(self.samples.items()) for value in values]
+
+    async def close(self) -> None:
+        """Aggregates the call's samples and stores them. Safe to call twice."""
+        if self._closed:
+            return
+        self._closed = True
+        rows = self.summary()
+        if not rows:
+            return
+        logger.info(f"latency for {self.phone_number}: {rows}")
+        await self.db.add_call_metrics(self.room_name, self.phone_number, self.agent_name, rows,
+                                       self.sample_rows(), self.stats)
@@ -0,0 +1,111 @@
+# call_monitor.py
+"""
+Event-driven tracking of an outbound SIP call's status.
+
+Instead of polling participant.attributes in a loop, CallMonitor subscribes
+to the room's participant_attributes_changed / participant_disconnected
+events and waits on a single timeout for the call to be answered, rejected
+or left unanswered. It also timestamps the agent's first utterance after
+pickup, so each call reports how long the callee waited to hear the agent.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from livekit import rtc
+
+logger = logging.getLogger("outbound-caller")
+
+ANSWERED = "answered"
+NO_ANSWER = "no_answer"
+REJECTED = "rejected"
+HUNG_UP = "hung_up"
+
+# outcomes seen by this worker process, logged with every call summary
+OUTCOME_COUNTS: Counter = Counter()
+
+
+class CallMonitor:
+    def __init__(self, room: rtc.Room, participant: rtc.RemoteParticipant, timeout: float = 30.0):
+        self.room = room
+        self.participant = participant
+        self.timeout = timeout
+        self.dial_started_at = time.perf_counter()
+        self.picked_up_at: Optional[float] = None
+        self.first_utterance_at: Optional[float] = None
+        self.outcome: Optional[str] = None
+        self._outcome_future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def track_agent(self, agent) -> None:
+        """Watches a VoicePipelineAgent or MultimodalAgent for its first speech."""
+        agent.on("agent_started_speaking", self._on_agent_started_speaking)
+
+    async def wait_for_outcome(self) -> str:
+        """Resolves to ANSWERED, REJECTED, NO_ANSWER or HUNG_UP; NO_ANSWER after `timeout`."""
+        self.room.on("participant_attributes_changed", self._on_attributes_changed)
+        self.room.on("participant_disconnected", self._on_disconnected)
+        try:
+            # the callee may have answered before we subscribed
+            self._check_status(self.participant.attributes.get("sip.callStatus"))
+            outcome = await asyncio.wait_for(asyncio.shield(self._outcome_future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            outcome = NO_ANSWER
+        finally:
+            self.room.off("participant_attributes_changed", self._on_attributes_changed)
+            self.room.off("participant_disconnected", self._on_disconnected)
+
+        self.outcome = outcome
+        OUTCOME_COUNTS[outcome] += 1
+        return outcome
+
+    def _resolve(self, outcome: str) -> None:
+        if self._outcome_future.done():
+            return
+        if outcome == ANSWERED:
+            self.picked_up_at = time.perf_counter()
+        self._outcome_future.set_result(outcome)
+
+    def _check_status(self, call_status: Optional[str]) -> None:
+        if call_status == "active":
+            self._resolve(ANSWERED)
+        elif call_status == "hangup":
+            self._resolve(self._disconnect_outcome())
+
+    def _disconnect_outcome(self) -> str:
+        reason = self.participant.disconnect_reason
+        if reason == rtc.DisconnectReason.USER_REJECTED:
+            return REJECTED
+        if reason == rtc.DisconnectReason.USER_UNAVAILABLE:
+            return NO_ANSWER
+        return HUNG_UP
+
+    def _on_attributes_changed(self, changed_attributes: Dict[str, str], participant: rtc.Participant) -> None:
+        if participant.identity == self.participant.identity:
+            self._check_status(changed_attributes.get("sip.callStatus"))
+
+    def _on_disconnected(self, participant: rtc.RemoteParticipant) -> None:
+        if participant.identity == self.participant.identity:
+            self._resolve(self._disconnect_outcome())
+
+    def _on_agent_started_speaking(self, *_) -> None:
+        if self.picked_up_at is not None and self.first_utterance_at is None:
+            self.first_utterance_at = time.perf_counter()
+            logger.info(f"first utterance {self.pickup_to_first_utterance_ms:.0f} ms after pickup")
+
+    @property
+    def pickup_to_first_utterance_ms(self) -> Optional[float]:
+        if self.picked_up_at is None or self.first_utterance_at is None:
+            return None
+        return (self.first_utterance_at - self.picked_up_at) * 1000
+
+    def summary(self) -> Dict:
+        ring_ms = (self.picked_up_at - self.dial_started_at) * 1000 if self.picked_up_at else None
+        first_utterance_ms = self.pickup_to_first_utterance_ms
+        return {
+            "outcome": self.outcome,
+            "dial_to_pickup_ms": round(ring_ms) if ring_ms is not None else None,
+            "pickup_to_first_utterance_ms": round(first_utterance_ms) if first_utterance_ms is not None else None,
+            "worker_outcomes": dict(OUTCOME_COUNTS),
+        }
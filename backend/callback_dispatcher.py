@@ -0,0 +1,268 @@
+# callback_dispatcher.py
+"""
+Places scheduled complaint callbacks when their slot arrives.
+
+_auto_schedule_callback and the dashboard only write
+`complaints.scheduled_callback`; CallbackDispatcher runs as its own process
+and turns due slots into outbound agent jobs:
+
+    python callback_dispatcher.py
+
+Due complaints are claimed with FOR UPDATE SKIP LOCKED through the partial
+index idx_complaints_callback_claim, so several replicas can run side by side
+without dialing the same customer twice. Each replica keeps at most
+`max_concurrent` callbacks in flight. A call slot is released when the agent
+publishes the call's outcome on CALL_OUTCOME_CHANNEL. A call still live after
+`call_timeout` keeps its slot until its room closes; a room that closes
+without an outcome is recorded as 'timeout' and not dialed again, since the
+customer may have answered. The LISTEN connection is checked on every poll
+and reopened when it drops.
+
+The outcome is stored in `callback_state`. Unanswered and failed calls are
+retried with backoff. The replica waiting on a call keeps refreshing its
+`callback_locked_at`, so rows left in 'dialing' or 'dispatched' by a crashed
+replica are reclaimed after `lock_timeout`; a reclaimed call that is still
+live is waited for instead of dialed again. Rescheduling a callback from the
+dashboard resets its state to 'pending'.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import uuid
+from typing import Dict, Optional
+
+import asyncpg
+from dotenv import load_dotenv
+
+from agent_db import CALL_OUTCOME_CHANNEL, AgentDatabase
+from call_monitor import ANSWERED, NO_ANSWER
+from dispatcher import DispatchError, LiveKitDispatcher
+
+load_dotenv(".env.local")
+
+logger = logging.getLogger("callback-dispatcher")
+
+# callback_state values besides the call_monitor outcomes
+PENDING = "pending"
+DIALING = "dialing"
+DISPATCHED = "dispatched"
+COMPLETED = "completed"
+FAILED = "failed"
+DISPATCH_FAILED = "dispatch_failed"
+TIMEOUT = "timeout"
+RETRYABLE_OUTCOMES = {NO_ANSWER, DISPATCH_FAILED}
+# how long a ping on the LISTEN connection may take before it is reopened
+LISTENER_PING_TIMEOUT = 5.0
+
+CLAIM_SQL = """
+    WITH due AS (
+        SELECT complaint_id, callback_state AS previous_state FROM complaints
+        WHERE callback_state IN ('pending', 'dialing', 'dispatched')
+          AND scheduled_callback IS NOT NULL
+          AND lower(status) = 'pending'
+          AND ((callback_state = 'pending'
+                AND scheduled_callback <= NOW()
+                AND scheduled_callback > NOW() - make_interval(secs => $3)
+                AND (callback_next_attempt_at IS NULL OR callback_next_attempt_at <= NOW()))
+               OR (callback_state IN ('dialing', 'dispatched')
+                   AND callback_locked_at < NOW() - make_interval(secs => $2)))
+        ORDER BY scheduled_callback
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE complaints c
+    SET callback_state = 'dialing', callback_locked_at = NOW(),
+        callback_attempts = c.callback_attempts + 1
+    FROM due
+    WHERE c.complaint_id = due.complaint_id
+    RETURNING c.complaint_id, c.customer_phone_number, c.callback_attempts, c.callback_room, due.previous_state
+"""
+
+
+class CallbackDispatcher:
+    def __init__(self, db: Optional[AgentDatabase] = None, dispatcher: Optional[LiveKitDispatcher] = None,
+                 max_concurrent: int = 5, max_attempts: int = 3, retry_backoff: float = 900.0,
+                 call_timeout: float = 900.0, poll_interval: float = 30.0, lock_timeout: float = 120.0,
+                 max_lateness: float = 6 * 3600.0):
+        self.db = db or AgentDatabase()
+        self.dispatcher = dispatcher or LiveKitDispatcher(max_concurrent=max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.call_timeout = call_timeout
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+        # slots missed by more than this (e.g. while no dispatcher ran) are not dialed late
+        self.max_lateness = max_lateness
+
+        self._waiting: Dict[str, asyncio.Future] = {}
+        self._listener: Optional[asyncpg.Connection] = None
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+
+    def _on_outcome(self, connection, pid, channel, payload) -> None:
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning(f"ignoring malformed call outcome: {payload!r}")
+            return
+        future = self._waiting.get(event.get("room"))
+        if future is not None and not future.done():
+            future.set_result(event)
+
+    async def _ensure_listener(self) -> None:
+        """(Re)opens the LISTEN connection for call outcomes if it is closed or no longer answers."""
+        if self._listener is not None:
+            try:
+                await asyncio.wait_for(self._listener.execute("SELECT 1"), timeout=LISTENER_PING_TIMEOUT)
+                return
+            except Exception as e:
+                logger.warning(f"call outcome listener lost ({e}), reconnecting")
+                self._listener.terminate()
+                self._listener = None
+        try:
+            listener = await asyncpg.connect(**self.db.connection_params)
+            await listener.add_listener(CALL_OUTCOME_CHANNEL, self._on_outcome)
+            # notice a drop right away instead of at the next poll
+            listener.add_termination_listener(lambda connection: self._wakeup.set())
+            self._listener = listener
+        except Exception as e:
+            # outcomes published meanwhile are lost; wait_for_outcome falls back to the room state
+            logger.error(f"Could not listen for call outcomes: {e}")
+
+    async def run(self) -> None:
+        """Dispatches due callbacks until stop() is called, polling every poll_interval."""
+        pool = await self.db.pool()
+        logger.info(f"callback dispatcher started, up to {self.max_concurrent} calls in flight")
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                await self._ensure_listener()
+                # claim only as many rows as there are free call slots
+                free = self.max_concurrent - len(self._tasks)
+                rows = []
+                if free > 0:
+                    try:
+                        rows = await pool.fetch(CLAIM_SQL, free, self.lock_timeout, self.max_lateness)
+                    except Exception as e:
+                        logger.error(f"Could not claim due callbacks: {e}")
+                for row in rows:
+                    task = asyncio.create_task(self._place_call(pool, row))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._call_finished)
+                if rows and len(rows) == free:
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            if self._listener is not None:
+                await self._listener.close()
+            await self.dispatcher.close()
+            await self.db.close()
+
+    def _call_finished(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        # a slot opened up; claim the next due callback right away
+        self._wakeup.set()
+
+    async def _place_call(self, pool: asyncpg.Pool, row: asyncpg.Record) -> None:
+        complaint_id, phone_number = row["complaint_id"], row["customer_phone_number"]
+        # a row reclaimed from a crashed replica may still have its call going on
+        resumed = (row["previous_state"] == DISPATCHED
+                   and await self.dispatcher.room_exists(row["callback_room"]) is not False)
+        room = row["callback_room"] if resumed else f"callback-{complaint_id}-{uuid.uuid4().hex[:8]}"
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[room] = future
+        heartbeat = None
+        try:
+            if resumed:
+                logger.info(f"complaint {complaint_id}: call in {room} is still live, waiting for its outcome")
+            else:
+                try:
+                    # the outbound agents read the job metadata as the number to dial
+                    await self.dispatcher.dispatch(phone_number, room_name=room)
+                except DispatchError as e:
+                    await self._record_outcome(pool, row, DISPATCH_FAILED, str(e))
+                    return
+                logger.info(f"calling back complaint {complaint_id} at {phone_number} in {room} "
+                            f"(attempt {row['callback_attempts']})")
+            await pool.execute(
+                """UPDATE complaints SET callback_state = 'dispatched', callback_room = $2,
+                       callback_locked_at = NOW()
+                   WHERE complaint_id = $1""",
+                complaint_id, room,
+            )
+            heartbeat = asyncio.create_task(self._keep_locked(pool, complaint_id))
+            event = await self.dispatcher.wait_for_outcome(future, room, self.call_timeout)
+            if event is None:
+                await self._record_outcome(pool, row, TIMEOUT, f"{room} closed without an outcome")
+                return
+            await self._record_outcome(pool, row, event.get("outcome") or NO_ANSWER)
+        except Exception as e:
+            logger.error(f"callback for complaint {complaint_id} failed unexpectedly: {e}")
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            self._waiting.pop(room, None)
+
+    async def _keep_locked(self, pool: asyncpg.Pool, complaint_id: int) -> None:
+        """Refreshes callback_locked_at while this replica waits on the call, so it is not reclaimed."""
+        while True:
+            await asyncio.sleep(self.lock_timeout / 2)
+            try:
+                await pool.execute(
+                    "UPDATE complaints SET callback_locked_at = NOW() WHERE complaint_id = $1 "
+                    "AND callback_state = 'dispatched'",
+                    complaint_id,
+                )
+            except Exception as e:
+                logger.warning(f"could not refresh the lock on complaint {complaint_id}: {e}")
+
+    async def _record_outcome(self, pool: asyncpg.Pool, row: asyncpg.Record, outcome: str,
+                              error: Optional[str] = None) -> None:
+        complaint_id, attempts = row["complaint_id"], row["callback_attempts"]
+        if outcome in RETRYABLE_OUTCOMES and attempts < self.max_attempts:
+            delay = self.retry_backoff * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+            await pool.execute(
+                """UPDATE complaints
+                   SET callback_state = 'pending', callback_locked_at = NULL, callback_error = $2,
+                       callback_next_attempt_at = NOW() + make_interval(secs => $3)
+                   WHERE complaint_id = $1""",
+                complaint_id, error or outcome, delay,
+            )
+            logger.info(f"complaint {complaint_id}: {outcome}, retrying in {delay:.0f}s")
+            return
+
+        state = COMPLETED if outcome == ANSWERED else (FAILED if outcome in RETRYABLE_OUTCOMES else outcome)
+        await pool.execute(
+            """UPDATE complaints
+               SET callback_state = $2, callback_locked_at = NULL, callback_error = $3
+               WHERE complaint_id = $1""",
+            complaint_id, state, (error or outcome) if state in (FAILED, TIMEOUT) else None,
+        )
+        logger.info(f"complaint {complaint_id}: callback {state} after {attempts} attempt(s)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    callback_dispatcher = CallbackDispatcher(
+        max_concurrent=int(os.getenv("CALLBACK_MAX_CONCURRENT_CALLS", "5")),
+        max_attempts=int(os.getenv("CALLBACK_MAX_ATTEMPTS", "3")),
+        retry_backoff=float(os.getenv("CALLBACK_RETRY_BACKOFF_SECONDS", "900")),
+    )
+    try:
+        asyncio.run(callback_dispatcher.run())
+    except KeyboardInterrupt:
+        pass
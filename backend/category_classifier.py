@@ -0,0 +1,236 @@
+# category_classifier.py
+"""
+Local complaint category classifier.
+
+A TF-IDF nearest-centroid model trained on the complaint_category labels
+already stored in the complaints table. Only labels given by the LLM or by a
+person are used (complaint_category_source): the model's own predictions are
+stored too, and training on them would reinforce its mistakes. Features are the BM25 index's
+tokens plus word bigrams; each category is the normalised mean of its
+complaints' TF-IDF vectors, so a prediction is one sparse dot product
+against four centroids, a few microseconds per complaint.
+
+ComplaintAnalyzer.get_complaint_category answers from this model when the
+prediction is confident (similar enough to its centroid and clearly ahead
+of the runner-up) and only asks the LLM otherwise.
+
+    python category_classifier.py train       # retrain from the complaints table
+    python category_classifier.py benchmark   # held-out accuracy, LLM deferral rate and latency
+"""
+import logging
+import math
+import os
+import pickle
+import random
+import time
+from collections import Counter
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bm25 import TOKENIZER_VERSION, tokenize
+
+logger = logging.getLogger("category-classifier")
+
+# index = the number the LLM prompt asks for
+CATEGORIES = ("Technical Support", "Billing", "New Connection", "Added Service and Bundle offers")
+
+# complaints.complaint_category_source: who chose the stored category
+SOURCE_LLM = "llm"
+SOURCE_LOCAL = "local"
+SOURCE_HUMAN = "human"
+# neither answered, CATEGORIES[0] was stored
+SOURCE_DEFAULT = "default"
+# labels the model may learn from and be measured against
+TRAINING_SOURCES = (SOURCE_LLM, SOURCE_HUMAN)
+
+MODEL_PATH = os.getenv("CATEGORY_MODEL_PATH", "./STORAGE/category_classifier.pkl")
+# below either threshold the prediction is deferred to the LLM
+MIN_SIMILARITY = float(os.getenv("CATEGORY_MIN_SIMILARITY", "0.15"))
+MIN_MARGIN = float(os.getenv("CATEGORY_MIN_MARGIN", "0.05"))
+MIN_TRAINING_SAMPLES = 20
+
+
+class Prediction(NamedTuple):
+    label: str
+    # cosine similarity to the label's centroid
+    similarity: float
+    # lead over the runner-up category's similarity
+    margin: float
+
+
+def features(text: str) -> List[str]:
+    tokens = tokenize(text)
+    return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class CategoryClassifier:
+    def __init__(self, labels: Sequence[str], vocabulary: Dict[str, int], idf: np.ndarray, centroids: np.ndarray):
+        self.labels = list(labels)
+        self.vocabulary = vocabulary
+        self.idf = idf
+        # (len(labels), len(vocabulary)), rows L2-normalised
+        self.centroids = centroids
+        self.tokenizer_version = TOKENIZER_VERSION
+
+    @classmethod
+    def train(cls, texts: Sequence[str], labels: Sequence[str]) -> "CategoryClassifier":
+        docs = [Counter(features(text)) for text in texts]
+        df = Counter(term for doc in docs for term in doc)
+        terms = sorted(df)
+        vocabulary = {term: i for i, term in enumerate(terms)}
+        n = len(docs)
+        idf = np.array([math.log((1 + n) / (1 + df[t])) + 1 for t in terms], dtype=np.float32)
+
+        label_set = [c for c in CATEGORIES if c in set(labels)] + sorted(set(labels) - set(CATEGORIES))
+        rows = {label: i for i, label in enumerate(label_set)}
+        classifier = cls(label_set, vocabulary, idf, np.zeros((len(label_set), len(terms)), dtype=np.float32))
+        for doc, label in zip(docs, labels):
+            cols, weights = classifier._vector(doc)
+            classifier.centroids[rows[label], cols] += weights
+        norms = np.linalg.norm(classifier.centroids, axis=1, keepdims=True)
+        classifier.centroids /= np.maximum(norms, 1e-12)
+        return classifier
+
+    def _vector(self, counts: Counter) -> Tuple[np.ndarray, np.ndarray]:
+        """Sublinear-tf TF-IDF weights of the known terms, L2-normalised."""
+        cols, weights = [], []
+        for term, tf in counts.items():
+            col = self.vocabulary.get(term)
+            if col is not None:
+                cols.append(col)
+                weights.append((1 + math.log(tf)) * self.idf[col])
+        weights = np.asarray(weights, dtype=np.float32)
+        norm = float(np.linalg.norm(weights)) if cols else 0.0
+        return np.asarray(cols, dtype=np.int64), (weights / norm if norm else weights)
+
+    def predict(self, text: str) -> Optional[Prediction]:
+        """The closest category, or None when the text shares no term with the training data."""
+        cols, weights = self._vector(Counter(features(text)))
+        if not len(cols):
+            return None
+        scores = self.centroids[:, cols] @ weights
+        order = np.argsort(scores)[::-1]
+        best = float(scores[order[0]])
+        runner_up = float(scores[order[1]]) if len(order) > 1 else 0.0
+        return Prediction(self.labels[order[0]], best, best - runner_up)
+
+    @staticmethod
+    def is_confident(prediction: Optional[Prediction],
+                     min_similarity: float = MIN_SIMILARITY, min_margin: float = MIN_MARGIN) -> bool:
+        return (prediction is not None and prediction.similarity >= min_similarity
+                and prediction.margin >= min_margin)
+
+    def save(self, path: str = MODEL_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> "CategoryClassifier":
+        classifier = cls.__new__(cls)
+        # models from before the version was recorded used the first tokenizer
+        classifier.tokenizer_version = 1
+        with open(path, "rb") as f:
+            classifier.__dict__.update(pickle.load(f))
+        return classifier
+
+
+def load_classifier(path: str = MODEL_PATH) -> Optional[CategoryClassifier]:
+    """The trained model, or None (every complaint goes to the LLM) if it has not been trained yet."""
+    try:
+        classifier = CategoryClassifier.load(path)
+        if classifier.tokenizer_version != TOKENIZER_VERSION:
+            logger.warning(f"Category model {path} was trained with an older tokenizer; "
+                           f"retrain it with `python category_classifier.py train`")
+            return None
+        return classifier
+    except FileNotFoundError:
+        logger.info(f"No category model at {path}; run `python category_classifier.py train`")
+    except Exception as e:
+        logger.error(f"Could not load category model {path}: {e}")
+    return None
+
+
+def benchmark(texts: Sequence[str], labels: Sequence[str], test_fraction: float = 0.2, seed: int = 0,
+              llm: Optional[Callable[[str], Optional[str]]] = None) -> Dict:
+    """
+    Trains on a random split and reports, on the held-out part: overall and
+    confident-only accuracy, the share deferred to the LLM, and per-prediction
+    latency. With `llm`, deferred complaints are also sent to it to measure
+    the accuracy of the combined path.
+    """
+    order = list(range(len(texts)))
+    random.Random(seed).shuffle(order)
+    split = max(1, int(len(order) * test_fraction))
+    test, train = order[:split], order[split:]
+    classifier = CategoryClassifier.train([texts[i] for i in train], [labels[i] for i in train])
+
+    correct = confident = confident_correct = combined_correct = 0
+    latencies_us = []
+    for i in test:
+        start = time.perf_counter_ns()
+        prediction = classifier.predict(texts[i])
+        latencies_us.append((time.perf_counter_ns() - start) / 1000)
+        label = prediction.label if prediction else None
+        correct += label == labels[i]
+        if classifier.is_confident(prediction):
+            confident += 1
+            confident_correct += label == labels[i]
+            combined_correct += label == labels[i]
+        elif llm is not None:
+            combined_correct += (llm(texts[i]) or label) == labels[i]
+
+    latencies_us.sort()
+    result = {
+        "train_samples": len(train),
+        "test_samples": len(test),
+        "accuracy": round(correct / len(test), 4),
+        "confident_share": round(confident / len(test), 4),
+        "confident_accuracy": round(confident_correct / confident, 4) if confident else None,
+        "p50_us": round(latencies_us[len(latencies_us) // 2], 1),
+        "p95_us": round(latencies_us[min(len(latencies_us) - 1, int(len(latencies_us) * 0.95))], 1),
+    }
+    if llm is not None:
+        result["combined_accuracy"] = round(combined_correct / len(test), 4)
+    return result
+
+
+def _training_data() -> Tuple[List[str], List[str]]:
+    from database import DatabaseManager
+
+    rows = DatabaseManager().get_labeled_complaints(CATEGORIES, TRAINING_SOURCES)
+    return [r["complaint_description"] for r in rows], [r["complaint_category"] for r in rows]
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Train or benchmark the local complaint category classifier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train")
+    train_parser.add_argument("--output", default=MODEL_PATH)
+    benchmark_parser = subparsers.add_parser("benchmark")
+    benchmark_parser.add_argument("--test-fraction", type=float, default=0.2)
+    benchmark_parser.add_argument("--with-llm", action="store_true",
+                                  help="send deferred complaints to the LLM and report combined accuracy")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    texts, labels = _training_data()
+    if len(texts) < MIN_TRAINING_SAMPLES or len(set(labels)) < 2:
+        raise SystemExit(f"Need at least {MIN_TRAINING_SAMPLES} LLM- or human-labelled complaints in two or "
+                         f"more categories, found {len(texts)} in {len(set(labels))}")
+
+    if args.command == "train":
+        CategoryClassifier.train(texts, labels).save(args.output)
+        logger.info(f"Trained on {len(texts)} complaints ({dict(Counter(labels))}), saved to {args.output}")
+    else:
+        llm = None
+        if args.with_llm:
+            from ai_analyzer import ComplaintAnalyzer
+            llm = ComplaintAnalyzer()._llm_category
+        print(json.dumps(benchmark(texts, labels, args.test_fraction, llm=llm), indent=2))
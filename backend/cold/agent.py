@@ -7,7 +7,6 @@ import logging
 from dotenv import load_dotenv
 import json
 import os
-from time import perf_counter
 from typing import Annotated
 from livekit import rtc, api
 from livekit.agents import (
@@ -18,8 +17,16 @@ from livekit.agents import (
     cli,
     llm,
 )
-import pandas as pd
+import sys
 from demo import send_whatsapp
+
+# shared backend modules (agent_db, dispatcher) live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agent_db import AgentDatabase
+from dialer import CAMPAIGN_CHANNEL
+from call_monitor import CallMonitor, ANSWERED, NO_ANSWER
+from call_metrics import CallMetricsRecorder
+from campaign_store import CALLED_STATUS, CampaignStore
 from livekit.agents.multimodal import MultimodalAgent
 from livekit.agents.pipeline import VoicePipelineAgent
 from livekit.plugins import deepgram, openai, silero
@@ -31,40 +38,52 @@ logger.setLevel(logging.INFO)
 
 outbound_trunk_id = os.getenv("SIP_OUTBOUND_TRUNK_ID")
 
-def get_user_info(phone_number, file_path='data.csv'):
+def parse_job_metadata(metadata):
+    """
+    The campaign dialer sends {"phone_number", "trunk_id"} as JSON; a bare
+    phone number (manual dispatch) uses the default trunk.
+    """
     try:
-        df = pd.read_csv(file_path)
-        user = df[df['Phone Number'] == phone_number]
-        
-        if not user.empty:
-            # Extract Name and Person Info
-            return {
-                'Name': user.iloc[0]['Name'],
-                'Person Info': user.iloc[0]['Person Info']
-            }
-        return None  # Return None if no match is found
-    except FileNotFoundError:
-        print(f"Error: The file {file_path} does not exist.")
-    except KeyError as e:
-        print(f"Error: Missing column in CSV file - {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-    return None
+        data = json.loads(metadata)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        return data["phone_number"], data.get("trunk_id") or outbound_trunk_id
+    return metadata, outbound_trunk_id
+
+campaign_store = CampaignStore()
 
 
 async def entrypoint(ctx: JobContext):
     global outbound_trunk_id
     logger.info(f"Connecting to room {ctx.room.name}")
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
-    data = pd.read_csv("data.csv")
     user_identity = "phone_user"
-    phone_number = ctx.job.metadata
-    
+    phone_number, trunk_id = parse_job_metadata(ctx.job.metadata)
+
+    # the dialer waits for this room's outcome instead of polling data.csv
+    monitor = None
+
+    async def publish_call_outcome():
+        summary = monitor.summary() if monitor is not None else {"outcome": None}
+        summary["outcome"] = summary["outcome"] or NO_ANSWER
+        logger.info(f"call summary for {phone_number}: {summary}")
+        await ctx.proc.userdata["db"].notify(CAMPAIGN_CHANNEL, json.dumps({
+            "room": ctx.room.name,
+            "phone_number": phone_number,
+            **summary,
+        }))
+
+    ctx.add_shutdown_callback(publish_call_outcome)
+
+    # realtime model TTFT and tool latency, aggregated into call_metrics at the end of the call
+    call_metrics = CallMetricsRecorder(ctx.proc.userdata["db"], ctx.room.name, phone_number, agent_name="cold-caller")
+    ctx.add_shutdown_callback(call_metrics.close)
     
     logger.info(f"Dialing {phone_number} to room {ctx.room.name}")
-    result = get_user_info(phone_number)
-    customer_name = result['Name']
-    customer_info = result['Person Info']
+    contact = await asyncio.to_thread(campaign_store.get_contact, phone_number) or {}
+    customer_name = contact.get("name", "there")
+    customer_info = contact.get("person_info") or ""
     
     instructions = (
         f"You are cold caller advertiser for a clothing company called Powerlook"
@@ -79,27 +98,29 @@ async def entrypoint(ctx: JobContext):
     await ctx.api.sip.create_sip_participant(
         api.CreateSIPParticipantRequest(
             room_name=ctx.room.name,
-            sip_trunk_id=outbound_trunk_id,
+            sip_trunk_id=trunk_id,
             sip_call_to=phone_number,
             participant_identity=user_identity,
         )
     )
 
     participant = await ctx.wait_for_participant(identity=user_identity)
-    run_multimodal_agent(ctx, participant, instructions)
+    monitor = CallMonitor(ctx.room, participant)
+    run_multimodal_agent(ctx, participant, instructions, phone_number, monitor, call_metrics)
+
+    # end the job (and publish the outcome) once the callee leaves the room
+    def on_participant_disconnected(p: rtc.RemoteParticipant):
+        if p.identity == user_identity:
+            ctx.shutdown()
 
-    start_time = perf_counter()
-    while perf_counter() - start_time < 30:
-        call_status = participant.attributes.get("sip.callStatus")
-        if call_status == "active":
-            logger.info("User has picked up")
-            return
-        elif call_status == "hangup":
-            logger.info("User hung up, exiting job")
-            break
-        await asyncio.sleep(0.1)
+    ctx.room.on("participant_disconnected", on_participant_disconnected)
 
-    logger.info("Session timed out, exiting job")
+    outcome = await monitor.wait_for_outcome()
+    if outcome == ANSWERED:
+        logger.info("User has picked up")
+        return
+
+    logger.info(f"Call not answered ({outcome}), exiting job")
     ctx.shutdown()
 
 class CallActions(llm.FunctionContext):
@@ -107,12 +128,14 @@ class CallActions(llm.FunctionContext):
     Detect user intent and perform actions
     """
 
-    def __init__(self, *, api: api.LiveKitAPI, participant: rtc.RemoteParticipant, room: rtc.Room):
+    def __init__(self, *, api: api.LiveKitAPI, participant: rtc.RemoteParticipant, room: rtc.Room,
+                 phone_number: str):
         super().__init__()
 
         self.api = api
         self.participant = participant
         self.room = room
+        self.phone_number = phone_number
 
     async def hangup(self):
         try:
@@ -124,76 +147,6 @@ class CallActions(llm.FunctionContext):
             )
         except Exception as e:
             logger.info(f"Received error while ending call: {e}")
-    import pandas as pd
-
-    def update_call_status(self,customer_name, file_path='data.csv'):
-        try:
-            # Load the CSV file into a DataFrame
-            df = pd.read_csv(file_path)
-
-            # Find the row where the Name matches the customer_name
-            if customer_name in df['Name'].values:
-                # Update the 'Call Status' to 'called' for the matched row
-                df.loc[df['Name'] == customer_name, 'Call Status'] = 'called'
-                
-                # Save the updated DataFrame back to the CSV file
-                df.to_csv(file_path, index=False)
-                print(f"Call status updated to 'called' for {customer_name}.")
-                return "success"
-            else:
-                print(f"Customer {customer_name} not found in the data.")
-                
-        
-        except FileNotFoundError:
-            print(f"Error: The file {file_path} does not exist.")
-        except Exception as e:
-            print(f"An error occurred: {e}")
-    def update_remarks(self,customer_name, remark, file_path='data.csv'):
-        try:
-            # Load the CSV file into a DataFrame
-            df = pd.read_csv(file_path)
-
-            # Find the row where the Name matches the customer_name
-            if customer_name in df['Name'].values:
-                # Update the 'Remarks' column for the matched row
-                df.loc[df['Name'] == customer_name, 'Remarks'] = remark
-                
-                # Save the updated DataFrame back to the CSV file
-                df.to_csv(file_path, index=False)
-                print(f"Remark added for {customer_name}.")
-                return "success"
-            else:
-                print(f"Customer {customer_name} not found in the data.")
-        
-        except FileNotFoundError:
-            print(f"Error: The file {file_path} does not exist.")
-        except Exception as e:
-            print(f"An error occurred: {e}")
-    def update_callback(self,customer_name, callback_date, file_path='data.csv'):
-        try:
-            # Load the CSV file into a DataFrame
-            df = pd.read_csv(file_path)
-
-            # Find the row where the Name matches the customer_name
-            if customer_name in df['Name'].values:
-                # Update the 'Next Follow-up Date' column for the matched row
-                df.loc[df['Name'] == customer_name, 'Next Follow-up Date'] = callback_date
-                
-                # Save the updated DataFrame back to the CSV file
-                df.to_csv(file_path, index=False)
-                print(f"Callback date added for {customer_name}.")
-                return "success"
-            else:
-                print(f"Customer {customer_name} not found in the data.")
-        
-        except FileNotFoundError:
-            print(f"Error: The file {file_path} does not exist.")
-        except Exception as e:
-            print(f"An error occurred: {e}")
-
-
-# Example usage:
-
 
     @llm.ai_callable()
     async def end_call(self):
@@ -226,35 +179,33 @@ class CallActions(llm.FunctionContext):
             return "could not send the details to {self.participant.identity}"
         
     @llm.ai_callable()
-    def update_status(self,customer_name:Annotated[str,"The name of the customer initially provided in the instructions"]):
+    async def update_status(self):
         """Call this to update the call status of the customer. Always do this before ending the call."""
-        logger.info(f"Updating the call status of {self.participant.identity}")
-        result=self.update_call_status(customer_name)
-        if result=="success":
-         return "call status has been updated"
-    
+        logger.info(f"Updating the call status of {self.phone_number}")
+        if await asyncio.to_thread(campaign_store.update_call_status, self.phone_number, CALLED_STATUS):
+            return "call status has been updated"
+        return "could not update the call status"
+
     @llm.ai_callable()
-    async def add_remark(self,customer_name:Annotated[str,"The name of the customer initially provided in the instructions"],remark:Annotated[str,"The review of the call how was the experience how was the customer"]):
+    async def add_remark(self,remark:Annotated[str,"The review of the call how was the experience how was the customer"]):
         """Call this function always before ending the call to give a review of the call"""
-        logger.info(f"Updating the call status of {self.participant.identity}")
-        result=self.update_remarks(customer_name,remark)
-        if result=="success":
-         return "call status has been updated"
-    
+        logger.info(f"Adding a remark for {self.phone_number}")
+        if await asyncio.to_thread(campaign_store.update_remarks, self.phone_number, remark):
+            return "remark has been added"
+        return "could not add the remark"
+
     @llm.ai_callable()
-    async def add_callback(self,customer_name:Annotated[str,"The name of the customer initially provided in the instructions"],callback_date:Annotated[str,"The date when the customer wants you to callback"]):
+    async def add_callback(self,callback_date:Annotated[str,"The date when the customer wants you to callback"]):
         """Call this function when the user is busy or wants to talk some other time ask him the preferred date and time"""
-        logger.info(f"Adding a callback for {self.participant.identity}")
-        result= self.update_callback(customer_name,callback_date)
-        if result=="success":
-         return "callback date has been added"
-    
-        
-        
-        
+        logger.info(f"Adding a callback for {self.phone_number}")
+        if await asyncio.to_thread(campaign_store.update_callback, self.phone_number, callback_date):
+            return "callback date has been added"
+        return "could not add the callback date"
+
 
 def run_multimodal_agent(
-    ctx: JobContext, participant: rtc.RemoteParticipant, instructions: str
+    ctx: JobContext, participant: rtc.RemoteParticipant, instructions: str, phone_number: str,
+    monitor: CallMonitor = None, call_metrics: CallMetricsRecorder = None
 ):
     logger.info("Starting multimodal agent")
 
@@ -264,12 +215,17 @@ def run_multimodal_agent(
     )
     agent = MultimodalAgent(
         model=model,
-        fnc_ctx=CallActions(api=ctx.api, participant=participant, room=ctx.room),
+        fnc_ctx=CallActions(api=ctx.api, participant=participant, room=ctx.room, phone_number=phone_number),
     )
     agent.start(ctx.room, participant)
+    if monitor is not None:
+        monitor.track_agent(agent)
+    if call_metrics is not None:
+        call_metrics.attach(agent)
 
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
+    proc.userdata["db"] = AgentDatabase()
 
 if __name__ == "__main__":
     if not outbound_trunk_id or not outbound_trunk_id.startswith("ST_"):
@@ -1,61 +1,49 @@
-import pandas as pd
-import time
+import asyncio
+import logging
 import os
 
-def run_all():
+from dotenv import load_dotenv
+from campaign_store import CALLED_STATUS, UNANSWERED_STATUS, CampaignStore
+from dialer import CampaignDialer, CallResult, ANSWERED, trunks_from_env
+
+load_dotenv(dotenv_path=".env.local")
+
+
+def run_all(store=None):
     """
-    Continuously checks the status of each phone number in the csv file.
-    Calls the first phone number immediately. Calls the next phone number only when
-    the previous phone number's status changes to 'called'.
+    Dials every 'Pending' contact in the campaign store through the campaign
+    dialer. Calls run concurrently up to the available trunk lines; each call
+    finishes when the agent reports its outcome, and unanswered numbers are
+    retried. Answered numbers are marked called (whether or not the agent
+    used update_status) and numbers still unreached after the last attempt
+    are marked not reached, so the next run dials neither again.
     """
-    csv_file_path = "data.csv"
-    seen = {}
-    phone_numbers_to_call = []
-
-    # Read the CSV file initially to get the list of phone numbers
-    try:
-        data = pd.read_csv(csv_file_path)
-        phone_numbers_to_call = data['Phone Number'].tolist()  # Get the list of phone numbers
-    except Exception as e:
-        print(f"Error reading the CSV file: {e}")
-        return
-
-    # Start calling the first phone number immediately
-    if phone_numbers_to_call:
-        first_phone_number = phone_numbers_to_call[0]
-        print(f"Calling the first phone number: {first_phone_number}")
-        os.system(f"lk dispatch create --new-room --agent-name outbound-caller --metadata {first_phone_number}")
-        seen[first_phone_number] = "called"
-        phone_numbers_to_call = phone_numbers_to_call[1:]  # Remove the first phone number from the list
-
-    while phone_numbers_to_call:
-        for phone_number in phone_numbers_to_call:
-            try:
-                # Read the CSV file to check the status of the phone number
-                data = pd.read_csv(csv_file_path)
-                row = data[data['Phone Number'] == phone_number]
-                status = row['Call Status'].values[0]  # Get the current status
-                
-                if status == "called" and phone_number not in seen:
-                    seen[phone_number] = status
-                    
-                    # Wait for 10 seconds before calling the next number
-                    print(f"Phone number {phone_number} status changed to 'called'. Waiting for 10 seconds...")
-                    time.sleep(30)
-                    
-                    # Call the next phone number
-                    print(f"Calling phone number: {phone_number}")
-                    os.system(f"lk dispatch create --new-room --agent-name outbound-caller --metadata {phone_number}")
-                    
-                    # Once the phone number is called, move to the next one
-                    phone_numbers_to_call = phone_numbers_to_call[1:]
-                    break
-                    
-            except Exception as e:
-                print(f"Error processing phone number {phone_number}: {e}")
-        
-        # Check the CSV file again after 5 seconds
-        time.sleep(5)  # Check every 5 seconds
-        
-# Example usage:
+    store = store or CampaignStore()
+    phone_numbers_to_call = store.get_pending_numbers()
+
+    async def record_result(result: CallResult):
+        status = CALLED_STATUS if result.outcome == ANSWERED else UNANSWERED_STATUS
+        await asyncio.to_thread(store.update_call_status, result.phone_number, status)
+
+    dialer = CampaignDialer(
+        trunks_from_env(),
+        workers=int(os.getenv("CAMPAIGN_MAX_CONCURRENT_CALLS", "10")),
+        calls_per_second=float(os.getenv("CAMPAIGN_CALLS_PER_SECOND", "1")),
+        max_attempts=int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "3")),
+        retry_backoff=float(os.getenv("CAMPAIGN_RETRY_BACKOFF_SECONDS", "300")),
+        on_result=record_result,
+    )
+    results = asyncio.run(dialer.run(phone_numbers_to_call))
+    for result in results:
+        print(f"{result.phone_number}: {result.outcome} ({result.attempts} attempt(s))")
+    return results
+
 
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    store = CampaignStore()
+    store.create_table()
+    # seed an empty store from the sample contacts; later runs keep call progress
+    if store.get_contacts().empty and os.path.exists("data.csv"):
+        print(f"Imported {store.import_csv('data.csv')} contacts from data.csv")
+    run_all(store)
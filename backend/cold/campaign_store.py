@@ -0,0 +1,213 @@
+# campaign_store.py
+"""
+Cold-calling contacts in Postgres, replacing read-modify-write of data.csv.
+
+Every agent update is a single-row UPDATE keyed by phone number (unique
+index), so concurrent call jobs no longer overwrite each other's changes and
+the cost of an update does not grow with the contact list. The dashboard
+imports and exports the same CSV layout as before.
+"""
+import io
+import os
+from typing import Dict, List, Optional
+
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor, execute_values
+
+load_dotenv(".env.local")
+
+# CSV header -> column
+CSV_COLUMNS = {
+    "ID": "id",
+    "Phone Number": "phone_number",
+    "Name": "name",
+    "Person Info": "person_info",
+    "Call Status": "call_status",
+    "Remarks": "remarks",
+    "Next Follow-up Date": "next_follow_up",
+}
+
+# call_status values besides 'Pending', the only one auto.run_all dials
+CALLED_STATUS = "called"
+# calls that never reached the customer
+UNANSWERED_STATUS = "Not Reached"
+
+
+class CampaignStore:
+    def __init__(self, connection_params: Optional[Dict] = None):
+        self.connection_params = connection_params or {
+            "dbname": os.getenv("DB_NAME"),
+            "user": os.getenv("DB_USER"),
+            "password": os.getenv("DB_PASSWORD"),
+            "host": os.getenv("DB_HOST"),
+            "port": os.getenv("DB_PORT"),
+        }
+
+    def connect(self) -> Optional[psycopg2.extensions.connection]:
+        try:
+            return psycopg2.connect(**self.connection_params)
+        except Exception as e:
+            print(f"Error connecting to database in campaign_store.py: {e}")
+            return None
+
+    def create_table(self) -> None:
+        conn = self.connect()
+        if not conn:
+            return
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS campaign_contacts (
+                        id SERIAL PRIMARY KEY,
+                        phone_number VARCHAR(32) NOT NULL UNIQUE,
+                        name VARCHAR(255) NOT NULL,
+                        person_info TEXT,
+                        call_status VARCHAR(32) NOT NULL DEFAULT 'Pending',
+                        remarks TEXT,
+                        next_follow_up TEXT,
+                        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+                    );
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_campaign_contacts_status
+                    ON campaign_contacts (call_status);
+                """)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Error creating campaign_contacts: {e}")
+        finally:
+            conn.close()
+
+    def get_contact(self, phone_number: str) -> Optional[Dict]:
+        conn = self.connect()
+        if not conn:
+            return None
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT * FROM campaign_contacts WHERE phone_number = %s", (phone_number,))
+                return cursor.fetchone()
+        except Exception as e:
+            print(f"Error fetching contact {phone_number}: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def _update(self, phone_number: str, column: str, value) -> bool:
+        # column names come from the methods below, never from callers
+        conn = self.connect()
+        if not conn:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE campaign_contacts SET {column} = %s, updated_at = NOW() WHERE phone_number = %s",
+                    (value, phone_number),
+                )
+                updated = cursor.rowcount == 1
+            conn.commit()
+            return updated
+        except Exception as e:
+            conn.rollback()
+            print(f"Error updating {column} for {phone_number}: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def update_call_status(self, phone_number: str, status: str) -> bool:
+        return self._update(phone_number, "call_status", status)
+
+    def update_remarks(self, phone_number: str, remark: str) -> bool:
+        return self._update(phone_number, "remarks", remark)
+
+    def update_callback(self, phone_number: str, callback_date: str) -> bool:
+        return self._update(phone_number, "next_follow_up", callback_date)
+
+    def get_pending_numbers(self) -> List[str]:
+        conn = self.connect()
+        if not conn:
+            return []
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT phone_number FROM campaign_contacts WHERE call_status = 'Pending' ORDER BY id")
+                return [row[0] for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    def import_csv(self, csv_file) -> int:
+        """
+        Upserts contacts from a CSV in the dashboard layout (path or file object).
+        Existing numbers keep their call progress, info, remarks and follow-up
+        date wherever the CSV leaves them blank; new numbers start as Pending.
+        Rows without a name are skipped. Returns the number of rows imported.
+        """
+        df = pd.read_csv(csv_file, dtype=str).rename(columns=CSV_COLUMNS)
+        df = df.where(pd.notna(df), None)
+        contacts = {}
+        skipped = 0
+        for r in df.to_dict("records"):
+            if not r.get("phone_number"):
+                continue
+            if not r.get("name"):
+                skipped += 1
+                continue
+            # a number listed twice keeps its last row
+            contacts[r["phone_number"]] = (
+                r["phone_number"], r["name"], r.get("person_info"), r.get("call_status"),
+                r.get("remarks"), r.get("next_follow_up"),
+            )
+        if skipped:
+            print(f"Skipped {skipped} contacts without a name")
+        rows = list(contacts.values())
+        if not rows:
+            return 0
+        conn = self.connect()
+        if not conn:
+            return 0
+        try:
+            with conn.cursor() as cursor:
+                execute_values(cursor, """
+                    UPDATE campaign_contacts AS c SET
+                        name = v.name,
+                        person_info = COALESCE(v.person_info, c.person_info),
+                        call_status = COALESCE(v.call_status, c.call_status),
+                        remarks = COALESCE(v.remarks, c.remarks),
+                        next_follow_up = COALESCE(v.next_follow_up, c.next_follow_up),
+                        updated_at = NOW()
+                    FROM (VALUES %s) AS v (phone_number, name, person_info, call_status, remarks, next_follow_up)
+                    WHERE c.phone_number = v.phone_number
+                """, rows)
+                execute_values(cursor, """
+                    INSERT INTO campaign_contacts
+                        (phone_number, name, person_info, call_status, remarks, next_follow_up)
+                    VALUES %s
+                    ON CONFLICT (phone_number) DO NOTHING
+                """, rows, template="(%s, %s, %s, COALESCE(%s, 'Pending'), %s, %s)")
+            conn.commit()
+            return len(rows)
+        except Exception as e:
+            conn.rollback()
+            print(f"Error importing contacts: {e}")
+            return 0
+        finally:
+            conn.close()
+
+    def get_contacts(self) -> pd.DataFrame:
+        """All contacts with the CSV column names, as the dashboard expects."""
+        conn = self.connect()
+        if not conn:
+            return pd.DataFrame(columns=list(CSV_COLUMNS))
+        try:
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(CSV_COLUMNS.values())} FROM campaign_contacts ORDER BY id", conn
+            )
+            return df.rename(columns={v: k for k, v in CSV_COLUMNS.items()})
+        finally:
+            conn.close()
+
+    def export_csv(self) -> str:
+        buffer = io.StringIO()
+        self.get_contacts().to_csv(buffer, index=False)
+        return buffer.getvalue()
@@ -3,6 +3,7 @@ import pandas as pd
 import plotly.express as px
 from datetime import datetime, timedelta
 from auto import run_all
+from campaign_store import CampaignStore
 # Configure the Streamlit page
 st.set_page_config(
     page_title="RESOLVR Cold Calling Dashboard",
@@ -88,13 +89,25 @@ def call_agent(df):
 st.title("📞 RESOLVR Cold Calling Dashboard")
 st.markdown("View your contacts and call statuses managed by the AI agent")
 
+store = CampaignStore()
+store.create_table()
+
 # File upload
 uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
 
+# Streamlit reruns this script on every interaction, so import each upload once
 if uploaded_file is not None:
-    # Read the CSV file
-    df = pd.read_csv(uploaded_file)
-    
+    upload_key = (uploaded_file.name, uploaded_file.size)
+    if st.session_state.get("imported_upload") != upload_key:
+        imported = store.import_csv(uploaded_file)
+        st.session_state["imported_upload"] = upload_key
+        st.success(f"Imported {imported} contacts")
+
+df = store.get_contacts()
+
+if not df.empty:
+    st.download_button("Export CSV", store.export_csv(), file_name="contacts.csv", mime="text/csv")
+
     # Dashboard metrics
     st.subheader("📊 Campaign Overview")
     col1, col2, col3, col4 = st.columns(4)
@@ -117,7 +130,7 @@ if uploaded_file is not None:
 
     # Initiate Call Button
     if st.button("Initiate Calls", key="initiate_calls"):
-        run_all()
+        run_all(store)
         st.experimental_rerun()
 
     # Contact Display Section
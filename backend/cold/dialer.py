@@ -0,0 +1,196 @@
+# dialer.py
+"""
+Concurrent outbound campaign dialer.
+
+Numbers go into an in-memory work queue drained by N workers. A worker takes
+a free line (each trunk has a fixed number of lines and its own token-bucket
+call rate), dispatches the cold-calling agent into a fresh room, and waits for
+that room's completion event. The agent publishes the outcome with NOTIFY on
+CAMPAIGN_CHANNEL when its job ends (see agent.publish_call_outcome), so no
+shared file has to be polled. Unanswered calls are re-queued with backoff.
+A call still live after `call_timeout` keeps its line until its room closes;
+one whose room closes without an outcome is recorded as a timeout and is not
+dialed again, since the customer may have answered.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import asyncpg
+
+_backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _backend_dir not in sys.path:
+    sys.path.append(_backend_dir)
+from agent_db import connection_params_from_env
+from dispatcher import LiveKitDispatcher, DispatchError
+from ratelimit import AsyncTokenBucket
+from call_monitor import ANSWERED, NO_ANSWER
+
+logger = logging.getLogger("campaign-dialer")
+
+CAMPAIGN_CHANNEL = "campaign_calls"
+
+# agents publish call_monitor outcomes; the dialer adds dispatch_failed and timeout
+DISPATCH_FAILED = "dispatch_failed"
+TIMEOUT = "timeout"
+RETRYABLE_OUTCOMES = {NO_ANSWER, DISPATCH_FAILED}
+
+
+@dataclass
+class DialJob:
+    phone_number: str
+    attempt: int = 1
+
+
+@dataclass
+class CallResult:
+    phone_number: str
+    outcome: str
+    attempts: int
+    room: Optional[str] = None
+    trunk_id: Optional[str] = None
+    details: Dict = field(default_factory=dict)
+
+
+class CampaignDialer:
+    """
+    `trunks` maps SIP trunk id -> number of simultaneous lines on it;
+    `calls_per_second` is the dial rate allowed on each trunk.
+    `on_result` is awaited with every final CallResult.
+    """
+
+    def __init__(self, trunks: Dict[str, int], dispatcher: Optional[LiveKitDispatcher] = None,
+                 workers: int = 10, calls_per_second: float = 1.0, max_attempts: int = 3,
+                 retry_backoff: float = 300.0, call_timeout: float = 900.0,
+                 on_result: Optional[Callable[[CallResult], Awaitable[None]]] = None,
+                 connection_params: Optional[Dict] = None):
+        if not trunks:
+            raise ValueError("at least one trunk is required")
+        self.trunks = trunks
+        self.dispatcher = dispatcher or LiveKitDispatcher(max_concurrent=workers)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.call_timeout = call_timeout
+        self.on_result = on_result
+        self.connection_params = connection_params or connection_params_from_env()
+        self.buckets = {trunk_id: AsyncTokenBucket(calls_per_second) for trunk_id in trunks}
+
+        self.results: List[CallResult] = []
+        self._queue: "asyncio.Queue[DialJob]" = asyncio.Queue()
+        self._lines: "asyncio.Queue[str]" = asyncio.Queue()
+        self._waiting: Dict[str, asyncio.Future] = {}
+        self._outstanding = 0
+        self._done = asyncio.Event()
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning(f"ignoring malformed campaign event: {payload!r}")
+            return
+        future = self._waiting.get(event.get("room"))
+        if future is not None and not future.done():
+            future.set_result(event)
+
+    async def run(self, phone_numbers: Iterable[str]) -> List[CallResult]:
+        """Dials every number (retrying unanswered ones) and returns the final results."""
+        for trunk_id, lines in self.trunks.items():
+            for _ in range(lines):
+                self._lines.put_nowait(trunk_id)
+        for number in phone_numbers:
+            self._submit(DialJob(number))
+        if self._outstanding == 0:
+            return self.results
+
+        listener = await asyncpg.connect(**self.connection_params)
+        await listener.add_listener(CAMPAIGN_CHANNEL, self._on_notify)
+        tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await self._done.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await listener.close()
+            await self.dispatcher.close()
+        return self.results
+
+    def _submit(self, job: DialJob, delay: float = 0.0) -> None:
+        self._outstanding += 1
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job)
+        else:
+            self._queue.put_nowait(job)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                result = await self._place_call(job)
+                await self._finish(job, result)
+            except Exception as e:
+                logger.error(f"dialing {job.phone_number} failed unexpectedly: {e}")
+                await self._finish(job, CallResult(job.phone_number, DISPATCH_FAILED, job.attempt))
+            finally:
+                self._queue.task_done()
+
+    async def _place_call(self, job: DialJob) -> CallResult:
+        trunk_id = await self._lines.get()
+        room = f"cold-{uuid.uuid4().hex[:12]}"
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[room] = future
+        try:
+            await self.buckets[trunk_id].acquire()
+            metadata = json.dumps({"phone_number": job.phone_number, "trunk_id": trunk_id})
+            try:
+                await self.dispatcher.dispatch(metadata, room_name=room)
+            except DispatchError as e:
+                logger.warning(f"could not dispatch call to {job.phone_number}: {e}")
+                return CallResult(job.phone_number, DISPATCH_FAILED, job.attempt, room, trunk_id, {"error": str(e)})
+
+            logger.info(f"dialing {job.phone_number} on {trunk_id} in {room} (attempt {job.attempt})")
+            event = await self.dispatcher.wait_for_outcome(future, room, self.call_timeout)
+            if event is None:
+                return CallResult(job.phone_number, TIMEOUT, job.attempt, room, trunk_id)
+            return CallResult(job.phone_number, event.get("outcome", ANSWERED), job.attempt, room, trunk_id, event)
+        finally:
+            self._waiting.pop(room, None)
+            self._lines.put_nowait(trunk_id)
+
+    async def _finish(self, job: DialJob, result: CallResult) -> None:
+        if result.outcome in RETRYABLE_OUTCOMES and job.attempt < self.max_attempts:
+            delay = self.retry_backoff * 2 ** (job.attempt - 1) * random.uniform(0.8, 1.2)
+            logger.info(f"{job.phone_number}: {result.outcome}, retrying in {delay:.0f}s")
+            self._submit(DialJob(job.phone_number, job.attempt + 1), delay)
+        else:
+            logger.info(f"{job.phone_number}: {result.outcome} after {result.attempts} attempt(s)")
+            self.results.append(result)
+            if self.on_result is not None:
+                try:
+                    await self.on_result(result)
+                except Exception as e:
+                    logger.error(f"result handler failed for {job.phone_number}: {e}")
+        self._outstanding -= 1
+        if self._outstanding == 0:
+            self._done.set()
+
+
+def trunks_from_env() -> Dict[str, int]:
+    """
+    SIP_OUTBOUND_TRUNK_IDS is a comma-separated list of trunk ids, each
+    optionally suffixed with ':<lines>'; falls back to SIP_OUTBOUND_TRUNK_ID.
+    """
+    default_lines = int(os.getenv("CAMPAIGN_LINES_PER_TRUNK", "2"))
+    spec = os.getenv("SIP_OUTBOUND_TRUNK_IDS") or os.getenv("SIP_OUTBOUND_TRUNK_ID") or ""
+    trunks = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        trunk_id, _, lines = entry.partition(":")
+        trunks[trunk_id] = int(lines) if lines else default_lines
+    return trunks
@@ -3,9 +3,10 @@ from dotenv import load_dotenv
 import os
 import pandas as pd
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, List , Dict
+from typing import Optional, Tuple, List , Dict, Sequence
 import random,string
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from events import notify_event
 load_dotenv(".env.local")
 
 class DatabaseManager:
@@ -99,6 +100,138 @@ class DatabaseManager:
                     );
                 """)
 
+                # 5) Create 'transcripts' table (written by the voice agents)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS transcripts (
+                        id SERIAL PRIMARY KEY,
+                        phone_number TEXT NOT NULL,
+                        call_transcript TEXT NOT NULL,
+                        called_at TIMESTAMP DEFAULT NOW()
+                    );
+                """)
+
+                # Batch ingestion: 'seq' keeps insertion order for rows sharing
+                # a transaction timestamp, 'client_message_id' makes retries idempotent
+                cursor.execute("""
+                    ALTER TABLE messages
+                        ADD COLUMN IF NOT EXISTS seq BIGSERIAL,
+                        ADD COLUMN IF NOT EXISTS client_message_id VARCHAR(255);
+                """)
+                cursor.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS uq_messages_call_client_message
+                    ON messages (call_id, client_message_id);
+                """)
+
+                # Full-text search over complaints: names weigh more than descriptions
+                cursor.execute("""
+                    ALTER TABLE complaints
+                        ADD COLUMN IF NOT EXISTS search_vector tsvector
+                        GENERATED ALWAYS AS (
+                            setweight(to_tsvector('english', coalesce(customer_name, '')), 'A') ||
+                            setweight(to_tsvector('english', coalesce(complaint_description, '')), 'B')
+                        ) STORED;
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_complaints_search_vector
+                    ON complaints USING GIN (search_vector);
+                """)
+
+                # Indexes backing the paginated call history endpoints
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_messages_call_id_timestamp
+                    ON messages (call_id, timestamp);
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_calls_created_at
+                    ON calls (created_at DESC);
+                """)
+
+                # 6) Outgoing WhatsApp messages, queued by the agents and
+                # delivered by whatsapp_outbox.WhatsAppSender
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS whatsapp_outbox (
+                        id BIGSERIAL PRIMARY KEY,
+                        to_number VARCHAR(32) NOT NULL,
+                        body TEXT NOT NULL,
+                        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                        locked_at TIMESTAMP,
+                        last_error TEXT,
+                        provider_sid VARCHAR(64),
+                        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                        sent_at TIMESTAMP
+                    );
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_whatsapp_outbox_due
+                    ON whatsapp_outbox (next_attempt_at)
+                    WHERE status = 'pending';
+                """)
+
+                # Who chose complaint_category: 'llm', 'local' (category_classifier), 'human' or
+                # 'default'; NULL for complaints from before it was recorded
+                cursor.execute("""
+                    ALTER TABLE complaints
+                        ADD COLUMN IF NOT EXISTS complaint_category_source VARCHAR(10);
+                """)
+
+                # Scheduled callback dialing state, driven by callback_dispatcher.CallbackDispatcher
+                cursor.execute("""
+                    ALTER TABLE complaints
+                        ADD COLUMN IF NOT EXISTS callback_state VARCHAR(20) NOT NULL DEFAULT 'pending',
+                        ADD COLUMN IF NOT EXISTS callback_attempts INTEGER NOT NULL DEFAULT 0,
+                        ADD COLUMN IF NOT EXISTS callback_next_attempt_at TIMESTAMP,
+                        ADD COLUMN IF NOT EXISTS callback_locked_at TIMESTAMP,
+                        ADD COLUMN IF NOT EXISTS callback_room VARCHAR(255),
+                        ADD COLUMN IF NOT EXISTS callback_error TEXT;
+                """)
+                # replaces idx_complaints_callback_due, which did not cover 'dispatched'
+                cursor.execute("DROP INDEX IF EXISTS idx_complaints_callback_due;")
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_complaints_callback_claim
+                    ON complaints (scheduled_callback)
+                    WHERE callback_state IN ('pending', 'dialing', 'dispatched') AND scheduled_callback IS NOT NULL;
+                """)
+
+                # 7) Per-call latency aggregates written by call_metrics.CallMetricsRecorder
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS call_metrics (
+                        id BIGSERIAL PRIMARY KEY,
+                        room_name VARCHAR(255) NOT NULL,
+                        phone_number VARCHAR(32),
+                        agent_name VARCHAR(64),
+                        metric VARCHAR(32) NOT NULL,
+                        label VARCHAR(255) NOT NULL DEFAULT '',
+                        samples INTEGER NOT NULL,
+                        avg_ms DOUBLE PRECISION NOT NULL,
+                        p50_ms DOUBLE PRECISION NOT NULL,
+                        p95_ms DOUBLE PRECISION NOT NULL,
+                        max_ms DOUBLE PRECISION NOT NULL,
+                        recorded_at TIMESTAMP NOT NULL DEFAULT NOW()
+                    );
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_call_metrics_recorded_at
+                    ON call_metrics (recorded_at);
+                """)
+                # the individual turns behind call_metrics, for percentiles across calls
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS call_metric_samples (
+                        id BIGSERIAL PRIMARY KEY,
+                        room_name VARCHAR(255) NOT NULL,
+                        agent_name VARCHAR(64),
+                        metric VARCHAR(32) NOT NULL,
+                        label VARCHAR(255) NOT NULL DEFAULT '',
+                        value_ms DOUBLE PRECISION NOT NULL,
+                        recorded_at TIMESTAMP NOT NULL DEFAULT NOW()
+                    );
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_call_metric_samples_recorded_at
+                    ON call_metric_samples (recorded_at);
+                """)
+
             conn.commit()
             print("All tables ensured (created if not existed).")
         except Exception as e:
@@ -168,7 +301,8 @@ class DatabaseManager:
 
     def submit_complaint(self, name: str, phone: str, description: str, 
                     sentiment: float, urgency: float, politeness: float, 
-                    priority_score: float,first_similar_token:str,past_count:int,solution:str,category) -> bool:
+                    priority_score: float,first_similar_token:str,past_count:int,solution:str,category,
+                    category_source: Optional[str] = None) -> bool:
         conn = self.connect()
         if conn:
             try:
@@ -177,13 +311,24 @@ class DatabaseManager:
                     cursor.execute("""
                         INSERT INTO complaints 
                         (customer_name, customer_phone_number, complaint_description, 
-                        sentiment_score, urgency_score, politeness_score, priority_score, status ,ticket_id,past_count,knowledge_base_solution,complaint_category)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s ,%s,%s,%s,%s)
+                        sentiment_score, urgency_score, politeness_score, priority_score, status ,ticket_id,past_count,knowledge_base_solution,complaint_category,
+                        complaint_category_source)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s ,%s,%s,%s,%s,%s)
                         RETURNING complaint_id
-                    """, (name, phone, description, sentiment, urgency, politeness, priority_score, 'pending',first_similar_token,past_count,solution,category))
+                    """, (name, phone, description, sentiment, urgency, politeness, priority_score, 'pending',first_similar_token,past_count,solution,category,
+                          category_source))
                     
                     complaint_id = cursor.fetchone()[0]
-                    
+                    notify_event(cursor, "complaint.created", {
+                        "complaint_id": complaint_id,
+                        "customer_name": name,
+                        "customer_phone_number": phone,
+                        "complaint_description": description,
+                        "complaint_category": category,
+                        "priority_score": priority_score,
+                        "status": "pending",
+                    })
+
                     # Auto-schedule callback
                     print('before calling suto schedule')
                     scheduled = self._auto_schedule_callback(cursor, complaint_id, priority_score)
@@ -255,6 +400,7 @@ class DatabaseManager:
                     SET scheduled_callback = %s
                     WHERE complaint_id = %s
                 """, (slot, complaint_id))
+                notify_event(cursor, "complaint.scheduled", {"complaint_id": complaint_id, "scheduled_callback": slot})
                 print(f"Scheduled callback for complaint ID {complaint_id} at {slot}")
                 return True  # Successfully scheduled
 
@@ -281,12 +427,15 @@ class DatabaseManager:
                     if cursor.fetchone()[0] > 0:
                         return False  # Slot already taken
                     
+                    # a new slot is dialed afresh by the callback dispatcher
                     cursor.execute("""
                         UPDATE complaints
-                        SET scheduled_callback = %s
+                        SET scheduled_callback = %s, callback_state = 'pending', callback_attempts = 0,
+                            callback_next_attempt_at = NULL, callback_error = NULL
                         WHERE complaint_id = %s
                     """, (new_time, complaint_id))
-                    
+                    notify_event(cursor, "complaint.scheduled", {"complaint_id": complaint_id, "scheduled_callback": new_time})
+
                 conn.commit()
                 return True
             except Exception as e:
@@ -335,6 +484,81 @@ class DatabaseManager:
                 conn.close()
         return pd.DataFrame()
 
+    def search_complaints(self, search: str, status: Optional[str] = None, priority: Optional[str] = None,
+                          limit: int = 100, offset: int = 0) -> Tuple[pd.DataFrame, int]:
+        """
+        Full-text search over customer names and complaint descriptions.
+
+        Uses the GIN-indexed search_vector column, ranks matches with ts_rank
+        and adds a 'search_highlight' snippet with matched terms wrapped in
+        <b></b>. 'status' and 'priority' accept the same values as the
+        complaints list filters ('all', 'high', 'medium', 'low').
+
+        Returns one page of `limit` matches starting at `offset`, best first,
+        with the total number of matches.
+        """
+        conn = self.connect()
+        if not conn:
+            return pd.DataFrame(), 0
+        try:
+            filters = ["c.search_vector @@ q.query"]
+            params: List = [search]
+
+            if status and status.lower() != "all":
+                filters.append("LOWER(c.status) = %s")
+                params.append(status.lower())
+
+            if priority and priority.lower() != "all":
+                if priority.lower() == "high":
+                    filters.append("c.priority_score >= 0.7")
+                elif priority.lower() == "medium":
+                    filters.append("c.priority_score >= 0.4 AND c.priority_score < 0.7")
+                else:
+                    filters.append("c.priority_score < 0.4")
+
+            params.extend([limit, offset])
+
+            # ts_headline is costly, so it only runs on the ranked page; the
+            # window count is taken before LIMIT, so it is the total match count
+            query = f"""
+                SELECT
+                    ranked.*,
+                    ts_headline('english', ranked.complaint_description, ranked.query,
+                                'StartSel=<b>, StopSel=</b>, MaxFragments=2, MaxWords=20, MinWords=5') AS search_highlight
+                FROM (
+                    SELECT
+                        c.created_at, c.customer_name, c.customer_phone_number, c.complaint_id,
+                        c.complaint_description, c.sentiment_score, c.urgency_score,
+                        c.politeness_score, c.priority_score, c.scheduled_callback, c.status,
+                        c.ticket_id, c.past_count, c.knowledge_base_solution, c.complaint_category,
+                        ts_rank(c.search_vector, q.query) AS search_rank,
+                        COUNT(*) OVER () AS search_total,
+                        q.query
+                    FROM complaints c, websearch_to_tsquery('english', %s) AS q(query)
+                    WHERE {" AND ".join(filters)}
+                    ORDER BY search_rank DESC, c.priority_score DESC, c.complaint_id
+                    LIMIT %s OFFSET %s
+                ) ranked
+                ORDER BY ranked.search_rank DESC, ranked.priority_score DESC, ranked.complaint_id
+            """
+            df = pd.read_sql_query(query, conn, params=params)
+            total = int(df["search_total"].iloc[0]) if not df.empty else 0
+            if df.empty and offset:
+                # past the last page, so there is no row carrying the count
+                with conn.cursor() as cursor:
+                    cursor.execute(f"""
+                        SELECT COUNT(*)
+                        FROM complaints c, websearch_to_tsquery('english', %s) AS q(query)
+                        WHERE {" AND ".join(filters)}
+                    """, params[:-2])
+                    total = cursor.fetchone()[0]
+            return df.drop(columns=["query", "search_total"]), total
+        except Exception as e:
+            print(f"Error searching complaints: {e}")
+            return pd.DataFrame(), 0
+        finally:
+            conn.close()
+
     def get_dashboard_metrics(self) -> Tuple[int, int, float]:
         conn = self.connect()
         if conn:
@@ -381,7 +605,8 @@ class DatabaseManager:
                         SET status = %s
                         WHERE complaint_id = %s
                     """, (new_status, complaint_id))
-                    
+                    notify_event(cursor, "complaint.status_changed", {"complaint_id": complaint_id, "status": new_status})
+
                     conn.commit()
                     return True
             except Exception as e:
@@ -616,6 +841,83 @@ class DatabaseManager:
                 conn.close()
         return pd.DataFrame()
 
+    def get_calls_summary(self, limit: int = 50, offset: int = 0) -> Tuple[List[Dict], int]:
+        """
+        Returns one page of calls as summary rows (no message bodies) together
+        with the total number of calls.
+
+        Message counts and last message times come from a LATERAL subquery per
+        call, which is answered from the (call_id, timestamp) index.
+        """
+        conn = self.connect()
+        if not conn:
+            return [], 0
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT COUNT(*) AS total FROM calls")
+                total = cursor.fetchone()["total"]
+
+                cursor.execute("""
+                    SELECT
+                        c.id::text AS call_id,
+                        c.caller,
+                        c.receiver,
+                        c.start_time,
+                        c.end_time,
+                        c.created_at,
+                        EXTRACT(EPOCH FROM (c.end_time - c.start_time)) AS duration_seconds,
+                        m.message_count,
+                        m.last_message_at
+                    FROM (
+                        SELECT * FROM calls
+                        ORDER BY created_at DESC
+                        LIMIT %s OFFSET %s
+                    ) c
+                    LEFT JOIN LATERAL (
+                        SELECT COUNT(*) AS message_count, MAX(timestamp) AS last_message_at
+                        FROM messages
+                        WHERE call_id = c.id
+                    ) m ON TRUE
+                    ORDER BY c.created_at DESC
+                """, (limit, offset))
+                return cursor.fetchall(), total
+        except Exception as e:
+            print(f"Error fetching call summaries: {e}")
+            return [], 0
+        finally:
+            conn.close()
+
+    def get_call_messages(self, call_id: str, limit: int = 100, offset: int = 0) -> Optional[Tuple[List[Dict], int]]:
+        """
+        Returns one page of a call's messages in chronological order together
+        with the call's total message count. Returns None if the call does not exist.
+        """
+        conn = self.connect()
+        if not conn:
+            return None
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT 1 FROM calls WHERE id = %s", (call_id,))
+                if cursor.fetchone() is None:
+                    return None
+
+                cursor.execute("SELECT COUNT(*) AS total FROM messages WHERE call_id = %s", (call_id,))
+                total = cursor.fetchone()["total"]
+
+                cursor.execute("""
+                    SELECT id::text AS message_id, sender, message, timestamp
+                    FROM messages
+                    WHERE call_id = %s
+                    ORDER BY timestamp ASC, seq ASC
+                    LIMIT %s OFFSET %s
+                """, (call_id, limit, offset))
+                return cursor.fetchall(), total
+        except Exception as e:
+            print(f"Error fetching messages for call {call_id}: {e}")
+            return None
+        finally:
+            conn.close()
+
     def add_call(self, caller: str, receiver: str) -> Optional[str]:
         """Add a new call and return its ID"""
         conn = self.connect()
@@ -666,7 +968,16 @@ class DatabaseManager:
                     cursor.execute("""
                         INSERT INTO messages (call_id, sender, message)
                         VALUES (%s, %s, %s)
+                        RETURNING id::text, timestamp
                     """, (call_id, sender, message))
+                    message_id, timestamp = cursor.fetchone()
+                    notify_event(cursor, "message.created", {
+                        "call_id": call_id,
+                        "message_id": message_id,
+                        "sender": sender,
+                        "message": message,
+                        "timestamp": timestamp,
+                    })
                     conn.commit()
                     return True
             except Exception as e:
@@ -675,6 +986,61 @@ class DatabaseManager:
             finally:
                 conn.close()
         return False
+
+    def add_messages_batch(self, call_id: str, messages: List[Dict]) -> Optional[Dict[str, int]]:
+        """
+        Appends many messages to a call in a single transaction.
+
+        Each message is a dict with 'sender', 'message' and optional
+        'client_message_id' / 'timestamp'. Rows are inserted in list order;
+        messages whose client_message_id was already stored for this call are
+        skipped, so a client can safely retry a batch.
+
+        Returns {"inserted": n, "duplicates": m}, or None if the call does not
+        exist or the insert failed.
+        """
+        conn = self.connect()
+        if not conn:
+            return None
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM calls WHERE id = %s", (call_id,))
+                if cursor.fetchone() is None:
+                    return None
+
+                rows = [
+                    (call_id, m["sender"], m["message"], m.get("client_message_id"), m.get("timestamp"))
+                    for m in messages
+                ]
+                inserted = execute_values(
+                    cursor,
+                    """
+                        INSERT INTO messages (call_id, sender, message, client_message_id, timestamp)
+                        VALUES %s
+                        ON CONFLICT (call_id, client_message_id) DO NOTHING
+                        RETURNING id::text, sender, message, timestamp
+                    """,
+                    rows,
+                    template="(%s, %s, %s, %s, COALESCE(%s, NOW()))",
+                    page_size=max(len(rows), 1),
+                    fetch=True,
+                )
+                for message_id, sender, message, timestamp in inserted:
+                    notify_event(cursor, "message.created", {
+                        "call_id": call_id,
+                        "message_id": message_id,
+                        "sender": sender,
+                        "message": message,
+                        "timestamp": timestamp,
+                    })
+                conn.commit()
+                return {"inserted": len(inserted), "duplicates": len(rows) - len(inserted)}
+        except Exception as e:
+            conn.rollback()
+            print(f"Error adding message batch for call {call_id}: {e}")
+            return None
+        finally:
+            conn.close()
     
     
     #graphs part
@@ -719,6 +1085,30 @@ class DatabaseManager:
         finally:
             conn.close()  # Ensure connection is closed
 
+    def get_labeled_complaints(self, categories: Sequence[str], sources: Sequence[str]) -> List[Dict]:
+        """
+        Complaint descriptions whose category is one of 'categories' and was
+        chosen by one of 'sources' (training data for category_classifier).
+        """
+        conn = self.connect()
+        if not conn:
+            return []
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT complaint_description, complaint_category
+                    FROM complaints
+                    WHERE complaint_category = ANY(%s)
+                    AND complaint_category_source = ANY(%s)
+                    AND complaint_description IS NOT NULL
+                """, (list(categories), list(sources)))
+                return cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching labelled complaints: {e}")
+            return []
+        finally:
+            conn.close()
+
 
     # def get_urgency_priority(self) -> List[Dict]:
     #     """Fetches urgency vs priority scores."""
@@ -880,4 +1270,100 @@ class DatabaseManager:
             print(f"Error fetching transcripts: {e}")
             return None
         finally:
-            connection.close()
\ No newline at end of file
+            connection.close()
+    def get_latency_percentiles(self, hours: int = 24, agent_name: Optional[str] = None) -> Optional[List[Dict]]:
+        """
+        Voice latency across the calls of the last `hours`, per metric (and tool):
+        p50_ms and p95_ms are percentiles over every turn of those calls.
+        """
+        conn = self.connect()
+        if not conn:
+            return None
+
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT metric, label,
+                           COUNT(DISTINCT room_name) AS calls,
+                           COUNT(*) AS samples,
+                           ROUND(percentile_cont(0.5) WITHIN GROUP (ORDER BY value_ms)::numeric, 2)::float AS p50_ms,
+                           ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY value_ms)::numeric, 2)::float AS p95_ms
+                    FROM call_metric_samples
+                    WHERE recorded_at >= NOW() - make_interval(hours => %s)
+                      AND (%s::text IS NULL OR agent_name = %s)
+                    GROUP BY metric, label
+                    ORDER BY metric, label;
+                """, (hours, agent_name, agent_name))
+                return cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching latency percentiles: {e}")
+            return None
+        finally:
+            conn.close()
+
+    # semantic search part
+
+    SEMANTIC_SOURCES = {
+        "complaints": {
+            "new_rows": """
+                SELECT complaint_id AS id, complaint_description AS text
+                FROM complaints
+                WHERE complaint_id > %s
+                ORDER BY complaint_id ASC
+                LIMIT %s
+            """,
+            "by_ids": """
+                SELECT complaint_id AS id, customer_name, customer_phone_number,
+                       complaint_description AS text, complaint_category, status,
+                       priority_score, created_at
+                FROM complaints
+                WHERE complaint_id = ANY(%s)
+            """,
+        },
+        "transcripts": {
+            "new_rows": """
+                SELECT id, call_transcript AS text
+                FROM transcripts
+                WHERE id > %s
+                ORDER BY id ASC
+                LIMIT %s
+            """,
+            "by_ids": """
+                SELECT id, phone_number, call_transcript AS text, called_at
+                FROM transcripts
+                WHERE id = ANY(%s)
+            """,
+        },
+    }
+
+    def get_semantic_rows_after(self, source: str, after_id: int, limit: int = 500) -> List[Dict]:
+        """Returns up to 'limit' (id, text) rows of a semantic search source with id > after_id."""
+        conn = self.connect()
+        if not conn:
+            return []
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(self.SEMANTIC_SOURCES[source]["new_rows"], (after_id, limit))
+                return cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching {source} rows for semantic index: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_semantic_rows_by_ids(self, source: str, ids: List[int]) -> Dict[int, Dict]:
+        """Returns display rows of a semantic search source keyed by id."""
+        if not ids:
+            return {}
+        conn = self.connect()
+        if not conn:
+            return {}
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(self.SEMANTIC_SOURCES[source]["by_ids"], (list(ids),))
+                return {row["id"]: row for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"Error fetching {source} rows by id: {e}")
+            return {}
+        finally:
+            conn.close()
@@ -0,0 +1,129 @@
+# dispatcher.py
+"""
+Starts outbound calls by dispatching the agent through the LiveKit server API.
+
+Replaces shelling out to `lk dispatch create --new-room`: the dispatch is an
+in-process request over one persistent LiveKitAPI session (created lazily on
+the caller's event loop), concurrent dispatches are bounded by a semaphore,
+and failures surface as DispatchError instead of a lost exit code.
+
+LIVEKIT_URL / LIVEKIT_API_KEY / LIVEKIT_API_SECRET configure the server, so
+pointing LIVEKIT_URL at a local mock is enough to test it.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from typing import Dict, Optional
+
+import aiohttp
+from dotenv import load_dotenv
+from livekit import api
+
+load_dotenv(".env.local")
+
+logger = logging.getLogger("dispatcher")
+
+DEFAULT_AGENT_NAME = "outbound-caller"
+
+
+class DispatchError(Exception):
+    """Raised when the LiveKit server rejects or does not answer a dispatch."""
+
+
+class LiveKitDispatcher:
+    def __init__(self, url: Optional[str] = None, api_key: Optional[str] = None,
+                 api_secret: Optional[str] = None, agent_name: str = DEFAULT_AGENT_NAME,
+                 max_concurrent: int = 10, timeout: float = 10.0):
+        self.url = url or os.getenv("LIVEKIT_URL")
+        self.api_key = api_key or os.getenv("LIVEKIT_API_KEY")
+        self.api_secret = api_secret or os.getenv("LIVEKIT_API_SECRET")
+        self.agent_name = agent_name
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._api: Optional[api.LiveKitAPI] = None
+
+    def _client(self) -> api.LiveKitAPI:
+        # The client's HTTP session binds to the running loop, so it is created on first use
+        if self._api is None:
+            self._api = api.LiveKitAPI(
+                self.url, self.api_key, self.api_secret,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._api
+
+    async def dispatch(self, metadata: str, room_name: Optional[str] = None,
+                       agent_name: Optional[str] = None) -> Dict[str, str]:
+        """
+        Dispatches the agent into a new room (or `room_name`) with the given job
+        metadata, which the outbound agents read as the number to dial.
+        Returns {"dispatch_id", "room"}.
+        """
+        room_name = room_name or f"call-{uuid.uuid4().hex[:12]}"
+        request = api.CreateAgentDispatchRequest(
+            agent_name=agent_name or self.agent_name,
+            room=room_name,
+            metadata=metadata,
+        )
+        async with self._semaphore:
+            try:
+                dispatch = await asyncio.wait_for(
+                    self._client().agent_dispatch.create_dispatch(request), timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                raise DispatchError(f"dispatch to {room_name} timed out after {self.timeout}s")
+            except Exception as e:
+                raise DispatchError(f"dispatch to {room_name} failed: {e}") from e
+        logger.info(f"dispatched {request.agent_name} to {room_name} ({dispatch.id})")
+        return {"dispatch_id": dispatch.id, "room": room_name}
+
+    async def room_exists(self, room_name: str) -> Optional[bool]:
+        """Whether the room is still open on the server; None when the server could not be asked."""
+        try:
+            response = await asyncio.wait_for(
+                self._client().room.list_rooms(api.ListRoomsRequest(names=[room_name])), timeout=self.timeout
+            )
+        except Exception as e:
+            logger.warning(f"could not look up room {room_name}: {e}")
+            return None
+        return len(response.rooms) > 0
+
+    async def wait_for_outcome(self, outcome: asyncio.Future, room_name: str, timeout: float,
+                               check_interval: float = 60.0) -> Optional[Dict]:
+        """
+        Waits for the call outcome the agent in `room_name` publishes. After
+        `timeout` the room is checked every `check_interval`: a call that is
+        still live (or cannot be checked) is waited for, and None is returned
+        once the room has closed without an outcome.
+        """
+        wait, room_closed = timeout, False
+        while True:
+            try:
+                # shielded so a timeout does not cancel the future the outcome is delivered to
+                return await asyncio.wait_for(asyncio.shield(outcome), timeout=wait)
+            except asyncio.TimeoutError:
+                if room_closed:
+                    return None
+            # the agent publishes the outcome while shutting down, after leaving the
+            # room, so a closed room still gets one more interval
+            room_closed = await self.room_exists(room_name) is False
+            if not room_closed:
+                logger.info(f"no outcome from {room_name} yet, the call is still live")
+            wait = check_interval
+
+    async def close(self) -> None:
+        if self._api is not None:
+            await self._api.aclose()
+            self._api = None
+
+
+def dispatch_call(metadata: str, agent_name: str = DEFAULT_AGENT_NAME) -> Dict[str, str]:
+    """Blocking one-off dispatch for callers without an event loop (the Streamlit app)."""
+    async def run():
+        dispatcher = LiveKitDispatcher(agent_name=agent_name, max_concurrent=1)
+        try:
+            return await dispatcher.dispatch(metadata)
+        finally:
+            await dispatcher.close()
+
+    return asyncio.run(run())
@@ -0,0 +1,185 @@
+# events.py
+"""
+Live change feed for the dashboards.
+
+Writers (DatabaseManager, the voice agents) publish small JSON deltas with
+Postgres NOTIFY inside the same transaction as the change, so an event is only
+delivered once the row is committed. The API process LISTENs on one dedicated
+connection and fans the events out to every connected client through an
+in-process EventBus.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional, Set
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger("events")
+
+EVENT_CHANNEL = "bpo_events"
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7500
+TRUNCATED_FIELD_CHARS = 2000
+MIN_TRUNCATED_FIELD_CHARS = 100
+
+
+def _dumps(event: Dict) -> str:
+    # raw UTF-8 rather than \uXXXX escapes: up to 4 bytes per character instead of 12
+    return json.dumps(event, default=str, ensure_ascii=False)
+
+
+def _fits(payload: str) -> bool:
+    return len(payload.encode("utf-8")) < MAX_PAYLOAD_BYTES
+
+
+def build_event_payload(event_type: str, data: Dict) -> str:
+    """
+    Serialises an event for pg_notify. Long text fields are cut until the
+    payload fits the byte limit; if even short text does not fit, the text
+    fields are dropped and subscribers get the ids only.
+    """
+    event = {
+        "type": event_type,
+        "data": data,
+        "emitted_at": datetime.now(timezone.utc).isoformat(),
+    }
+    payload = _dumps(event)
+    limit = TRUNCATED_FIELD_CHARS
+    while not _fits(payload) and limit >= MIN_TRUNCATED_FIELD_CHARS:
+        trimmed = dict(data)
+        for key, value in data.items():
+            if isinstance(value, str) and len(value) > limit:
+                trimmed[key] = value[:limit]
+                trimmed["truncated"] = True
+        event["data"] = trimmed
+        payload = _dumps(event)
+        limit //= 2
+    if not _fits(payload):
+        event["data"] = {key: value for key, value in data.items() if not isinstance(value, str) or key.endswith("id")}
+        event["data"]["truncated"] = True
+        payload = _dumps(event)
+    return payload
+
+
+def notify_event(cursor, event_type: str, data: Dict) -> None:
+    """Queues an event on the cursor's transaction; it is delivered on commit."""
+    cursor.execute("SELECT pg_notify(%s, %s)", (EVENT_CHANNEL, build_event_payload(event_type, data)))
+
+
+class EventBus:
+    """Fans events out to per-subscriber queues. Must be used from a single event loop."""
+
+    def __init__(self, max_queue_size: int = 500):
+        self.max_queue_size = max_queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    def publish(self, event: Dict) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                # A slow client loses its oldest delta rather than stalling everyone else
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+
+class PostgresEventListener:
+    """
+    Holds one LISTEN connection and forwards notifications to an EventBus.
+
+    The socket is registered with the running event loop, so no thread or
+    polling loop is needed. If the connection drops it is re-established with
+    exponential backoff.
+    """
+
+    def __init__(self, connection_params: Dict, bus: EventBus, channel: str = EVENT_CHANNEL):
+        self.connection_params = connection_params
+        self.bus = bus
+        self.channel = channel
+        self._conn: Optional[psycopg2.extensions.connection] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = False
+        try:
+            self._listen()
+        except Exception as e:
+            logger.error(f"Could not LISTEN on {self.channel}: {e}")
+            self._schedule_reconnect()
+
+    def stop(self) -> None:
+        self._stopped = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        self._close()
+
+    def _listen(self) -> None:
+        conn = psycopg2.connect(**self.connection_params)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel};")
+        self._conn = conn
+        self._loop.add_reader(conn.fileno(), self._drain)
+        logger.info(f"Listening for events on channel '{self.channel}'")
+
+    def _drain(self) -> None:
+        try:
+            self._conn.poll()
+        except Exception as e:
+            logger.error(f"Event listener connection lost: {e}")
+            self._close()
+            self._schedule_reconnect()
+            return
+
+        while self._conn.notifies:
+            notification = self._conn.notifies.pop(0)
+            try:
+                self.bus.publish(json.loads(notification.payload))
+            except ValueError:
+                logger.warning(f"Dropping malformed event payload: {notification.payload[:200]}")
+
+    def _close(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._loop.remove_reader(self._conn.fileno())
+        except Exception:
+            pass
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _schedule_reconnect(self) -> None:
+        if self._stopped or (self._reconnect_task and not self._reconnect_task.done()):
+            return
+        self._reconnect_task = self._loop.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = 1.0
+        while not self._stopped:
+            await asyncio.sleep(delay)
+            try:
+                self._listen()
+                return
+            except Exception as e:
+                logger.error(f"Event listener reconnect failed: {e}")
+                delay = min(delay * 2, 30.0)
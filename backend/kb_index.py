@@ -0,0 +1,191 @@
+# kb_index.py
+"""
+On-disk layout of a knowledge base index, sized for large KBs.
+
+The FAISS index comes from a factory string (KB_INDEX_FACTORY), e.g.
+
+    Flat                 exact search, the full float32 matrix (default for small KBs)
+    IVF1024,Flat         inverted lists, exact vectors, searches KB_IVF_NPROBE lists
+    IVF1024,SQ8          inverted lists with 8-bit scalar quantization (4x smaller)
+    IVF1024,PQ16         product quantization, 16 bytes per vector
+    HNSW32               graph index, KB_HNSW_EF_SEARCH candidates per query
+    auto                 picks one of the above from the number of vectors
+
+Trainable indexes are trained on a sample of the embeddings; when there are
+too few vectors to train the requested index, exact Flat search is used.
+Indexes are opened with IO_FLAG_MMAP so their arrays stay in the page cache
+rather than worker RSS.
+
+Chunks are stored as one UTF-8 file plus an int64 offsets array
+(chunks.bin / chunks.idx). ChunkStore memory-maps both and decodes a chunk
+only when it is read, so loading a KB no longer unpickles every chunk.
+"""
+import hashlib
+import math
+import mmap
+import os
+from typing import Iterable, Optional
+
+import faiss
+import numpy as np
+
+INDEX_FILE = "faiss.index"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.idx"
+# content hash of the chunk store; derived indexes (BM25) record it to detect staleness
+CHUNKS_HASH_FILE = "chunks.sha256"
+
+INDEX_FACTORY = os.getenv("KB_INDEX_FACTORY", "auto")
+IVF_NPROBE = int(os.getenv("KB_IVF_NPROBE", "16"))
+HNSW_EF_SEARCH = int(os.getenv("KB_HNSW_EF_SEARCH", "64"))
+# FAISS wants roughly this many training points per IVF list / PQ centroid
+TRAINING_POINTS_PER_CENTROID = 39
+MAX_TRAINING_POINTS = 256 * 1024
+
+
+def auto_index_spec(num_vectors: int) -> str:
+    if num_vectors < 10_000:
+        return "Flat"
+    nlist = 1 << int(math.log2(4 * math.sqrt(num_vectors)))
+    if num_vectors < 1_000_000:
+        return f"IVF{nlist},SQ8"
+    return f"IVF{nlist},PQ32"
+
+
+def _min_training_points(index: faiss.Index, spec: str) -> int:
+    needed = 1
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        needed = ivf.nlist * TRAINING_POINTS_PER_CENTROID
+    if "PQ" in spec:
+        # 256 centroids per sub-quantizer
+        needed = max(needed, 256 * TRAINING_POINTS_PER_CENTROID)
+    return needed
+
+
+def build_index(embeddings: np.ndarray, spec: str = INDEX_FACTORY) -> faiss.Index:
+    """Creates, trains and fills an index for the (n, d) float32 embeddings."""
+    n, dimension = embeddings.shape
+    if spec == "auto":
+        spec = auto_index_spec(n)
+    index = faiss.index_factory(dimension, spec)
+    if not index.is_trained:
+        if n < _min_training_points(index, spec):
+            print(f"{n} vectors are too few to train {spec}; using exact Flat search.")
+            index = faiss.IndexFlatL2(dimension)
+        else:
+            rng = np.random.default_rng(0)
+            sample = embeddings if n <= MAX_TRAINING_POINTS else embeddings[
+                rng.choice(n, MAX_TRAINING_POINTS, replace=False)]
+            index.train(sample)
+    index.add(embeddings)
+    configure_search(index)
+    return index
+
+
+def configure_search(index: faiss.Index) -> faiss.Index:
+    """Applies the query-time knobs (IVF nprobe, HNSW efSearch) to a built or loaded index."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(IVF_NPROBE, ivf.nlist)
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def write_index(index: faiss.Index, persist_dir: str) -> None:
+    path = os.path.join(persist_dir, INDEX_FILE)
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def read_index(persist_dir: str) -> faiss.Index:
+    """Memory-maps the index where its type allows it, otherwise reads it into memory."""
+    path = os.path.join(persist_dir, INDEX_FILE)
+    try:
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        index = faiss.read_index(path)
+    return configure_search(index)
+
+
+def write_chunk_store(chunks: Iterable[str], persist_dir: str) -> None:
+    """Streams chunks to chunks.bin, their byte offsets to chunks.idx and their hash to chunks.sha256."""
+    os.makedirs(persist_dir, exist_ok=True)
+    data_path = os.path.join(persist_dir, CHUNKS_FILE)
+    offsets = [0]
+    digest = hashlib.sha256()
+    with open(data_path + ".tmp", "wb") as f:
+        for chunk in chunks:
+            encoded = chunk.encode("utf-8")
+            f.write(encoded)
+            digest.update(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    offsets = np.asarray(offsets, dtype=np.int64)
+    # the offsets are hashed too: the same text split differently is a different store
+    digest.update(offsets.tobytes())
+    offsets_path = os.path.join(persist_dir, OFFSETS_FILE)
+    with open(offsets_path + ".tmp", "wb") as f:
+        np.save(f, offsets)
+    os.replace(data_path + ".tmp", data_path)
+    os.replace(offsets_path + ".tmp", offsets_path)
+    _write_text(os.path.join(persist_dir, CHUNKS_HASH_FILE), digest.hexdigest())
+
+
+def chunk_store_hash(persist_dir: str) -> str:
+    """
+    The hash written with the chunk store; stores written before it existed
+    are hashed once here and the result saved.
+    """
+    hash_path = os.path.join(persist_dir, CHUNKS_HASH_FILE)
+    try:
+        with open(hash_path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    digest = hashlib.sha256()
+    with open(os.path.join(persist_dir, CHUNKS_FILE), "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(np.load(os.path.join(persist_dir, OFFSETS_FILE)).astype(np.int64).tobytes())
+    _write_text(hash_path, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path + ".tmp", "w") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+class ChunkStore:
+    """Read-only, list-like access to the chunks written by write_chunk_store."""
+
+    def __init__(self, persist_dir: str):
+        self._offsets = np.load(os.path.join(persist_dir, OFFSETS_FILE), mmap_mode="r")
+        self._file = open(os.path.join(persist_dir, CHUNKS_FILE), "rb")
+        size = int(self._offsets[-1])
+        # mmap cannot map an empty file
+        self._data: Optional[mmap.mmap] = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        )
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._data[start:end].decode("utf-8") if self._data is not None else ""
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def close(self) -> None:
+        if self._data is not None:
+            self._data.close()
+        self._file.close()
@@ -0,0 +1,282 @@
+# llm_gateway.py
+"""
+Shared client for the OpenAI-compatible chat completion APIs (Groq, OpenAI,
+or any server speaking the same protocol).
+
+One httpx.Client per provider keeps connections alive across requests, and
+every request goes through:
+
+  - rate limiting: per-provider token buckets for requests and tokens per
+    minute, matching the provider's quotas, so bursts queue locally instead
+    of being answered with 429s. Each request reserves its estimated prompt
+    plus max_tokens, and the unused part is refunded from the response's
+    usage, so pass a realistic max_tokens for short answers;
+  - timeouts and retries: 408/429/5xx responses, timeouts and connection
+    errors are retried with exponential backoff and full jitter, honouring
+    Retry-After;
+  - hedging: once a provider has enough latency samples, a request still
+    running after its LLM_HEDGE_PERCENTILE latency is sent a second time and
+    the first answer wins. The duplicate is only sent, and charged, if both
+    rate limiters have room for it;
+  - fallback: providers are tried in LLM_PROVIDERS order, moving on when one
+    keeps failing.
+
+Providers are configured from the environment:
+
+    LLM_PROVIDERS=groq,openai        # try order
+    LLM_<NAME>_BASE_URL=...          # defaults known for groq and openai
+    LLM_<NAME>_API_KEY=...           # defaults to GROQ_API_KEY / OPENAI_API_KEY
+    LLM_<NAME>_MODEL=...             # overrides the caller's model (needed for fallbacks)
+    LLM_<NAME>_RPM=30 LLM_<NAME>_TPM=6000
+
+To try a configuration (e.g. against a local stub server):
+
+    LLM_PROVIDERS=stub LLM_STUB_BASE_URL=http://127.0.0.1:8001/v1 python llm_gateway.py "Say hi"
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from ratelimit import TokenBucket
+
+load_dotenv(dotenv_path=".env.local")
+
+logger = logging.getLogger("llm-gateway")
+
+KNOWN_PROVIDERS = {
+    "groq": {"base_url": "https://api.groq.com/openai/v1", "api_key_env": "GROQ_API_KEY"},
+    "openai": {"base_url": "https://api.openai.com/v1", "api_key_env": "OPENAI_API_KEY", "model": "gpt-4o-mini"},
+}
+
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+CONNECT_TIMEOUT = 3.0
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+# longest a request waits for the rate limiter before trying the next provider
+RATE_LIMIT_WAIT = float(os.getenv("LLM_RATE_LIMIT_WAIT_SECONDS", "30"))
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# hedging starts once a provider has this many latency samples; 0 disables it
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 200
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# a provider answering these is misconfigured for this request; try the next one
+FALLBACK_STATUS = {401, 403, 404}
+DEFAULT_MAX_TOKENS = 512
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, provider: Optional[str] = None, status: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.provider = provider
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status in RETRYABLE_STATUS
+
+
+class Provider:
+    def __init__(self, name: str, base_url: str, api_key: Optional[str], model: Optional[str] = None,
+                 requests_per_minute: float = 30, tokens_per_minute: float = 6000):
+        self.name = name
+        self.model = model
+        self.client = httpx.Client(
+            base_url=base_url.rstrip("/"),
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else {},
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+        self.requests = TokenBucket(requests_per_minute / 60, capacity=max(1.0, requests_per_minute / 6))
+        self.tokens = TokenBucket(tokens_per_minute / 60, capacity=tokens_per_minute)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str) -> "Provider":
+        defaults = KNOWN_PROVIDERS.get(name, {})
+        prefix = f"LLM_{name.upper()}_"
+        base_url = os.getenv(prefix + "BASE_URL", defaults.get("base_url"))
+        if not base_url:
+            raise ValueError(f"{prefix}BASE_URL is not set for LLM provider {name!r}")
+        return cls(
+            name,
+            base_url,
+            os.getenv(prefix + "API_KEY") or os.getenv(defaults.get("api_key_env", ""), None),
+            model=os.getenv(prefix + "MODEL", defaults.get("model")),
+            requests_per_minute=float(os.getenv(prefix + "RPM", "30")),
+            tokens_per_minute=float(os.getenv(prefix + "TPM", "6000")),
+        )
+
+    def record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self) -> Optional[float]:
+        """The HEDGE_PERCENTILE latency, or None while there are too few samples to hedge."""
+        with self._lock:
+            if not HEDGE_MIN_SAMPLES or len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            samples = sorted(self._latencies)
+        return samples[min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100))]
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def _estimate_tokens(payload: Dict) -> int:
+    # ~4 characters per token, plus the completion budget
+    prompt_chars = sum(len(m.get("content") or "") for m in payload["messages"])
+    return prompt_chars // 4 + payload.get("max_tokens", DEFAULT_MAX_TOKENS)
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+class LLMGateway:
+    def __init__(self, providers: List[Provider], max_workers: int = 16):
+        if not providers:
+            raise ValueError("at least one LLM provider is required")
+        self.providers = providers
+        # runs the original and hedged copies of a request
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-gateway")
+
+    @classmethod
+    def from_env(cls) -> "LLMGateway":
+        names = [n.strip() for n in os.getenv("LLM_PROVIDERS", "groq").split(",") if n.strip()]
+        return cls([Provider.from_env(name) for name in names])
+
+    def chat(self, messages: List[Dict], model: str, **params) -> str:
+        """The first choice's message content; params go to the API as-is (temperature, max_tokens, ...)."""
+        response = self.complete(messages, model, **params)
+        try:
+            return response["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            raise LLMError(f"Malformed completion response: {json.dumps(response)[:200]}")
+
+    def complete(self, messages: List[Dict], model: str, **params) -> Dict:
+        """The raw chat completion JSON from the first provider that answers."""
+        error: Optional[LLMError] = None
+        for provider in self.providers:
+            payload = {"model": provider.model or model, "messages": messages, **params}
+            try:
+                return self._with_retries(provider, payload)
+            except LLMError as e:
+                if not e.retryable and e.status not in FALLBACK_STATUS:
+                    raise
+                logger.warning(f"LLM provider {provider.name} failed ({e}); trying the next one")
+                error = e
+        raise error
+
+    def _with_retries(self, provider: Provider, payload: Dict) -> Dict:
+        reserved = min(_estimate_tokens(payload), int(provider.tokens.capacity))
+        for attempt in range(MAX_RETRIES + 1):
+            if not (provider.requests.acquire(1, timeout=RATE_LIMIT_WAIT)
+                    and provider.tokens.acquire(reserved, timeout=RATE_LIMIT_WAIT)):
+                raise LLMError("rate limit wait exceeded", provider.name)
+            try:
+                return self._hedged(provider, payload, reserved)
+            except LLMError as e:
+                # a long Retry-After is better spent on the next provider
+                if not e.retryable or attempt == MAX_RETRIES or (e.retry_after or 0) > BACKOFF_MAX:
+                    raise
+                delay = e.retry_after or random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                logger.info(f"LLM request to {provider.name} failed ({e}); retry {attempt + 1} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _hedged(self, provider: Provider, payload: Dict, reserved: int) -> Dict:
+        delay = provider.hedge_delay()
+        if delay is None:
+            return self._send(provider, payload, reserved)
+        pending = {self._executor.submit(self._send, provider, payload, reserved)}
+        done, pending = wait(pending, timeout=delay)
+        # only hedge when both quotas have room for the duplicate
+        if not done and self._try_reserve(provider, reserved):
+            logger.debug(f"Hedging LLM request to {provider.name} after {delay:.2f}s")
+            pending.add(self._executor.submit(self._send, provider, payload, reserved))
+        error = None
+        while done or pending:
+            for future in done:
+                try:
+                    return future.result()
+                except LLMError as e:
+                    error = e
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        raise error
+
+    @staticmethod
+    def _try_reserve(provider: Provider, tokens: int) -> bool:
+        if not provider.tokens.try_acquire(tokens):
+            return False
+        if not provider.requests.try_acquire():
+            provider.tokens.refund(tokens)
+            return False
+        return True
+
+    def _send(self, provider: Provider, payload: Dict, reserved: int) -> Dict:
+        """One HTTP attempt; settles the `reserved` tokens against the actual usage."""
+        start = time.perf_counter()
+        try:
+            response = provider.client.post("/chat/completions", json=payload)
+        except httpx.HTTPError as e:
+            # the provider may have done the work; keep the reservation
+            raise LLMError(f"{type(e).__name__}: {e}", provider.name)
+        if response.status_code != 200:
+            provider.tokens.refund(reserved)
+            raise LLMError(f"HTTP {response.status_code}: {response.text[:200]}", provider.name,
+                           response.status_code, _retry_after(response))
+        provider.record_latency(time.perf_counter() - start)
+        try:
+            result = response.json()
+        except ValueError:
+            raise LLMError("Response is not JSON", provider.name)
+        used = (result.get("usage") or {}).get("total_tokens") if isinstance(result, dict) else None
+        if isinstance(used, int):
+            provider.tokens.refund(reserved - used)
+        return result
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        for provider in self.providers:
+            provider.close()
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """The process-wide gateway, created from the environment on first use."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway.from_env()
+    return _gateway
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    gateway = get_gateway()
+    prompt = " ".join(sys.argv[1:]) or "Reply with the word ok."
+    start = time.perf_counter()
+    answer = gateway.chat([{"role": "user", "content": prompt}],
+                          model=os.getenv("LLM_CHECK_MODEL", "llama-3.3-70b-versatile"), max_tokens=50)
+    print(f"{answer!r} in {(time.perf_counter() - start) * 1000:.0f} ms")
+    gateway.close()
@@ -1,8 +1,11 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, status, Body
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, status, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
+import asyncio
+import json
 import uvicorn
 import pandas as pd
 import firebase_admin
@@ -11,7 +14,10 @@ from firebase_admin import auth  # for verifying Firebase tokens
 
 from database import DatabaseManager
 from ai_analyzer import ComplaintAnalyzer
-from call_agent import resolve, resolve_db
+from call_agent import resolve_db
+from dispatcher import LiveKitDispatcher, DispatchError
+from events import EventBus, PostgresEventListener
+from semantic_search import SemanticSearch, SOURCES as SEMANTIC_SOURCES
 
 app = FastAPI(title="BPO Complaint System API")
 
@@ -22,6 +28,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # the complaints list reports its total match count in a header
+    expose_headers=["X-Total-Count"],
 )
 
 # Initialize Firebase Admin, if not already
@@ -33,6 +41,25 @@ if not firebase_admin._apps:
 db = DatabaseManager()
 db.create_tables()  # <-- This ensures tables exist
 analyzer = ComplaintAnalyzer()
+semantic_search = SemanticSearch(db)
+semantic_search.load()
+
+# Live change feed: one LISTEN connection fanned out to all SSE clients
+event_bus = EventBus()
+event_listener = PostgresEventListener(db.connection_params, event_bus)
+
+# Outbound calls are dispatched in-process over one persistent LiveKit API session
+dispatcher = LiveKitDispatcher()
+
+@app.on_event("startup")
+async def start_event_listener():
+    event_listener.start()
+    semantic_search.refresh_in_background()
+
+@app.on_event("shutdown")
+async def stop_event_listener():
+    event_listener.stop()
+    await dispatcher.close()
 
 # -------------------
 # Pydantic models
@@ -55,6 +82,9 @@ class ComplaintResponse(ComplaintBase):
     past_count: Optional[int]
     knowledge_base_solution: Optional[str]
     complaint_category: Optional[str]
+    # Only set when the list was produced by a full-text search
+    search_rank: Optional[float] = None
+    search_highlight: Optional[str] = None
 
 class ScheduleCallback(BaseModel):
     complaint_id: int
@@ -69,8 +99,14 @@ class UserUpdate(BaseModel):
 # -------------------
 # Complaint Routes
 # -------------------
+# full-text search results per page when no limit is given
+SEARCH_PAGE_SIZE = 100
+
 @app.post("/complaints/", response_model=ComplaintResponse)
-async def create_complaint(complaint: ComplaintBase):
+def create_complaint(complaint: ComplaintBase):
+    # sync so FastAPI runs it in the threadpool: the LLM calls below would
+    # otherwise block the event loop, and concurrent identical complaints
+    # could never share them (see singleflight)
     token = db.generate_random_string()
     print("Token:", token)
 
@@ -91,8 +127,8 @@ async def create_complaint(complaint: ComplaintBase):
         complaint.complaint_description, past_count
     )
     problem_description = complaint.complaint_description
-    solution = resolve_db(problem_description)
-    category = analyzer.get_complaint_category(problem_description)
+    category, category_source = analyzer.classify_complaint(problem_description)
+    solution = resolve_db(problem_description, category=category)
 
     success = db.submit_complaint(
         complaint.customer_name,
@@ -105,10 +141,12 @@ async def create_complaint(complaint: ComplaintBase):
         first_similar_token,
         past_count,
         solution,
-        category
+        category,
+        category_source
     )
     if not success:
         raise HTTPException(status_code=500, detail="Failed to submit complaint")
+    semantic_search.refresh_in_background()
 
     # Return the newest complaint
     complaints = db.get_complaints()
@@ -116,31 +154,40 @@ async def create_complaint(complaint: ComplaintBase):
 
 @app.get("/complaints/", response_model=List[ComplaintResponse])
 async def get_complaints(
+    response: Response,
     status: Optional[str] = None,
     priority: Optional[str] = None,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0),
 ):
-    df = db.get_complaints()
-    print("knowledge base part in get complaint",df)
-
-    # Apply filters
-    if status and status.lower() != "all":
-        df = df[df["status"].str.lower() == status.lower()]
-
-    if priority and priority.lower() != "all":
-        if priority.lower() == "high":
-            df = df[df["priority_score"] >= 0.7]
-        elif priority.lower() == "medium":
-            df = df[(df["priority_score"] >= 0.4) & (df["priority_score"] < 0.7)]
-        else:
-            df = df[df["priority_score"] < 0.4]
-
+    """
+    Complaints matching the filters. With `search`, a ranked page of
+    `limit` (default 100) matches; without, every complaint unless `limit` is
+    given. X-Total-Count is the number of matches before paging.
+    """
     if search:
-        df = df[
-            df["customer_name"].str.contains(search, case=False)
-            | df["complaint_description"].str.contains(search, case=False)
-        ]
-
+        # Ranked full-text search; filters and paging are applied in SQL
+        df, total = db.search_complaints(search, status, priority, limit or SEARCH_PAGE_SIZE, offset)
+    else:
+        df = db.get_complaints()
+        print("knowledge base part in get complaint",df)
+
+        # Apply filters
+        if status and status.lower() != "all":
+            df = df[df["status"].str.lower() == status.lower()]
+
+        if priority and priority.lower() != "all":
+            if priority.lower() == "high":
+                df = df[df["priority_score"] >= 0.7]
+            elif priority.lower() == "medium":
+                df = df[(df["priority_score"] >= 0.4) & (df["priority_score"] < 0.7)]
+            else:
+                df = df[df["priority_score"] < 0.4]
+        total = len(df)
+        df = df.iloc[offset:offset + limit] if limit else df.iloc[offset:]
+
+    response.headers["X-Total-Count"] = str(total)
     return [
         {
             **row.to_dict(),
@@ -167,11 +214,11 @@ async def resolve_complaint(complaint_id: int):
         raise HTTPException(status_code=404, detail="Complaint not found")
 
     # Resolve
-    resolve(
-        complaint.iloc[0]["customer_phone_number"],
-        complaint.iloc[0]["complaint_description"],
-    )
-    return {"message": "Complaint resolved successfully"}
+    try:
+        dispatch = await dispatcher.dispatch(str(complaint.iloc[0]["customer_phone_number"]))
+    except DispatchError as e:
+        raise HTTPException(status_code=502, detail=f"Could not start the call: {e}")
+    return {"message": "Complaint resolved successfully", **dispatch}
 
 @app.post("/complaints/{complaint_id}/toggleResolve")
 async def toggle_resolve_complaint(complaint_id: int):
@@ -409,10 +456,59 @@ async def update_user(
     raise HTTPException (status_code=400, detail="Failed to update user")
 
 
-@app.get("/calls")
-async def get_calls(current_user: CurrentUser = Depends(get_current_user)):
-    calls_df = db.get_calls_with_messages()
-    return calls_df.to_dict(orient="records")
+class CallSummaryResponse(BaseModel):
+    call_id: str
+    caller: str
+    receiver: str
+    start_time: datetime
+    end_time: Optional[datetime]
+    created_at: Optional[datetime]
+    duration_seconds: Optional[float]
+    message_count: int
+    last_message_at: Optional[datetime]
+
+class CallPageResponse(BaseModel):
+    items: List[CallSummaryResponse]
+    total: int
+    limit: int
+    offset: int
+
+class CallMessageResponse(BaseModel):
+    message_id: str
+    sender: str
+    message: str
+    timestamp: datetime
+
+class CallMessagePageResponse(BaseModel):
+    call_id: str
+    items: List[CallMessageResponse]
+    total: int
+    limit: int
+    offset: int
+
+@app.get("/calls", response_model=CallPageResponse)
+async def get_calls(
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """List calls newest first as summary rows; fetch transcripts via /calls/{call_id}/messages."""
+    calls, total = db.get_calls_summary(limit, offset)
+    return {"items": calls, "total": total, "limit": limit, "offset": offset}
+
+@app.get("/calls/{call_id}/messages", response_model=CallMessagePageResponse)
+async def get_call_messages(
+    call_id: str,
+    limit: int = Query(100, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """Page through a single call's messages in chronological order."""
+    result = db.get_call_messages(call_id, limit, offset)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Call not found")
+    messages, total = result
+    return {"call_id": call_id, "items": messages, "total": total, "limit": limit, "offset": offset}
 
 @app.post("/calls")
 async def create_call(call: dict, current_user: CurrentUser = Depends(get_current_user)):
@@ -439,6 +535,31 @@ async def add_message(
         raise HTTPException(status_code=500, detail="Failed to add message")
     return {"success": True}
 
+class MessageIn(BaseModel):
+    sender: str
+    message: str
+    client_message_id: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
+class MessageBatch(BaseModel):
+    messages: List[MessageIn] = Field(..., min_length=1, max_length=1000)
+
+@app.post("/calls/{call_id}/messages/batch")
+async def add_messages_batch(
+    call_id: str,
+    batch: MessageBatch,
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Append many transcript messages in one request and one transaction.
+    Order is preserved; messages carrying an already stored client_message_id
+    are skipped, so retrying a batch is safe.
+    """
+    result = db.add_messages_batch(call_id, [m.dict() for m in batch.messages])
+    if result is None:
+        raise HTTPException(status_code=500, detail="Failed to add messages")
+    return {"success": True, **result}
+
 # -------------------
 # Graph Endpoints
 # -------------------
@@ -526,6 +647,99 @@ def get_transcripts():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching transcripts: {str(e)}")
 
+class LatencyMetricResponse(BaseModel):
+    metric: str
+    label: str
+    calls: int
+    samples: int
+    p50_ms: float
+    p95_ms: float
+
+@app.get("/metrics/latency", response_model=List[LatencyMetricResponse])
+def get_latency_metrics(hours: int = Query(24, ge=1, le=24 * 90), agent_name: Optional[str] = None):
+    """p50/p95 voice latency (STT, LLM TTFT, TTS TTFB, end of utterance, tool calls) across recent calls."""
+    rows = db.get_latency_percentiles(hours, agent_name)
+    if rows is None:
+        raise HTTPException(status_code=500, detail="Error fetching latency metrics")
+    return rows
+
+# -------------------
+# Semantic Search
+# -------------------
+@app.get("/search/semantic")
+def search_semantic(
+    q: Optional[str] = None,
+    complaint_id: Optional[int] = None,
+    source: str = "all",
+    k: int = Query(5, ge=1, le=50)
+):
+    """
+    Top-k complaints and/or transcripts by meaning rather than wording.
+
+    Pass `q` for free text ("customer mentioned router reset") or
+    `complaint_id` to find complaints and calls like an existing complaint.
+    `source` is one of all, complaints, transcripts.
+    """
+    if source == "all":
+        sources = list(SEMANTIC_SOURCES)
+    elif source in SEMANTIC_SOURCES:
+        sources = [source]
+    else:
+        raise HTTPException(status_code=400, detail=f"source must be one of: all, {', '.join(SEMANTIC_SOURCES)}")
+
+    if complaint_id is not None:
+        results = semantic_search.similar_to_complaint(complaint_id, sources, k)
+        if results is None:
+            raise HTTPException(status_code=404, detail="Complaint is not in the semantic index yet")
+    elif q:
+        try:
+            results = semantic_search.search(q, sources, k)
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Embedding request failed: {str(e)}")
+    else:
+        raise HTTPException(status_code=400, detail="Provide either q or complaint_id")
+
+    return {"results": results, "index": semantic_search.stats()}
+
+# -------------------
+# Live Events
+# -------------------
+SSE_KEEPALIVE_SECONDS = 15
+
+@app.get("/events/stream")
+async def stream_events(request: Request, types: Optional[str] = None,
+                        current_user: CurrentUser = Depends(get_current_user)):
+    """
+    Server-Sent Events feed of complaint and transcript deltas.
+
+    Event types: complaint.created, complaint.status_changed,
+    complaint.scheduled, message.created. Pass a comma separated `types`
+    query parameter to receive only some of them.
+    """
+    wanted = {t.strip() for t in types.split(",") if t.strip()} if types else None
+    queue = event_bus.subscribe()
+
+    async def event_source():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if wanted and event.get("type") not in wanted:
+                    continue
+                yield f"event: {event.get('type')}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            event_bus.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # -------------------
 # Main
 # -------------------
@@ -0,0 +1,125 @@
+# prompt_builder.py
+"""
+System prompt assembly for the outbound complaint agent.
+
+The LLM re-reads the whole system prompt on every turn, so its size is paid
+as time-to-first-token for the entire call. The static instructions live in
+one template rendered once per process; only the per-call fields (customer
+name, complaint, complaint time, initial solution) are filled in per call,
+after being compacted and cut to a token budget. The stored
+`knowledge_base_solution` is verbose LLM output, so it gets the largest
+budget but is still trimmed at a sentence boundary. The static text comes
+first, so every call shares the same prompt prefix.
+
+build_complaint_prompt returns the prompt together with a PromptStats that
+the agent logs with its call summary.
+"""
+import re
+import string
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from token_count import count_tokens, truncate_tokens
+from tts_cache import CLOSING_PHRASE
+
+# per-field token budgets for the per-call part of the prompt
+FIELD_BUDGETS = {
+    "name": 16,
+    "complaint": 120,
+    "time": 16,
+    "solution": 250,
+}
+
+COMPLAINT_TEMPLATE = string.Template(
+    "You are a voice agent resolving complaints for Bharat Telecom, a broadband company. "
+    "Speak fluent English in short, natural sentences.\n"
+    "The call opens with a greeting that already introduced you and the complaint. "
+    "After the customer replies, explain the initial solution and answer their questions.\n"
+    "Use the tools in this order:\n"
+    "1. search_knowledge_base for anything the initial solution does not cover.\n"
+    "2. change_status to 'resolved' if the complaint is resolved, or 'Human Assistance' if the "
+    "customer wants a human; otherwise leave it unchanged.\n"
+    "3. send_whatsapp with a confirmation of the complaint details.\n"
+    "4. end_call when the customer wants to end the call, after saying exactly: '$closing'\n"
+    "\n"
+    "Customer: $name\n"
+    "Complaint: $complaint\n"
+    "Complaint time: $time\n"
+    "Initial solution: $solution"
+)
+
+_static_template: Optional[string.Template] = None
+_static_tokens: Optional[int] = None
+
+_MARKDOWN = re.compile(r"(\*\*|__|`|^#+\s*|^\s*[-*•]\s+|^\s*\d+[.)]\s+)", re.MULTILINE)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def compact(text) -> str:
+    """Drops markdown emphasis, headings and list markers and collapses whitespace."""
+    if text is None:
+        return ""
+    return " ".join(_MARKDOWN.sub("", str(text)).split())
+
+
+def truncate_to_budget(text: str, budget: int) -> Tuple[str, bool]:
+    """
+    Keeps whole sentences while they fit in `budget` tokens; a first sentence
+    that is already too long is cut at the token limit. Returns (text, truncated).
+    """
+    if count_tokens(text) <= budget:
+        return text, False
+    kept: List[str] = []
+    used = 0
+    for sentence in _SENTENCE_END.split(text):
+        tokens = count_tokens(sentence) + (1 if kept else 0)
+        if used + tokens > budget:
+            break
+        kept.append(sentence)
+        used += tokens
+    if kept:
+        return " ".join(kept), True
+    return truncate_tokens(text, budget).rstrip() + "...", True
+
+
+@dataclass
+class PromptStats:
+    total_tokens: int
+    static_tokens: int
+    field_tokens: Dict[str, int] = field(default_factory=dict)
+    # field -> tokens before truncation, for the fields that were cut
+    truncated: Dict[str, int] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _static() -> Tuple[string.Template, int]:
+    # the fixed instructions are rendered and counted once per process
+    global _static_template, _static_tokens
+    if _static_template is None:
+        rendered = COMPLAINT_TEMPLATE.safe_substitute(closing=CLOSING_PHRASE)
+        _static_template = string.Template(rendered)
+        _static_tokens = count_tokens(rendered.split("Customer: $name")[0])
+    return _static_template, _static_tokens
+
+
+def build_complaint_prompt(complaint_details: Dict,
+                           budgets: Optional[Dict[str, int]] = None) -> Tuple[str, PromptStats]:
+    """Renders the agent's system prompt from AgentDatabase.get_complaint_details output."""
+    budgets = {**FIELD_BUDGETS, **(budgets or {})}
+    template, static_tokens = _static()
+
+    values: Dict[str, str] = {}
+    field_tokens: Dict[str, int] = {}
+    truncated: Dict[str, int] = {}
+    for name, budget in budgets.items():
+        text = compact(complaint_details.get(name)) or "not available"
+        text, was_truncated = truncate_to_budget(text, budget)
+        if was_truncated:
+            truncated[name] = count_tokens(compact(complaint_details.get(name)))
+        values[name] = text
+        field_tokens[name] = count_tokens(text)
+
+    prompt = template.substitute(values)
+    return prompt, PromptStats(count_tokens(prompt), static_tokens, field_tokens, truncated)
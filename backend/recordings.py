@@ -0,0 +1,187 @@
+# recordings.py
+"""
+Streams call recordings to disk with a bounded memory footprint.
+
+download_recording reads the response body in fixed-size chunks into a
+`.part` file next to the destination, hashing as it goes, then fsyncs and
+atomically renames it, so a crash never leaves a truncated file under the
+final name. The SHA-256 is written next to the file in `sha256sum` format.
+File writes and the fsync run in a worker thread so the agent's audio loop
+is never blocked on disk.
+
+Transcoding to a compact audio-only file is optional and runs in a detached
+`python recordings.py transcode <file>` process (ffmpeg, low priority), so
+the call worker never holds the decoded media:
+
+    python recordings.py transcode recordings/call_recording_20250101_120000.mp4
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger("outbound-caller")
+
+RECORDINGS_DIR = "recordings"
+CHUNK_SIZE = 1024 * 1024
+
+# ffmpeg output options per audio-only format; speech-tuned, mono
+TRANSCODE_FORMATS = {
+    "opus": ["-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg"],
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "48k", "-f", "mp3"],
+}
+
+
+class RecordingDownloadError(Exception):
+    pass
+
+
+@dataclass
+class RecordingFile:
+    path: str
+    size: int
+    sha256: str
+
+
+def _fsync_dir(path: str) -> None:
+    # makes the rename itself durable; not supported on every platform
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _finish_file(f, part_path: str, path: str) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(part_path, path)
+    _fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+
+def write_checksum(path: str, sha256: str) -> None:
+    with open(path + ".sha256", "w") as f:
+        f.write(f"{sha256}  {os.path.basename(path)}\n")
+
+
+async def download_recording(url: str, dest_dir: str = RECORDINGS_DIR, filename: Optional[str] = None,
+                             headers: Optional[Dict[str, str]] = None, chunk_size: int = CHUNK_SIZE,
+                             session: Optional[aiohttp.ClientSession] = None,
+                             timeout: float = 600.0) -> RecordingFile:
+    """
+    Streams `url` to `dest_dir/filename` and returns its path, size and SHA-256.
+    Raises RecordingDownloadError on HTTP errors or a short body.
+    """
+    filename = filename or f"call_recording_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, filename)
+    part_path = path + ".part"
+
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout))
+    digest = hashlib.sha256()
+    size = 0
+    f = open(part_path, "wb")
+    try:
+        async with session.get(url, headers=headers) as response:
+            if response.status != 200:
+                raise RecordingDownloadError(f"GET {url} returned {response.status}")
+            async for chunk in response.content.iter_chunked(chunk_size):
+                digest.update(chunk)
+                size += len(chunk)
+                await asyncio.to_thread(f.write, chunk)
+            # Content-Length counts encoded bytes, so only check unencoded bodies
+            if (response.content_length is not None and "Content-Encoding" not in response.headers
+                    and size != response.content_length):
+                raise RecordingDownloadError(f"expected {response.content_length} bytes, got {size}")
+        await asyncio.to_thread(_finish_file, f, part_path, path)
+    except BaseException as e:
+        f.close()
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        if isinstance(e, aiohttp.ClientError):
+            raise RecordingDownloadError(f"downloading {url} failed: {e}") from e
+        raise
+    finally:
+        if own_session:
+            await session.close()
+
+    recording = RecordingFile(path, size, digest.hexdigest())
+    await asyncio.to_thread(write_checksum, path, recording.sha256)
+    logger.info(f"Recording saved as {path} ({size} bytes, sha256 {recording.sha256})")
+    return recording
+
+
+def transcode_in_background(path: str, fmt: str = "opus", keep_source: bool = True) -> subprocess.Popen:
+    """Starts a detached transcode of `path`; returns without waiting for it."""
+    if fmt not in TRANSCODE_FORMATS:
+        raise ValueError(f"unsupported format {fmt!r}, expected one of {sorted(TRANSCODE_FORMATS)}")
+    args = [sys.executable, os.path.abspath(__file__), "transcode", path, "--format", fmt]
+    if not keep_source:
+        args.append("--delete-source")
+    return subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def transcode(path: str, fmt: str = "opus", keep_source: bool = True) -> RecordingFile:
+    """Audio-only transcode with ffmpeg, written through a `.part` file and renamed like downloads."""
+    out_path = os.path.splitext(path)[0] + "." + ("ogg" if fmt == "opus" else fmt)
+    part_path = out_path + ".part"
+    try:
+        subprocess.run(
+            ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+             "-i", path, "-vn", "-ac", "1", *TRANSCODE_FORMATS[fmt], part_path],
+            check=True,
+        )
+        digest = hashlib.sha256()
+        with open(part_path, "rb+") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+            size = f.tell()
+            _finish_file(f, part_path, out_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    write_checksum(out_path, digest.hexdigest())
+    if not keep_source:
+        os.remove(path)
+        if os.path.exists(path + ".sha256"):
+            os.remove(path + ".sha256")
+    return RecordingFile(out_path, size, digest.hexdigest())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Transcode a call recording to an audio-only file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    transcode_parser = subparsers.add_parser("transcode")
+    transcode_parser.add_argument("path")
+    transcode_parser.add_argument("--format", choices=sorted(TRANSCODE_FORMATS), default="opus")
+    transcode_parser.add_argument("--delete-source", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # yield the CPU to live calls on the same host
+    if hasattr(os, "nice"):
+        os.nice(10)
+    result = transcode(args.path, args.format, keep_source=not args.delete_source)
+    logger.info(f"Transcoded {args.path} to {result.path} ({result.size} bytes)")
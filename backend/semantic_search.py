@@ -0,0 +1,236 @@
+# semantic_search.py
+"""
+Embedding search over complaint descriptions and call transcripts.
+
+Each source gets its own FAISS inner-product index over L2-normalised
+embeddings (so scores are cosine similarities), keyed by the row's primary
+key. Indexes are persisted under ./STORAGE/semantic and extended
+incrementally: a refresh only embeds rows whose id is above the last indexed
+id, so adding new complaints never rebuilds the index.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+from database import DatabaseManager
+
+load_dotenv()
+genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+
+logger = logging.getLogger("semantic-search")
+
+EMBEDDING_MODEL = "models/embedding-001"
+SEMANTIC_STORAGE_DIR = "./STORAGE/semantic"
+SOURCES = ("complaints", "transcripts")
+
+EMBED_BATCH_SIZE = 100
+# Embedding inputs are capped; long transcripts are represented by their opening
+MAX_EMBED_CHARS = 8000
+SNIPPET_CHARS = 300
+
+
+def embed_texts(texts: List[str], task_type: str) -> np.ndarray:
+    """Embeds texts in batches and returns L2-normalised float32 vectors."""
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = [t[:MAX_EMBED_CHARS] for t in texts[start:start + EMBED_BATCH_SIZE]]
+        response = genai.embed_content(model=EMBEDDING_MODEL, content=batch, task_type=task_type)
+        vectors.extend(response["embedding"])
+    matrix = np.array(vectors, dtype="float32")
+    faiss.normalize_L2(matrix)
+    return matrix
+
+
+class SemanticIndex:
+    """A persisted id-mapped FAISS index for one source table."""
+
+    def __init__(self, name: str, persist_dir: str = SEMANTIC_STORAGE_DIR):
+        self.name = name
+        self.index_path = os.path.join(persist_dir, f"{name}.index")
+        self.meta_path = os.path.join(persist_dir, f"{name}.json")
+        self.persist_dir = persist_dir
+        self.index: Optional[faiss.Index] = None
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        if not (os.path.exists(self.index_path) and os.path.exists(self.meta_path)):
+            return
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        self.index = faiss.read_index(self.index_path)
+        self.last_id = meta.get("last_id", 0)
+
+    def save(self) -> None:
+        os.makedirs(self.persist_dir, exist_ok=True)
+        with self.lock:
+            if self.index is None:
+                return
+            tmp_index = self.index_path + ".tmp"
+            faiss.write_index(self.index, tmp_index)
+            os.replace(tmp_index, self.index_path)
+            with open(self.meta_path + ".tmp", "w") as f:
+                json.dump({"last_id": self.last_id, "size": self.index.ntotal}, f)
+            os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def add(self, ids: List[int], vectors: np.ndarray) -> None:
+        with self.lock:
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+            self.index.add_with_ids(vectors, np.array(ids, dtype="int64"))
+            self.last_id = max(self.last_id, max(ids))
+
+    def search(self, vector: np.ndarray, k: int) -> List[tuple]:
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return []
+            scores, ids = self.index.search(vector.reshape(1, -1), min(k, self.index.ntotal))
+        return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+
+    def vector_for(self, row_id: int) -> Optional[np.ndarray]:
+        with self.lock:
+            if self.index is None:
+                return None
+            try:
+                return self.index.reconstruct(int(row_id))
+            except RuntimeError:
+                return None
+
+    @property
+    def size(self) -> int:
+        return self.index.ntotal if self.index is not None else 0
+
+
+class SemanticSearch:
+    """
+    Semantic search over complaints and transcripts.
+
+    Searches never wait on indexing: a stale index triggers a background
+    refresh and the query is answered from what is already indexed. Query
+    embeddings are cached, so repeated searches skip the embedding call.
+    """
+
+    def __init__(self, db: DatabaseManager, persist_dir: str = SEMANTIC_STORAGE_DIR,
+                 refresh_interval: float = 30.0, query_cache_size: int = 256):
+        self.db = db
+        self.indexes = {source: SemanticIndex(source, persist_dir) for source in SOURCES}
+        self.refresh_interval = refresh_interval
+        self.query_cache_size = query_cache_size
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0.0
+
+    def load(self) -> None:
+        for index in self.indexes.values():
+            try:
+                index.load()
+            except Exception as e:
+                logger.error(f"Could not load semantic index '{index.name}', it will be rebuilt: {e}")
+
+    def refresh(self) -> Dict[str, int]:
+        """Embeds and indexes rows added since the last refresh. Returns rows added per source."""
+        added = {}
+        with self._refresh_lock:
+            for source, index in self.indexes.items():
+                added[source] = 0
+                while True:
+                    batch = self.db.get_semantic_rows_after(source, index.last_id)
+                    if not batch:
+                        break
+                    rows = [r for r in batch if r["text"]]
+                    if rows:
+                        vectors = embed_texts([r["text"] for r in rows], task_type="retrieval_document")
+                        index.add([r["id"] for r in rows], vectors)
+                        added[source] += len(rows)
+                    # Empty rows are skipped for good rather than re-read on every refresh
+                    index.last_id = max(index.last_id, batch[-1]["id"])
+                if added[source]:
+                    index.save()
+            self._last_refresh = time.monotonic()
+        if any(added.values()):
+            logger.info(f"Semantic index refreshed: {added}")
+        return added
+
+    def refresh_in_background(self) -> None:
+        """Starts a refresh on a daemon thread unless one is already running."""
+        if self._refresh_lock.locked():
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Semantic index refresh failed: {e}")
+
+        threading.Thread(target=run, name="semantic-refresh", daemon=True).start()
+
+    def _maybe_refresh(self) -> None:
+        if time.monotonic() - self._last_refresh > self.refresh_interval:
+            self.refresh_in_background()
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        key = " ".join(query.lower().split())
+        with self._cache_lock:
+            if key in self._query_cache:
+                self._query_cache.move_to_end(key)
+                return self._query_cache[key]
+        vector = embed_texts([query], task_type="retrieval_query")[0]
+        with self._cache_lock:
+            self._query_cache[key] = vector
+            if len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def search(self, query: str, sources: List[str] = SOURCES, k: int = 5) -> List[Dict]:
+        """Returns the top-k rows across the requested sources, best first."""
+        self._maybe_refresh()
+        return self._search_vector(self._embed_query(query), sources, k)
+
+    def similar_to_complaint(self, complaint_id: int, sources: List[str] = SOURCES, k: int = 5) -> Optional[List[Dict]]:
+        """Finds rows similar to an indexed complaint. Returns None if it is not indexed yet."""
+        self._maybe_refresh()
+        vector = self.indexes["complaints"].vector_for(complaint_id)
+        if vector is None:
+            return None
+        results = self._search_vector(vector, sources, k + 1)
+        return [r for r in results if not (r["source"] == "complaints" and r["id"] == complaint_id)][:k]
+
+    def _search_vector(self, vector: np.ndarray, sources: List[str], k: int) -> List[Dict]:
+        hits = []
+        for source in sources:
+            hits.extend((source, row_id, score) for row_id, score in self.indexes[source].search(vector, k))
+        hits.sort(key=lambda hit: hit[2], reverse=True)
+        hits = hits[:k]
+
+        rows = {
+            source: self.db.get_semantic_rows_by_ids(source, [row_id for s, row_id, _ in hits if s == source])
+            for source in sources
+        }
+        results = []
+        for source, row_id, score in hits:
+            row = rows[source].get(row_id)
+            if row is None:
+                continue
+            row = dict(row)
+            text = row.pop("text") or ""
+            results.append({
+                "source": source,
+                "id": row_id,
+                "score": round(score, 4),
+                "snippet": text[:SNIPPET_CHARS],
+                **row,
+            })
+        return results
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: {"size": index.size, "last_id": index.last_id} for name, index in self.indexes.items()}
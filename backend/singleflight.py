@@ -0,0 +1,92 @@
+# singleflight.py
+"""
+Request coalescing for expensive, repeatable calls.
+
+During an outage many customers file near-identical complaints within
+seconds, and each one would send the same prompts to the LLM. SingleFlight
+runs one call per key at a time: concurrent callers with the same key wait
+for the first one and share its result (or its exception). Successful
+results are also kept in a short TTL cache, so a burst spread over a few
+seconds still costs one upstream call. Failures are never cached.
+
+Keys are usually built with normalized_key, which ignores case, punctuation
+and spacing differences in the input text.
+"""
+import hashlib
+import os
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from cachetools import TTLCache
+
+CACHE_TTL = float(os.getenv("COALESCE_CACHE_TTL_SECONDS", "60"))
+CACHE_SIZE = int(os.getenv("COALESCE_CACHE_SIZE", "1024"))
+
+def _normalize(text: str) -> str:
+    # letters, combining marks (Indic vowel signs) and digits of any script are
+    # kept; punctuation, symbols and whitespace runs become one space
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join("".join(c if unicodedata.category(c)[0] in "LMN" else " " for c in text).split())
+
+
+def normalized_key(*parts: Any) -> str:
+    """Hash of the parts, case-folded with punctuation and whitespace runs collapsed."""
+    text = "\x1f".join(_normalize(str(part)) for part in parts)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Thread-safe; use one instance per kind of call so keys cannot collide."""
+
+    def __init__(self, ttl: float = CACHE_TTL, maxsize: int = CACHE_SIZE):
+        # ttl=0 only coalesces in-flight calls
+        self._cache: Optional[TTLCache] = TTLCache(maxsize, ttl) if ttl > 0 else None
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """Returns fn(*args, **kwargs), computed at most once per key among concurrent and recent callers."""
+        with self._lock:
+            if self._cache is not None and key in self._cache:
+                self.hits += 1
+                return self._cache[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None and self._cache is not None:
+                    self._cache[key] = call.result
+            call.done.set()
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "shared": self.shared, "misses": self.misses}
@@ -0,0 +1,72 @@
+"""
+Tokenizer and ranking of the local BM25 index.
+
+    cd backend && python -m pytest tests/test_bm25.py
+"""
+import tempfile
+import unittest
+
+from bm25 import BM25Index, tokenize
+
+CHUNKS = [
+    "To raise a bill dispute, share the invoice number and the charge amount with support.",
+    "Resetting the router: hold the reset button for ten seconds until the lights blink.",
+    "Late payment charges are added to the next bill after the due date.",
+    "New connections are installed within three working days of the address check.",
+    "Routers lose their settings after a factory reset; reconfigure the WiFi name afterwards.",
+]
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_inflections_meet(self):
+        for forms in (
+            ("dispute", "disputes", "disputed", "disputing"),
+            ("charge", "charges", "charged", "charging"),
+            ("route", "routes", "routing"),
+            ("router", "routers"),
+            ("reset", "resets", "resetting"),
+            ("bill", "bills", "billing", "billed"),
+            ("fee", "fees"),
+            ("reply", "replies"),
+            ("address", "addresses"),
+        ):
+            stems = {tuple(tokenize(form)) for form in forms}
+            self.assertEqual(len(stems), 1, f"{forms} -> {stems}")
+
+    def test_short_words_and_stopwords(self):
+        self.assertEqual(tokenize("The string is on the bus"), ["string", "bus"])
+        self.assertEqual(tokenize("Speed: 100 Mbit!"), ["speed", "100", "mbit"])
+
+
+class BM25IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = BM25Index.build(CHUNKS)
+
+    def test_plural_query_finds_singular_text(self):
+        results = self.index.search("bill disputes", top_k=2)
+        self.assertEqual(results[0][0], 0)
+        self.assertEqual(self.index.coverage("bill disputes", 0), 1.0)
+        self.assertTrue(self.index.is_confident("bill disputes", results))
+
+    def test_ranking(self):
+        self.assertEqual([doc for doc, _ in self.index.search("reset router", top_k=2)], [1, 4])
+        self.assertEqual(self.index.search("late charge")[0][0], 2)
+        self.assertEqual(self.index.search("install new connection")[0][0], 3)
+        self.assertEqual(self.index.search("unrelated words"), [])
+
+    def test_ambiguous_query_is_not_confident(self):
+        results = self.index.search("charges")
+        self.assertFalse(self.index.is_confident("charges", results))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.index.source_hash = "abc"
+            self.index.save(f"{tmp}/bm25")
+            loaded = BM25Index.load(f"{tmp}/bm25")
+            self.assertEqual(loaded.source_hash, "abc")
+            self.assertEqual(loaded.tokenizer_version, self.index.tokenizer_version)
+            self.assertEqual(loaded.search("bill dispute"), self.index.search("bill dispute"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+LLMGateway against a local OpenAI-compatible stub server.
+
+    cd backend && python -m pytest tests/test_llm_gateway.py
+"""
+import json
+import threading
+import time
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import llm_gateway
+from llm_gateway import LLMError, LLMGateway, Provider
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Behaviour is picked by the request's model name:
+
+        ok           answers at once
+        flaky        503 for the first two requests, then answers
+        ratelimited  429 with Retry-After: 0.2 for the first request, then answers
+        bad          400
+        dead         500
+    Setting server.stall_next makes the next request take STALL_SECONDS.
+    """
+
+    STALL_SECONDS = 2.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        model = body["model"]
+        with self.server.lock:
+            self.server.requests[model] += 1
+            count = self.server.requests[model]
+            stall, self.server.stall_next = self.server.stall_next, False
+
+        status, headers = 200, {}
+        if model == "flaky" and count <= 2:
+            status = 503
+        elif model == "ratelimited" and count == 1:
+            status, headers = 429, {"Retry-After": "0.2"}
+        elif model == "bad":
+            status = 400
+        elif model == "dead":
+            status = 500
+        if stall:
+            time.sleep(self.STALL_SECONDS)
+
+        payload = json.dumps({
+            "choices": [{"message": {"role": "assistant", "content": f"{model} {count}"}}],
+            "usage": {"total_tokens": 10},
+        }).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class LLMGatewayTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/v1"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests = Counter()
+        self.server.stall_next = False
+        # fast backoff, no hedging unless a test enables it
+        patches = [
+            mock.patch.object(llm_gateway, "BACKOFF_BASE", 0.01),
+            mock.patch.object(llm_gateway, "HEDGE_MIN_SAMPLES", 0),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def gateway(self, *models):
+        """A gateway with one stub provider per entry; a model overrides the caller's model."""
+        providers = [Provider(f"stub{i}", self.base_url, "test-key", model=model,
+                              requests_per_minute=6000, tokens_per_minute=100000)
+                     for i, model in enumerate(models or [None])]
+        gateway = LLMGateway(providers)
+        self.addCleanup(gateway.close)
+        return gateway
+
+    def chat(self, gateway, model, **params):
+        return gateway.chat([{"role": "user", "content": "hi"}], model=model, **params)
+
+    def test_retries_503(self):
+        self.assertEqual(self.chat(self.gateway(), "flaky"), "flaky 3")
+        self.assertEqual(self.server.requests["flaky"], 3)
+
+    def test_retries_429_after_retry_after(self):
+        start = time.monotonic()
+        self.assertEqual(self.chat(self.gateway(), "ratelimited"), "ratelimited 2")
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_does_not_retry_or_fall_back_on_400(self):
+        gateway = self.gateway(None, "ok")
+        with self.assertRaises(LLMError) as raised:
+            self.chat(gateway, "bad")
+        self.assertEqual(raised.exception.status, 400)
+        self.assertEqual(self.server.requests, Counter({"bad": 1}))
+
+    def test_falls_back_to_next_provider(self):
+        gateway = self.gateway("dead", "ok")
+        self.assertEqual(self.chat(gateway, "anything"), "ok 1")
+        self.assertEqual(self.server.requests["dead"], llm_gateway.MAX_RETRIES + 1)
+
+    def test_hedges_slow_request(self):
+        gateway = self.gateway()
+        with mock.patch.object(llm_gateway, "HEDGE_MIN_SAMPLES", 5):
+            for _ in range(5):
+                self.chat(gateway, "ok", max_tokens=5)
+            self.server.stall_next = True
+            start = time.monotonic()
+            self.chat(gateway, "ok", max_tokens=5)
+            elapsed = time.monotonic() - start
+        self.assertLess(elapsed, StubHandler.STALL_SECONDS / 2)
+        # the stalled original and its hedge
+        self.assertEqual(self.server.requests["ok"], 7)
+
+    def test_refunds_unused_token_reservation(self):
+        gateway = self.gateway()
+        bucket = gateway.providers[0].tokens
+        before = bucket.capacity
+        self.chat(gateway, "ok", max_tokens=512)
+        # the stub reports 10 tokens used; the rest of the 512+ reservation is returned
+        self.assertGreaterEqual(bucket._tokens, before - 10 - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
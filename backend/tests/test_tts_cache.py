@@ -0,0 +1,87 @@
+"""
+CachedTTS behind the pipeline's sentence-splitting StreamAdapter.
+
+    cd backend && python -m pytest tests/test_tts_cache.py
+"""
+import tempfile
+import unittest
+
+from livekit import rtc
+from livekit.agents import DEFAULT_API_CONNECT_OPTIONS, tokenize, tts, utils
+
+from tts_cache import CLOSING_PHRASE, FIXED_PHRASES, CachedTTS, PhraseAudioCache
+
+SAMPLE_RATE = 16000
+
+
+class FakeTTS(tts.TTS):
+    """Answers every sentence with 100 ms of silence and remembers what it was asked."""
+
+    def __init__(self):
+        super().__init__(capabilities=tts.TTSCapabilities(streaming=False), sample_rate=SAMPLE_RATE, num_channels=1)
+        self.requests = []
+
+    def synthesize(self, text, *, conn_options=DEFAULT_API_CONNECT_OPTIONS):
+        self.requests.append(text)
+        return FakeChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+
+class FakeChunkedStream(tts.ChunkedStream):
+    async def _run(self):
+        samples = SAMPLE_RATE // 10
+        frame = rtc.AudioFrame(data=b"\x00\x00" * samples, sample_rate=SAMPLE_RATE,
+                               num_channels=1, samples_per_channel=samples)
+        self._event_ch.send_nowait(tts.SynthesizedAudio(request_id=utils.shortuuid(), frame=frame))
+
+
+class CachedTTSTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        self.cache = PhraseAudioCache(voice_id="fake", cache_dir=self.cache_dir.name)
+        self.inner = FakeTTS()
+        self.cached_tts = CachedTTS(self.inner, self.cache)
+
+    async def speak(self, text):
+        """Sends text the way VoicePipelineAgent does for LLM output; returns the frame count."""
+        adapter = tts.StreamAdapter(tts=self.cached_tts, sentence_tokenizer=tokenize.basic.SentenceTokenizer())
+        stream = adapter.stream()
+        stream.push_text(text)
+        stream.end_input()
+        frames = 0
+        async for _ in stream:
+            frames += 1
+        await stream.aclose()
+        return frames
+
+    def test_fixed_phrases_are_single_sentences(self):
+        tokenizer = tokenize.basic.SentenceTokenizer()
+        for phrase in FIXED_PHRASES:
+            self.assertEqual(tokenizer.tokenize(phrase), [phrase])
+
+    async def test_pinned_closing_phrase_hits_through_stream(self):
+        self.assertEqual(self.cache.load_pinned(FIXED_PHRASES), list(FIXED_PHRASES))
+        await self.cached_tts.render_fixed_phrases(self.cache.take_unrendered())
+        self.inner.requests.clear()
+
+        self.assertGreater(await self.speak(CLOSING_PHRASE), 0)
+        self.assertEqual(self.inner.requests, [])
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    async def test_unpinned_sentence_is_synthesized_once(self):
+        await self.speak("Your router will be replaced tomorrow.")
+        await self.speak("Your router will be replaced tomorrow.")
+        self.assertEqual(self.inner.requests, ["Your router will be replaced tomorrow."])
+
+    async def test_phrases_are_rendered_by_one_job(self):
+        self.cache.load_pinned(FIXED_PHRASES)
+        self.assertEqual(self.cache.take_unrendered(), list(FIXED_PHRASES))
+        self.assertEqual(self.cache.take_unrendered(), [])
+        # pinned phrases load from disk in the next process
+        await self.cached_tts.render_fixed_phrases(FIXED_PHRASES)
+        fresh = PhraseAudioCache(voice_id="fake", cache_dir=self.cache_dir.name)
+        self.assertEqual(fresh.load_pinned(FIXED_PHRASES), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+WhatsAppSender against a local fake Twilio.
+
+    cd backend && python -m pytest tests/test_whatsapp_outbox.py
+"""
+import json
+import threading
+import unittest
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from urllib.parse import parse_qs
+
+import aiohttp
+
+from agent_db import AgentDatabase
+from whatsapp_outbox import WhatsAppSender, parse_retry_after
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    """
+    Behaviour is picked by the destination number:
+
+        +911  201 with a SID
+        +912  201 without a SID
+        +913  429 with an HTTP-date Retry-After
+        +914  503 with an HTML body
+        +915  400 with a Twilio error
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        to_number = form["To"][0].removeprefix("whatsapp:")
+        with self.server.lock:
+            self.server.requests.append((self.path, form))
+
+        headers = {"Content-Type": "application/json"}
+        if to_number == "+911":
+            status, body = 201, json.dumps({"sid": "SM123", "status": "queued"})
+        elif to_number == "+912":
+            status, body = 201, json.dumps({"status": "queued"})
+        elif to_number == "+913":
+            status, body = 429, json.dumps({"code": 20429, "message": "Too Many Requests"})
+            headers["Retry-After"] = formatdate(time() + 30, usegmt=True)
+        elif to_number == "+914":
+            status, body = 503, "<html><body>Service Unavailable</body></html>"
+            headers["Content-Type"] = "text/html"
+        else:
+            status, body = 400, json.dumps({"code": 21211, "message": "Invalid 'To' Phone Number"})
+
+        payload = body.encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakePool:
+    """Records the UPDATEs the sender issues instead of running them."""
+
+    def __init__(self, error: Exception = None):
+        self.executed = []
+        self.error = error
+
+    async def execute(self, query, *args):
+        if self.error is not None:
+            raise self.error
+        self.executed.append((" ".join(query.split()), args))
+
+
+class WhatsAppSenderTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTwilioHandler)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    async def asyncSetUp(self):
+        self.server.requests = []
+        self.sender = WhatsAppSender(
+            db=AgentDatabase(connection_params={}), account_sid="AC123", auth_token="token",
+            api_base=f"http://127.0.0.1:{self.server.server_port}", rate_per_second=1000, burst=100,
+        )
+        self.session = aiohttp.ClientSession(auth=aiohttp.BasicAuth("AC123", "token"))
+        self.addAsyncCleanup(self.session.close)
+
+    async def deliver(self, to_number, pool=None):
+        pool = pool or FakePool()
+        row = {"id": 7, "to_number": to_number, "body": "Your complaint is resolved", "attempts": 1}
+        await self.sender._deliver(self.session, pool, row)
+        return pool.executed
+
+    async def test_sent(self):
+        [(query, args)] = await self.deliver("+911")
+        self.assertIn("status = 'sent'", query)
+        self.assertEqual(args, (7, "SM123"))
+        path, form = self.server.requests[0]
+        self.assertEqual(path, "/2010-04-01/Accounts/AC123/Messages.json")
+        self.assertEqual(form["To"], ["whatsapp:+911"])
+
+    async def test_accepted_without_sid_is_sent(self):
+        [(query, args)] = await self.deliver("+912")
+        self.assertIn("status = 'sent'", query)
+        self.assertEqual(args, (7, None))
+
+    async def test_429_retries_after_http_date(self):
+        [(query, args)] = await self.deliver("+913")
+        self.assertIn("status = 'pending'", query)
+        outbox_id, error, delay = args
+        self.assertEqual(error, "HTTP 429: Too Many Requests")
+        # ~30s from the header, with the sender's +-20% jitter
+        self.assertTrue(20 <= delay <= 37, delay)
+
+    async def test_html_5xx_is_retried(self):
+        [(query, args)] = await self.deliver("+914")
+        self.assertIn("status = 'pending'", query)
+        self.assertTrue(args[1].startswith("HTTP 503: <html>"), args[1])
+
+    async def test_4xx_fails_with_twilio_message(self):
+        [(query, args)] = await self.deliver("+915")
+        self.assertIn("status = 'failed'", query)
+        self.assertEqual(args, (7, "HTTP 400: Invalid 'To' Phone Number"))
+
+    async def test_database_error_does_not_escape(self):
+        self.assertEqual(await self.deliver("+911", FakePool(error=OSError("connection reset"))), [])
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("12"), 12.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+# token_count.py
+"""
+Token counting for prompt and context budgets, in the cl100k encoding used
+by the agents' OpenAI models. prompt_builder and call_agent both budget with
+these helpers, so their counts cannot drift apart. The encoding is loaded on
+first use and shared by the whole process.
+"""
+import tiktoken
+
+ENCODING_NAME = "cl100k_base"
+
+_encoding = None
+
+
+def get_encoding() -> tiktoken.Encoding:
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(ENCODING_NAME)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text))
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """The first `budget` tokens of `text`."""
+    encoding = get_encoding()
+    return encoding.decode(encoding.encode(text)[:budget])
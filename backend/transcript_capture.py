@@ -0,0 +1,110 @@
+# transcript_capture.py
+"""
+Records a voice call's transcript from the pipeline's speech events.
+
+VoicePipelineAgent emits user_speech_committed / agent_speech_committed with
+the final text of each turn. TranscriptRecorder appends those turns to an
+in-memory buffer (the event handlers never touch the database), flushes the
+buffer to the call's `messages` rows in batches while the call runs, and on
+close writes the remaining turns plus the full transcript to `transcripts`.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from livekit.agents import llm
+from livekit.agents.pipeline import VoicePipelineAgent
+
+from agent_db import AgentDatabase, DBLatencyStats
+
+logger = logging.getLogger("outbound-caller")
+
+SPEAKER_LABELS = {"user": "User", "agent": "Agent"}
+
+
+def _message_text(msg: llm.ChatMessage) -> str:
+    content = msg.content
+    if isinstance(content, list):
+        content = " ".join(part for part in content if isinstance(part, str))
+    return (content or "").strip()
+
+
+class TranscriptRecorder:
+    def __init__(self, db: AgentDatabase, phone_number: str, agent_name: str = "outbound-caller",
+                 stats: Optional[DBLatencyStats] = None, flush_interval: float = 5.0, max_batch: int = 20):
+        self.db = db
+        self.phone_number = phone_number
+        self.agent_name = agent_name
+        self.stats = stats
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self.call_id: Optional[str] = None
+        self.turns: List[Dict] = []
+        self._flushed = 0
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def attach(self, agent: VoicePipelineAgent) -> None:
+        """Subscribes to the agent's committed-speech events and starts the flush loop."""
+        agent.on("user_speech_committed", lambda msg: self.record("user", _message_text(msg)))
+        agent.on("agent_speech_committed", lambda msg: self.record("agent", _message_text(msg)))
+        agent.on("agent_speech_interrupted", lambda msg: self.record("agent", _message_text(msg)))
+        self._task = asyncio.create_task(self._run())
+
+    def record(self, sender: str, text: str) -> None:
+        if self._closed or not text:
+            return
+        self.turns.append({
+            "sender": sender,
+            "message": text,
+            "timestamp": datetime.now(),
+            # position in the call; lets a retried flush skip rows already stored
+            "client_message_id": str(len(self.turns)),
+        })
+        if len(self.turns) - self._flushed >= self.max_batch:
+            self._wakeup.set()
+
+    def transcript(self) -> str:
+        return "\n".join(f"{SPEAKER_LABELS[t['sender']]}: {t['message']}" for t in self.turns)
+
+    async def _run(self) -> None:
+        self.call_id = await self.db.start_call(self.agent_name, self.phone_number, self.stats)
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Writes turns recorded since the last successful flush; failed batches are retried next time."""
+        async with self._flush_lock:
+            if self.call_id is None or self._flushed == len(self.turns):
+                return
+            batch = self.turns[self._flushed:]
+            if await self.db.add_messages(self.call_id, batch, self.stats):
+                self._flushed += len(batch)
+
+    async def close(self) -> None:
+        """Final flush, then store the whole transcript and close the call row. Safe to call twice."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"transcript flush loop for {self.phone_number} failed: {e}")
+
+        await self.flush()
+        if self.turns:
+            await self.db.save_transcript(self.phone_number, self.transcript(), self.stats)
+        if self.call_id is not None:
+            await self.db.end_call(self.call_id, self.stats)
+        logger.info(f"saved {len(self.turns)} transcript turns for {self.phone_number}")
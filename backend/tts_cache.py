@@ -0,0 +1,245 @@
+# tts_cache.py
+"""
+Phrase-level TTS audio cache for the voice agents.
+
+VoicePipelineAgent feeds a non-streaming TTS one sentence at a time, so
+wrapping the TTS with CachedTTS caches audio per sentence. Fixed phrases (the
+greeting's static opening, the hold and closing lines) are pinned: rendered
+once, written under STORAGE/tts_cache and loaded into memory in prewarm, so
+they play without a TTS round-trip. The greeting's dynamic sentence is then
+synthesized while the cached opening is already playing.
+
+Other sentences are kept in an in-memory LRU bounded by total audio bytes.
+Pinned phrases are never evicted. Hits, misses and evictions are counted
+for the per-call summary.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from livekit import rtc
+from livekit.agents import DEFAULT_API_CONNECT_OPTIONS, APIConnectOptions, tts, utils
+
+logger = logging.getLogger("outbound-caller")
+
+TTS_CACHE_DIR = "./STORAGE/tts_cache"
+FRAME_MS = 100
+
+# LLM replies reach the TTS split by the pipeline's sentence tokenizer, so
+# each fixed phrase must be a single sentence to be found in the cache.
+# Spoken as the first sentence of every call; keep it free of per-call details
+GREETING_PREFIX = "Hello, this is the customer support team at Bharat Telecom."
+HOLD_PHRASE = "Please wait a moment while I check that for you."
+CLOSING_PHRASE = "Thank you for your time, and have a great day!"
+FIXED_PHRASES = (GREETING_PREFIX, HOLD_PHRASE, CLOSING_PHRASE)
+
+
+def greeting(name: str, complaint: str) -> str:
+    """
+    The per-call part of the greeting. Say GREETING_PREFIX first in its own
+    say() call: a string is synthesized as one piece, so the cached opening
+    is only a hit when spoken on its own.
+    """
+    return f"Am I speaking with {name}? I'm calling about your complaint: {complaint}."
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+@dataclass
+class CachedAudio:
+    pcm: bytes
+    sample_rate: int
+    num_channels: int
+
+    def frames(self) -> Iterable[rtc.AudioFrame]:
+        bytes_per_frame = self.sample_rate * FRAME_MS // 1000 * self.num_channels * 2
+        for start in range(0, len(self.pcm), bytes_per_frame):
+            chunk = self.pcm[start:start + bytes_per_frame]
+            yield rtc.AudioFrame(
+                data=chunk,
+                sample_rate=self.sample_rate,
+                num_channels=self.num_channels,
+                samples_per_channel=len(chunk) // (2 * self.num_channels),
+            )
+
+
+class PhraseAudioCache:
+    def __init__(self, voice_id: str, cache_dir: str = TTS_CACHE_DIR, max_bytes: int = 32 * 1024 * 1024):
+        self.voice_id = voice_id
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._pinned: Dict[str, CachedAudio] = {}
+        self._lru: "OrderedDict[str, CachedAudio]" = OrderedDict()
+        self._lru_bytes = 0
+        self._lock = threading.Lock()
+        # fixed phrases not found on disk, handed to one job for rendering
+        self._unrendered: List[str] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.voice_id}|{_normalize(text)}".encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".pcm", base + ".json"
+
+    def get(self, text: str) -> Optional[CachedAudio]:
+        key = self.key(text)
+        with self._lock:
+            audio = self._pinned.get(key)
+            if audio is None:
+                audio = self._lru.get(key)
+                if audio is not None:
+                    self._lru.move_to_end(key)
+            if audio is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return audio
+
+    def put(self, text: str, audio: CachedAudio) -> None:
+        key = self.key(text)
+        size = len(audio.pcm)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._pinned:
+                return
+            previous = self._lru.pop(key, None)
+            if previous is not None:
+                self._lru_bytes -= len(previous.pcm)
+            self._lru[key] = audio
+            self._lru_bytes += size
+            while self._lru_bytes > self.max_bytes:
+                _, evicted = self._lru.popitem(last=False)
+                self._lru_bytes -= len(evicted.pcm)
+                self.evictions += 1
+
+    def pin(self, text: str, audio: CachedAudio, persist: bool = True) -> None:
+        """Keeps a fixed phrase in memory for good and, by default, writes it to disk."""
+        key = self.key(text)
+        with self._lock:
+            self._pinned[key] = audio
+        if persist:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            pcm_path, meta_path = self._paths(key)
+            with open(pcm_path + ".tmp", "wb") as f:
+                f.write(audio.pcm)
+            os.replace(pcm_path + ".tmp", pcm_path)
+            with open(meta_path, "w") as f:
+                json.dump({"text": _normalize(text), "voice_id": self.voice_id,
+                           "sample_rate": audio.sample_rate, "num_channels": audio.num_channels}, f)
+
+    def load_pinned(self, texts: Iterable[str]) -> List[str]:
+        """Loads rendered fixed phrases from disk. Returns the phrases that still need rendering."""
+        missing = []
+        for text in texts:
+            pcm_path, meta_path = self._paths(self.key(text))
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                with open(pcm_path, "rb") as f:
+                    pcm = f.read()
+            except (OSError, ValueError):
+                missing.append(text)
+                continue
+            self.pin(text, CachedAudio(pcm, meta["sample_rate"], meta["num_channels"]), persist=False)
+        with self._lock:
+            self._unrendered = list(missing)
+        return missing
+
+    def take_unrendered(self) -> List[str]:
+        """The fixed phrases still to render, handed out once so only one job per process renders them."""
+        with self._lock:
+            texts, self._unrendered = self._unrendered, []
+        return texts
+
+    def return_unrendered(self, text: str) -> None:
+        """Gives a phrase that failed to render back, for the next job to retry."""
+        with self._lock:
+            self._unrendered.append(text)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "pinned": len(self._pinned),
+            "cached_bytes": self._lru_bytes,
+        }
+
+
+class CachedTTS(tts.TTS):
+    """Wraps a non-streaming TTS; sentences found in the cache skip synthesis."""
+
+    def __init__(self, inner: tts.TTS, cache: PhraseAudioCache):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False),
+            sample_rate=inner.sample_rate,
+            num_channels=inner.num_channels,
+        )
+        self.inner = inner
+        self.cache = cache
+
+    def synthesize(self, text: str, *,
+                   conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS) -> "CachedChunkedStream":
+        return CachedChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+    async def render_fixed_phrases(self, texts: Iterable[str]) -> None:
+        """Synthesizes and pins phrases not found on disk; meant to run in the background."""
+        for text in texts:
+            try:
+                self.cache.pin(text, await self._synthesize_uncached(text))
+                logger.info(f"rendered fixed phrase for the TTS cache: {text!r}")
+            except Exception as e:
+                logger.error(f"could not render fixed phrase {text!r}: {e}")
+                self.cache.return_unrendered(text)
+
+    async def _synthesize_uncached(self, text: str, on_frame=None) -> CachedAudio:
+        pcm = bytearray()
+        sample_rate, num_channels = self.sample_rate, self.num_channels
+        stream = self.inner.synthesize(text)
+        try:
+            async for audio in stream:
+                pcm.extend(audio.frame.data.tobytes())
+                sample_rate, num_channels = audio.frame.sample_rate, audio.frame.num_channels
+                if on_frame is not None:
+                    on_frame(audio.frame)
+        finally:
+            await stream.aclose()
+        return CachedAudio(bytes(pcm), sample_rate, num_channels)
+
+
+class CachedChunkedStream(tts.ChunkedStream):
+    def __init__(self, *, tts: CachedTTS, input_text: str,
+                 conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._cached_tts = tts
+
+    async def _run(self) -> None:
+        request_id = utils.shortuuid()
+        cache = self._cached_tts.cache
+
+        def send(frame: rtc.AudioFrame) -> None:
+            self._event_ch.send_nowait(tts.SynthesizedAudio(request_id=request_id, frame=frame))
+
+        audio = cache.get(self._input_text)
+        if audio is not None:
+            for frame in audio.frames():
+                send(frame)
+            return
+
+        # forward frames as they arrive so a miss costs no extra latency
+        audio = await self._cached_tts._synthesize_uncached(self._input_text, on_frame=send)
+        cache.put(self._input_text, audio)
@@ -0,0 +1,216 @@
+# whatsapp_outbox.py
+"""
+Delivers queued WhatsApp messages through the Twilio REST API.
+
+Agents only insert into `whatsapp_outbox` (AgentDatabase.enqueue_whatsapp), so
+a slow or failing Twilio never stalls a live call. WhatsAppSender runs as its
+own process:
+
+    python whatsapp_outbox.py
+
+It claims due rows with FOR UPDATE SKIP LOCKED (several senders can run side
+by side), posts them over one reused aiohttp session under a token-bucket
+rate limit, and retries 429/5xx/network failures with exponential backoff.
+Rows left in 'sending' by a crashed sender are reclaimed after a timeout.
+
+Set TWILIO_API_BASE to point the sender at a local fake Twilio for testing.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import aiohttp
+import asyncpg
+from dotenv import load_dotenv
+
+from agent_db import OUTBOX_CHANNEL, AgentDatabase
+from ratelimit import AsyncTokenBucket
+
+load_dotenv(".env.local")
+
+logger = logging.getLogger("whatsapp-outbox")
+
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com")
+TWILIO_WHATSAPP_FROM = os.getenv("TWILIO_WHATSAPP_FROM", "whatsapp:+14155238886")
+
+CLAIM_SQL = """
+    UPDATE whatsapp_outbox
+    SET status = 'sending', locked_at = NOW(), attempts = attempts + 1
+    WHERE id IN (
+        SELECT id FROM whatsapp_outbox
+        WHERE (status = 'pending' AND next_attempt_at <= NOW())
+           OR (status = 'sending' AND locked_at < NOW() - make_interval(secs => $2))
+        ORDER BY next_attempt_at
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, to_number, body, attempts
+"""
+
+
+class RetryableSendError(Exception):
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header in either delta-seconds or HTTP-date form."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class WhatsAppSender:
+    def __init__(self, db: Optional[AgentDatabase] = None,
+                 account_sid: Optional[str] = None, auth_token: Optional[str] = None,
+                 from_number: str = TWILIO_WHATSAPP_FROM, api_base: str = TWILIO_API_BASE,
+                 rate_per_second: float = 1.0, burst: int = 5, concurrency: int = 5,
+                 max_attempts: int = 6, base_backoff: float = 2.0, max_backoff: float = 300.0,
+                 poll_interval: float = 10.0, lock_timeout: float = 120.0, request_timeout: float = 15.0):
+        self.db = db or AgentDatabase()
+        self.account_sid = account_sid or os.getenv("TWILIO_ACCOUNT_SID")
+        self.auth_token = auth_token or os.getenv("TWILIO_AUTH_TOKEN")
+        self.from_number = from_number
+        self.messages_url = f"{api_base.rstrip('/')}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+        self.bucket = AsyncTokenBucket(rate_per_second, burst)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+        self.request_timeout = request_timeout
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Drains the outbox until stop() is called, waking on NOTIFY or every poll_interval."""
+        pool = await self.db.pool()
+        listener = await asyncpg.connect(**self.db.connection_params)
+        await listener.add_listener(OUTBOX_CHANNEL, lambda *_: self._wakeup.set())
+
+        session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(self.account_sid, self.auth_token),
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+        )
+        logger.info(f"WhatsApp sender started, posting to {self.messages_url}")
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                try:
+                    rows = await pool.fetch(CLAIM_SQL, self.concurrency, self.lock_timeout)
+                except Exception as e:
+                    logger.error(f"Could not claim outbox rows: {e}")
+                    rows = []
+                if rows:
+                    # _deliver logs its own errors; a row it could not update is reclaimed after lock_timeout
+                    await asyncio.gather(*(self._deliver(session, pool, row) for row in rows),
+                                         return_exceptions=True)
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await session.close()
+            await listener.close()
+            await self.db.close()
+
+    async def _deliver(self, session: aiohttp.ClientSession, pool: asyncpg.Pool, row: asyncpg.Record) -> None:
+        try:
+            try:
+                sid = await self._post(session, row["to_number"], row["body"])
+            except RetryableSendError as e:
+                await self._retry_or_fail(pool, row, str(e), e.retry_after)
+            except Exception as e:
+                await self._mark_failed(pool, row["id"], str(e))
+            else:
+                await pool.execute(
+                    """UPDATE whatsapp_outbox
+                       SET status = 'sent', provider_sid = $2, sent_at = NOW(), locked_at = NULL, last_error = NULL
+                       WHERE id = $1""",
+                    row["id"], sid,
+                )
+                logger.info(f"WhatsApp message {row['id']} sent to {row['to_number']} ({sid})")
+        except Exception as e:
+            # left in 'sending'; another pass reclaims it after lock_timeout
+            logger.error(f"Could not update WhatsApp message {row['id']}: {e}")
+
+    async def _post(self, session: aiohttp.ClientSession, to_number: str, body: str) -> Optional[str]:
+        """Sends one message and returns Twilio's message SID (None if an accepted reply lacks one)."""
+        await self.bucket.acquire()
+        data = {"From": self.from_number, "To": f"whatsapp:{to_number}", "Body": body}
+        try:
+            async with session.post(self.messages_url, data=data) as resp:
+                # error bodies from proxies and gateways are often HTML or empty
+                text = await resp.text()
+                try:
+                    payload = json.loads(text)
+                except ValueError:
+                    payload = None
+                if resp.status < 300:
+                    # Twilio accepted the message; a missing SID must not get it sent twice
+                    sid = payload.get("sid") if isinstance(payload, dict) else None
+                    if sid is None:
+                        logger.warning(f"Twilio accepted the message to {to_number} without a SID: {text[:200]}")
+                    return sid
+                detail = payload.get("message", text) if isinstance(payload, dict) else text[:200]
+                error = f"HTTP {resp.status}: {detail}"
+                if resp.status == 429 or resp.status >= 500:
+                    raise RetryableSendError(error, parse_retry_after(resp.headers.get("Retry-After")))
+                raise ValueError(error)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise RetryableSendError(f"{type(e).__name__}: {e}")
+
+    async def _retry_or_fail(self, pool: asyncpg.Pool, row: asyncpg.Record, error: str,
+                             retry_after: Optional[float]) -> None:
+        if row["attempts"] >= self.max_attempts:
+            await self._mark_failed(pool, row["id"], error)
+            return
+        delay = retry_after or min(self.max_backoff, self.base_backoff * 2 ** (row["attempts"] - 1))
+        delay *= random.uniform(0.8, 1.2)
+        await pool.execute(
+            """UPDATE whatsapp_outbox
+               SET status = 'pending', locked_at = NULL, last_error = $2,
+                   next_attempt_at = NOW() + make_interval(secs => $3)
+               WHERE id = $1""",
+            row["id"], error, delay,
+        )
+        logger.warning(f"WhatsApp message {row['id']} attempt {row['attempts']} failed, retrying in {delay:.0f}s: {error}")
+
+    async def _mark_failed(self, pool: asyncpg.Pool, outbox_id: int, error: str) -> None:
+        await pool.execute(
+            "UPDATE whatsapp_outbox SET status = 'failed', locked_at = NULL, last_error = $2 WHERE id = $1",
+            outbox_id, error,
+        )
+        logger.error(f"WhatsApp message {outbox_id} failed permanently: {error}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sender = WhatsAppSender(rate_per_second=float(os.getenv("WHATSAPP_RATE_PER_SECOND", "1")))
+    try:
+        asyncio.run(sender.run())
+    except KeyboardInterrupt:
+        pass